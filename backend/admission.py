@@ -0,0 +1,172 @@
+"""
+Admission control for expensive endpoints.
+
+Each class of heavy work (X-ray inference, report analysis, face matching,
+chat) gets its own concurrency limit and bounded queue, and all heavy
+classes together share a smaller pool than the server has, so cheap
+interactive routes such as login always find capacity. A request is shed
+with 503 and ``Retry-After`` as soon as its estimated queueing delay plus
+service time would exceed the class's latency budget, instead of waiting
+until the client times out.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any
+
+from fastapi import HTTPException
+
+logger = logging.getLogger("hospital_ai")
+
+# Weight of the newest sample in the service time average
+EWMA_ALPHA = 0.2
+
+
+class WorkClass:
+    """Concurrency, queue and latency budget for one kind of heavy request."""
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: int,
+        latency_budget: float,
+        initial_service_time: float
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.latency_budget = latency_budget
+        self.service_time = initial_service_time
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def estimated_wait(self) -> float:
+        """Expected seconds before a newly queued request starts running."""
+        busy = self.in_flight + self.waiting
+        if busy < self.max_concurrency:
+            return 0.0
+        # Requests ahead drain max_concurrency at a time
+        rounds = (busy - self.max_concurrency) // self.max_concurrency + 1
+        return rounds * self.service_time
+
+    def record(self, seconds: float):
+        self.service_time = (1 - EWMA_ALPHA) * self.service_time + EWMA_ALPHA * seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "latency_budget": self.latency_budget,
+            "service_time": round(self.service_time, 3),
+            "estimated_wait": round(self.estimated_wait(), 3),
+            "admitted": self.admitted,
+            "shed": self.shed
+        }
+
+
+class AdmissionController:
+    """Admits, queues or sheds heavy requests per work class."""
+
+    def __init__(self, heavy_capacity: int):
+        self.heavy_capacity = heavy_capacity
+        self.classes: Dict[str, WorkClass] = {}
+        self._heavy = asyncio.Semaphore(heavy_capacity)
+
+    def add_class(self, work_class: WorkClass):
+        self.classes[work_class.name] = work_class
+
+    def _reject(self, work_class: WorkClass, retry_after: float, reason: str):
+        work_class.shed += 1
+        logger.warning(f"Shedding {work_class.name} request: {reason}")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy processing other requests. Please try again shortly.",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    @asynccontextmanager
+    async def admit(self, name: str):
+        work_class = self.classes[name]
+        wait = work_class.estimated_wait()
+
+        if work_class.waiting >= work_class.max_queue:
+            self._reject(work_class, wait, "queue full")
+        if wait + work_class.service_time > work_class.latency_budget:
+            self._reject(work_class, wait, f"estimated latency {wait + work_class.service_time:.1f}s over budget")
+
+        # Wait for a class slot and a shared heavy slot, within what is left of the budget
+        work_class.waiting += 1
+        queued_at = time.monotonic()
+        acquired_class = False
+        try:
+            timeout = max(work_class.latency_budget - work_class.service_time, 0.1)
+            await asyncio.wait_for(work_class._semaphore.acquire(), timeout)
+            acquired_class = True
+            remaining = max(timeout - (time.monotonic() - queued_at), 0.1)
+            await asyncio.wait_for(self._heavy.acquire(), remaining)
+        except asyncio.TimeoutError:
+            if acquired_class:
+                work_class._semaphore.release()
+            self._reject(work_class, work_class.service_time, "timed out waiting for capacity")
+        except BaseException:
+            # Client went away while queued
+            if acquired_class:
+                work_class._semaphore.release()
+            raise
+        finally:
+            work_class.waiting -= 1
+
+        work_class.in_flight += 1
+        work_class.admitted += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            work_class.record(time.monotonic() - started)
+            work_class.in_flight -= 1
+            self._heavy.release()
+            work_class._semaphore.release()
+
+    def guard(self, name: str):
+        """FastAPI dependency that holds an admission slot for the request."""
+
+        async def dependency():
+            async with self.admit(name):
+                yield
+
+        return dependency
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "heavy_capacity": self.heavy_capacity,
+            "classes": {name: c.stats() for name, c in self.classes.items()}
+        }
+
+
+def work_class_from_env(
+    name: str,
+    max_concurrency: int,
+    max_queue: int,
+    latency_budget: float,
+    initial_service_time: float,
+    env: Optional[Dict[str, str]] = None
+) -> WorkClass:
+    """Build a work class, letting ADMISSION_<NAME>_* variables override the defaults."""
+    env = env if env is not None else os.environ
+    prefix = f"ADMISSION_{name.upper()}_"
+    return WorkClass(
+        name,
+        int(env.get(prefix + "CONCURRENCY", max_concurrency)),
+        int(env.get(prefix + "QUEUE", max_queue)),
+        float(env.get(prefix + "LATENCY_BUDGET", latency_budget)),
+        initial_service_time
+    )
@@ -1,7 +1,7 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Header, Request, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Header, Request, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from typing import Optional, Dict, Any, List, Union
 import os
@@ -11,28 +11,32 @@ import logging
 import uuid
 import json
 import re
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import jwt
 from passlib.context import CryptContext
 import pydantic
-from pymongo import MongoClient, errors, ASCENDING, DESCENDING
+from pymongo import MongoClient, errors
+from bson import ObjectId
+from bson.errors import InvalidId
 import asyncio
 import io
 from PIL import Image
 import pydicom
 from dotenv import load_dotenv
-import tempfile
 import shutil
 import hashlib
 import traceback
 import random
 import urllib.parse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import jwt as pyjwt
 from transformers import BlipProcessor, BlipForConditionalGeneration,AutoProcessor
 import torch
 import torchvision.transforms as transforms
 import timm
 import redis
+import redis.asyncio as redis_async
 import time
 import google.generativeai as genai
 from pydantic import BaseModel
@@ -43,13 +47,50 @@ from io import BytesIO
 import cv2
 from pytorch_grad_cam import GradCAM
 from transformers import AutoImageProcessor, AutoModelForImageClassification, BlipProcessor, BlipForConditionalGeneration
+# Load environment variables before the local modules below read their settings at import
+load_dotenv()
+from health_summary import (
+    HealthSummaryStore, SUMMARY_COLLECTION, calculate_bmi,
+    vital_risk_factors, history_risk_factors, bmi_risk_factors
+)
+from vitals_timeseries import (
+    VitalSignsTimeSeries, METRICS as VITAL_METRICS, WINDOWS as VITAL_WINDOWS, choose_window, window_ceiling
+)
+from vitals_ingest import (
+    MAX_BATCH_BODY, MAX_REJECTION_DETAILS, BatchFormatError, parse_batch_body, validate_batch
+)
+from vitals_stream import VitalsStreamHub
+from vitals_trends import VitalTrendAnalyzer
+from appointment_slots import (
+    AppointmentSlotEngine, SlotUnavailableError, SLOTS_COLLECTION, SLOT_INDEX, SLOT_TIMES, SLOT_MINUTES
+)
+from doctor_directory import DoctorDirectory
+from doctor_search import DoctorSearchIndex
+from pagination import InvalidCursorError, keyset_page, DEFAULT_PAGE_SIZE
+from migrations import run_migrations
+from serialization import MongoJSONResponse, to_jsonable
+from admission import AdmissionController, work_class_from_env
+from cache import TwoTierCache
+from chat_sessions import ChatSessionStore, cap_messages
+from chat_prompt import PromptBuilder
+from chat_stream import FINAL_MARKER, DiagnosisStreamParser, parse_final_json, sse_event
+from gemini_gateway import GeminiGateway, GeminiUnavailableError, backend_from_env
+import lab_panel
+from document_extraction import DocumentExtractor
+from ocr_service import OcrService, OcrBusyError
+from aadhaar_ocr import extract_aadhaar, mask_aadhaar, aadhaar_fingerprint
+from uploads import UploadSizeLimitMiddleware, MULTIPART_OVERHEAD, ingest_upload
+from blob_store import BlobStore, LocalBlobBackend
+from xray_inference import InferenceError, ModelUnavailableError, analyze_xray_image, decode_xray
+from rate_limiter import RateLimiter, RateLimitRule, build_checks, client_identity, is_exempt
+from request_models import (
+    LoginRequest, RegisterRequest, MedicalHistoryRequest, VitalSignsRequest, BookAppointmentRequest,
+    HealthAssessmentRequest, MAX_ASSESSMENT_BODY, json_body, parse_model, read_body
+)
 API_KEY = os.getenv("GEMINI_API_KEY", "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")  # Replace with your actual key in production
 genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash') 
-# Load environment variables
-load_dotenv()
-# In-memory storage for conversation histories (keyed by session token)
-conversations: Dict[str, List[Dict[str, str]]] = {}
+# Every Gemini call goes through the gateway: bounded concurrency, retries and a circuit breaker
+gemini = GeminiGateway(backend_from_env())
 
 # Request model
 class ChatRequest(BaseModel):
@@ -125,8 +166,8 @@ class Settings:
     
     # Security settings
     PASSWORD_MIN_LENGTH = int(os.getenv("PASSWORD_MIN_LENGTH", "8"))
-    RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "100"))
-    RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "3600"))  # 1 hour
+    RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "120"))  # Budget units per window
+    RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))  # 1 minute
     
     # Ensure directories exist
     os.makedirs(STATIC_DIR, exist_ok=True)
@@ -134,10 +175,8 @@ class Settings:
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     
     # Create subdirectories for different file types
-    os.makedirs(os.path.join(UPLOAD_DIR, "blood_reports"), exist_ok=True)
     os.makedirs(os.path.join(UPLOAD_DIR, "xrays"), exist_ok=True)
     os.makedirs(os.path.join(UPLOAD_DIR, "documents"), exist_ok=True)
-    os.makedirs(os.path.join(UPLOAD_DIR, "aadhaar"), exist_ok=True)
 
 settings = Settings()
 
@@ -147,9 +186,13 @@ app = FastAPI(
     description="API for hospital management with AI-powered medical analysis",
     version="3.0.0",
     docs_url="/api/docs" if os.getenv("ENVIRONMENT") != "production" else None,
-    redoc_url="/api/redoc" if os.getenv("ENVIRONMENT") != "production" else None
+    redoc_url="/api/redoc" if os.getenv("ENVIRONMENT") != "production" else None,
+    default_response_class=MongoJSONResponse
 )
 
+# Refuse oversized upload bodies before they are buffered; added first so CORS wraps its 413s
+app.add_middleware(UploadSizeLimitMiddleware, max_body=settings.MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -157,6 +200,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy", "Retry-After"],
 )
 def calculate_severity(findings: list) -> int:
     """Calculate severity score based on findings"""
@@ -170,42 +214,77 @@ def calculate_severity(findings: list) -> int:
         severity_score += severity_contribution
     
     return min(round(severity_score), 10)
+# Async Redis connection shared by the rate limiter and the cache
+redis_async_client = redis_async.Redis(
+    host=os.getenv("REDIS_HOST", "localhost"),
+    port=int(os.getenv("REDIS_PORT", 6379)),
+    db=int(os.getenv("REDIS_DB", 0)),
+    socket_connect_timeout=2,
+    socket_timeout=2
+) if redis_available else None
+
+# Two-tier (in-process LRU + Redis) cache for expensive lookups
+cache = TwoTierCache(redis_async_client)
+
+# Chat sessions shared by all workers, with a bounded local fallback
+chat_sessions = ChatSessionStore(redis_async_client)
+
 # Rate limiting middleware
-# In-memory rate limiting (for testing purposes)
-rate_limit = {}
-RATE_LIMIT_REQUESTS = 10  # Max requests allowed
-RATE_LIMIT_WINDOW = timedelta(minutes=1)  # Time window for rate limiting
+# Token buckets shared across workers through Redis, with a bounded local fallback
+rate_limiter = RateLimiter(redis_async_client)
+default_rate_limit = RateLimitRule("requests", settings.RATE_LIMIT_REQUESTS, settings.RATE_LIMIT_WINDOW)
 
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
-    # Get client IP (consider proxies)
-    client_ip = request.headers.get("x-forwarded-for", request.client.host)
+    path = request.url.path
+    client_host = request.client.host if request.client else None
+    
+    forwarded_for = request.headers.get("x-forwarded-for")
     
-    # Skip rate limiting for internal requests or when testing
-    if client_ip == "127.0.0.1" or os.getenv("ENVIRONMENT") == "test":
+    # Skip rate limiting for internal requests or when testing; proxied requests
+    # also arrive from loopback, so only those without X-Forwarded-For are internal
+    internal = client_host == "127.0.0.1" and not forwarded_for
+    if internal or os.getenv("ENVIRONMENT") == "test" or is_exempt(path, request.method):
         return await call_next(request)
-
-    # Rate limit logic
-    current_time = datetime.utcnow()
-    if client_ip not in rate_limit:
-        rate_limit[client_ip] = {"count": 1, "start_time": current_time}
-    else:
-        elapsed_time = current_time - rate_limit[client_ip]["start_time"]
-        if elapsed_time > RATE_LIMIT_WINDOW:
-            rate_limit[client_ip] = {"count": 1, "start_time": current_time}
-        else:
-            rate_limit[client_ip]["count"] += 1
-
-    # Check rate limit
-    if rate_limit[client_ip]["count"] > RATE_LIMIT_REQUESTS:
+    
+    # Authenticated callers get their own budget; anyone else is limited by IP
+    user_email = None
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        try:
+            user_email = decode_access_token(authorization[7:])["email"]
+        except Exception:
+            pass
+    identity = client_identity(forwarded_for, client_host, user_email)
+    
+    result = await rate_limiter.hit(build_checks(identity, path, default_rate_limit))
+    if not result.allowed:
         return JSONResponse(
             status_code=429,
-            content={"detail": "Too many requests. Please try again later."}
+            content={"detail": "Too many requests. Please try again later."},
+            headers=result.headers()
         )
-
+    
     # Call next middleware/route
     response = await call_next(request)
+    response.headers.update(result.headers())
     return response
+# Admission control for ML-heavy routes. Heavy classes share fewer slots than
+# the server has, so interactive routes keep capacity during spikes.
+admission = AdmissionController(int(os.getenv("ADMISSION_HEAVY_CAPACITY", "6")))
+admission.add_class(work_class_from_env("xray", max_concurrency=2, max_queue=8, latency_budget=30, initial_service_time=8))
+admission.add_class(work_class_from_env("blood_report", max_concurrency=2, max_queue=8, latency_budget=30, initial_service_time=6))
+admission.add_class(work_class_from_env("face", max_concurrency=3, max_queue=12, latency_budget=10, initial_service_time=1.5))
+admission.add_class(work_class_from_env("chat", max_concurrency=4, max_queue=32, latency_budget=20, initial_service_time=3))
+
+# Bounded thread pool for image decoding and model inference, so that CPU-bound
+# work in X-ray and face routes never runs on the event loop
+ml_executor = ThreadPoolExecutor(max_workers=int(os.getenv("ML_WORKERS", "4")), thread_name_prefix="ml")
+
+@app.on_event("shutdown")
+async def stop_ml_executor():
+    ml_executor.shutdown(wait=False, cancel_futures=True)
+
 # Mount static files directory
 app.mount("/static", StaticFiles(directory=settings.STATIC_DIR), name="static")
 
@@ -488,25 +567,36 @@ try:
     appointments_collection = db["appointments"]
     health_assessments_collection = db["health_assessments"]
     audit_logs_collection = db["audit_logs"]
+    health_summary_collection = db[SUMMARY_COLLECTION]
 
     
         
     
     
     # seed_doctors_data()
-    # Ensure indexes for performance and constraints
-    users_collection.create_index([("email", ASCENDING)], unique=True)
-    users_collection.create_index([("created_at", DESCENDING)])
+    # Collections and indexes are managed by versioned migrations
+    if os.getenv("RUN_MIGRATIONS_ON_STARTUP", "true").lower() == "true":
+        run_migrations(db)
+    
+    # Materialized per-user summary, updated by every health data write
+    health_summaries = HealthSummaryStore(health_summary_collection)
+    
+    # Time-series copy of vital signs for range and chart queries
+    vital_signs_series = VitalSignsTimeSeries(db)
+    vital_trends = VitalTrendAnalyzer(vital_signs_series.collection)
     
-    aadhaar_collection.create_index([("user_email", ASCENDING)])
-    medical_history_collection.create_index([("user_email", ASCENDING)])
-    vital_signs_collection.create_index([("user_email", ASCENDING), ("recorded_at", DESCENDING)])
-    medical_reports_collection.create_index([("user_email", ASCENDING), ("created_at", DESCENDING)])
-    consultation_collection.create_index([("user_email", ASCENDING), ("timestamp", DESCENDING)])
-    appointments_collection.create_index([("user_email", ASCENDING), ("appointment_date", ASCENDING)])
-    appointments_collection.create_index([("doctor_id", ASCENDING), ("appointment_date", ASCENDING)])
+    # Per-doctor/per-day slot bitmaps for availability and atomic booking
+    appointment_slots = AppointmentSlotEngine(db[SLOTS_COLLECTION])
     
-    logger.info("MongoDB connection established and indexes created")
+    # Doctor roster cached in memory and indexed by specialty
+    doctor_directory = DoctorDirectory(doctors_collection)
+    doctor_directory.load()
+    
+    # Precomputed doctor ranking for search and recommendations
+    doctor_search = DoctorSearchIndex(doctor_directory, appointment_slots)
+    doctor_search.rebuild()
+    
+    logger.info("MongoDB connection established")
     
 except Exception as e:
     logger.error(f"Database initialization error: {e}")
@@ -530,12 +620,12 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def validate_email(email):
-    # Email validation regex
-    pattern = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-    if not re.match(pattern, email):
-        return False
-    return True
+def parse_iso_datetime(value):
+    """Parse an ISO 8601 string into a naive UTC datetime"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
 
 def secure_filename(filename):
     """Make filename secure and unique"""
@@ -559,38 +649,9 @@ def log_audit(user_email, action, details=None):
     except Exception as e:
         logger.error(f"Error logging audit: {e}")
 
-def sanitize_document(doc):
-    """Convert MongoDB documents to JSON-serializable format"""
-    if doc is None:
-        return None
-        
-    if isinstance(doc, dict):
-        # Convert ObjectId to string
-        if "_id" in doc:
-            doc["_id"] = str(doc["_id"])
-            
-        # Handle datetime objects
-        for k, v in doc.items():
-            if isinstance(v, datetime):
-                doc[k] = v.isoformat()
-            elif isinstance(v, dict) or isinstance(v, list):
-                doc[k] = sanitize_document(v)
-                
-    elif isinstance(doc, list):
-        doc = [sanitize_document(item) for item in doc]
-        
-    return doc
-
-# Dependency for token verification
-def verify_token(authorization: Optional[str] = Header(None)):
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
+def decode_access_token(token: str):
+    """Decode a bearer token into the email and role it was issued for"""
     try:
-        scheme, token = authorization.split()
-        if scheme.lower() != "bearer":
-            raise HTTPException(status_code=401, detail="Invalid authentication scheme")
-        
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         email = payload.get("sub")
         role = payload.get("role", "patient")
@@ -608,17 +669,28 @@ def verify_token(authorization: Optional[str] = Header(None)):
         logger.error(f"JWT validation error: {str(e)}")
         raise HTTPException(status_code=401, detail="Invalid authentication token")
 
+# Dependency for token verification
+def verify_token(authorization: Optional[str] = Header(None)):
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    try:
+        scheme, token = authorization.split()
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Invalid authentication scheme")
+    if scheme.lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Invalid authentication scheme")
+    
+    return decode_access_token(token)
+
 # Dependency to get current user
 def get_current_user(token_data: dict = Depends(verify_token)):
-    user = users_collection.find_one({"email": token_data["email"]})
+    # Leave out sensitive information
+    user = users_collection.find_one({"email": token_data["email"]}, projection={"password": 0})
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Remove sensitive information
-    if "password" in user:
-        del user["password"]
-        
-    return sanitize_document(user)
+    return to_jsonable(user)
 
 # Check if user is admin
 def admin_required(current_user: dict = Depends(get_current_user)):
@@ -657,6 +729,11 @@ async def health_check():
         "database": db_status,
         # "model_status": model_status,
         "environment": os.getenv("ENVIRONMENT", "development"),
+        "admission": admission.stats(),
+        "cache": cache.report(),
+        "gemini": gemini.stats(),
+        "ocr": ocr_service.stats(),
+        "blob_store": blob_store.stats(),
         "version": app.__dict__.get("version", "3.0.0"),
         "timestamp": datetime.utcnow().isoformat()
     }
@@ -831,57 +908,22 @@ async def register_user(request: Request):
         if not user_json:
             raise HTTPException(status_code=422, detail="Missing user data")
         
-        try:
-            # Parse the JSON string to get user data
-            user_data = json.loads(user_json)
-            logger.info(f"User data parsed successfully - Request ID: {request_id}")
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON format - Request ID: {request_id}")
-            raise HTTPException(status_code=422, detail="Invalid user data format")
-        
-        # Manual validation
-        email = user_data.get('email')
-        password = user_data.get('password')
-        name = user_data.get('name')
-        gender = user_data.get('gender', 'other')
-        dob = user_data.get('dob')
-        role = user_data.get('role', 'patient')
-        
-        # Validate required fields
-        if not email or not password or not name:
-            raise HTTPException(status_code=422, detail="Missing required fields: email, password, name")
-        
-        # Validate email
-        if not validate_email(email):
-            raise HTTPException(status_code=422, detail="Invalid email format")
-        
-        # Validate password strength
-        if len(password) < settings.PASSWORD_MIN_LENGTH:
-            raise HTTPException(status_code=422, detail=f"Password must be at least {settings.PASSWORD_MIN_LENGTH} characters")
-        if not any(c.isdigit() for c in password):
-            raise HTTPException(status_code=422, detail="Password must contain at least one number")
-        if not any(c.isupper() for c in password):
-            raise HTTPException(status_code=422, detail="Password must contain at least one uppercase letter")
-        if not any(c.islower() for c in password):
-            raise HTTPException(status_code=422, detail="Password must contain at least one lowercase letter")
-        
-        # Validate role
-        allowed_roles = ["patient", "doctor", "admin"]
-        if role not in allowed_roles:
-            raise HTTPException(status_code=422, detail=f"Role must be one of: {', '.join(allowed_roles)}")
-        
-        # Normalize email
-        normalized_email = email.lower().strip()
+        # Parse and validate the JSON string in one pass
+        user_data = parse_model(RegisterRequest, user_json)
+        logger.info(f"User data parsed successfully - Request ID: {request_id}")
+        
+        normalized_email = user_data.email
+        password = user_data.password
+        name = user_data.name
+        gender = user_data.gender
+        dob = user_data.dob
+        role = user_data.role
         
         # Use a unique ID to prevent duplicates
-        custom_id = user_data.get('id') or f"user_{uuid.uuid4().hex}"
+        custom_id = user_data.id or f"user_{uuid.uuid4().hex}"
         
         # Check if user already exists using findOneAndUpdate for atomic operation
         try:
-            # Add index for unique_id if it doesn't exist
-            if "unique_id_index" not in [idx["name"] for idx in users_collection.list_indexes()]:
-                users_collection.create_index([("unique_id", ASCENDING)], name="unique_id_index", unique=True)
-            
             # Check for existing user
             existing_user = users_collection.find_one({
                 "$or": [
@@ -944,7 +986,8 @@ async def register_user(request: Request):
             if face_image:
                 # Read the file content
                 if hasattr(face_image, "read"):
-                    content = await face_image.read()
+                    with await ingest_upload(face_image, settings.MAX_UPLOAD_SIZE) as upload:
+                        content = upload.read()
                 else:
                     content = face_image
                     
@@ -1096,11 +1139,8 @@ async def register_user(request: Request):
                 
                 # Save face image
                 try:
-                    face_filename = f"face_{user_id}.jpg"
-                    user_face_dir = os.path.join(settings.UPLOAD_DIR, "faces", str(user_id))
-                    os.makedirs(user_face_dir, exist_ok=True)
-                    face_filepath = os.path.join(user_face_dir, face_filename)
-                    cv2.imwrite(face_filepath, face_img)
+                    face_blob = await blob_store.put_bytes(cv2.imencode(".jpg", face_img)[1].tobytes(), ".jpg")
+                    face_filepath = face_blob["path"]
                     
                     # Update user with face features
                     users_collection.update_one(
@@ -1145,27 +1185,15 @@ async def register_user(request: Request):
         raise HTTPException(status_code=500, detail=f"Error registering user: {str(e)}")
 
 @app.post("/api/login", response_model=Token)
-async def login(request: Request):
+async def login(data: LoginRequest = Depends(json_body(LoginRequest))):
     """Authenticate a user and return a token."""
     try:
-        data = await request.json()
-        email = data.get("email")
-        password = data.get("password")
-        
-        # Validate required fields
-        if not email or not password:
-            raise HTTPException(status_code=422, detail="Email and password are required")
-        
-        # Validate email format
-        if not validate_email(email):
-            raise HTTPException(status_code=422, detail="Invalid email format")
-        
         # Get user
-        normalized_email = email.lower().strip()
+        normalized_email = data.email
         user = users_collection.find_one({"email": normalized_email})
         
         # Check if user exists and password is correct
-        if not user or not verify_password(password, user["password"]):
+        if not user or not verify_password(data.password, user["password"]):
             raise HTTPException(status_code=401, detail="Incorrect email or password")
         
         # Check if user is active
@@ -1179,9 +1207,7 @@ async def login(request: Request):
         )
         
         # Clean user data for response
-        user_response = sanitize_document(user)
-        if "password" in user_response:
-            del user_response["password"]
+        user_response = {k: v for k, v in user.items() if k != "password"}
         
         # Log audit
         log_audit(
@@ -1190,11 +1216,11 @@ async def login(request: Request):
             {"user_id": str(user["_id"])}
         )
         
-        return {
+        return MongoJSONResponse({
             "access_token": access_token,
             "token_type": "bearer",
             "user": user_response
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
@@ -1202,11 +1228,14 @@ async def login(request: Request):
         raise HTTPException(status_code=500, detail="Login error")
 
 @app.post("/api/medical-history", response_model=Dict[str, Any])
-async def save_medical_history(request: Request, current_user: dict = Depends(get_current_user)):
+async def save_medical_history(
+    data: MedicalHistoryRequest = Depends(json_body(MedicalHistoryRequest)),
+    current_user: dict = Depends(get_current_user)
+):
     """Save patient medical history."""
     try:
-        # Parse request body
-        history_data = await request.json()
+        # Only validated, bounded fields are stored
+        history_data = data.model_dump(exclude_none=True)
         
         # Add user information
         history_data["user_id"] = current_user["_id"]
@@ -1217,12 +1246,13 @@ async def save_medical_history(request: Request, current_user: dict = Depends(ge
         height = history_data.get("height")
         weight = history_data.get("weight")
         if height and weight:
-            height_m = float(height) / 100  # Convert cm to m
-            bmi = float(weight) / (height_m * height_m)
-            history_data["bmi"] = round(bmi, 2)
+            bmi = calculate_bmi(height, weight)
+            if bmi is not None:
+                history_data["bmi"] = round(bmi, 2)
         
         # Store in database
         result = medical_history_collection.insert_one(history_data)
+        health_summaries.record_medical_history(current_user["email"], history_data)
         
         # Update user record
         users_collection.update_one(
@@ -1250,29 +1280,14 @@ async def save_medical_history(request: Request, current_user: dict = Depends(ge
         raise HTTPException(status_code=500, detail="Error saving medical history")
 
 @app.post("/api/vital-signs", response_model=Dict[str, Any])
-async def save_vital_signs(request: Request, current_user: dict = Depends(get_current_user)):
+async def save_vital_signs(
+    data: VitalSignsRequest = Depends(json_body(VitalSignsRequest)),
+    current_user: dict = Depends(get_current_user)
+):
     """Save patient vital signs."""
     try:
-        # Parse request body
-        vitals_data = await request.json()
-        print(vitals_data)
-        
-        # Validate vital signs ranges
-        heart_rate = vitals_data.get("heartRate")
-        if heart_rate is not None and (heart_rate < 30 or heart_rate > 220):
-            raise HTTPException(status_code=422, detail="Heart rate must be between 30 and 220 bpm")
-            
-        oxygen_level = vitals_data.get("oxygenLevel")
-        if oxygen_level is not None and (oxygen_level < 70 or oxygen_level > 100):
-            raise HTTPException(status_code=422, detail="Oxygen level must be between 70 and 100%")
-            
-        temperature = vitals_data.get("temperature")
-        if temperature is not None and (temperature < 35 or temperature > 42):
-            raise HTTPException(status_code=422, detail="Temperature must be between 35 and 42°C")
-            
-        respiratory_rate = vitals_data.get("respiratoryRate")
-        if respiratory_rate is not None and (respiratory_rate < 8 or respiratory_rate > 40):
-            raise HTTPException(status_code=422, detail="Respiratory rate must be between 8 and 40 breaths per minute")
+        # Ranges were checked by the request model
+        vitals_data = data.model_dump(exclude_none=True)
         
         # Add user information and timestamp
         vitals_data["user_id"] = current_user["_id"]
@@ -1281,21 +1296,12 @@ async def save_vital_signs(request: Request, current_user: dict = Depends(get_cu
         
         # Store in database
         result = vital_signs_collection.insert_one(vitals_data)
+        health_summaries.record_vitals(current_user["email"], vitals_data)
+        vital_signs_series.insert(current_user["email"], vitals_data)
+        vital_trends.record_write(current_user["email"], [vitals_data["recorded_at"]])
         
         # Update user record with latest vitals
-        users_collection.update_one(
-            {"_id": current_user["_id"]},
-            {"$set": {
-                "latest_vitals": {
-                    "heartRate": vitals_data.get("heartRate"),
-                    "bloodPressure": vitals_data.get("bloodPressure"),
-                    "oxygenLevel": vitals_data.get("oxygenLevel"),
-                    "temperature": vitals_data.get("temperature"),
-                    "respiratoryRate": vitals_data.get("respiratoryRate"),
-                    "updated_at": datetime.utcnow()
-                }
-            }}
-        )
+        set_latest_vitals({"_id": current_user["_id"]}, vitals_data)
         
         # Log action
         log_audit(
@@ -1304,17 +1310,289 @@ async def save_vital_signs(request: Request, current_user: dict = Depends(get_cu
             {"vitals_id": str(result.inserted_id)}
         )
         
-        return {
+        return MongoJSONResponse({
             "message": "Vital signs saved successfully",
             "vitals_id": str(result.inserted_id),
-            "data": sanitize_document(vitals_data)
-        }
+            "data": vitals_data
+        })
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error saving vital signs: {e}")
         raise HTTPException(status_code=500, detail="Error saving vital signs")
 
+def set_latest_vitals(user_filter, vitals):
+    """Record a reading as the user's latest vitals unless a newer one is already stored"""
+    recorded_at = vitals["recorded_at"]
+    users_collection.update_one(
+        {
+            **user_filter,
+            # Buffered monitor uploads can be older than readings already saved
+            "$or": [
+                {"latest_vitals.recorded_at": {"$exists": False}},
+                {"latest_vitals.recorded_at": {"$lte": recorded_at}}
+            ]
+        },
+        {"$set": {
+            "latest_vitals": {
+                "heartRate": vitals.get("heartRate"),
+                "bloodPressure": vitals.get("bloodPressure"),
+                "oxygenLevel": vitals.get("oxygenLevel"),
+                "temperature": vitals.get("temperature"),
+                "respiratoryRate": vitals.get("respiratoryRate"),
+                "recorded_at": recorded_at,
+                "updated_at": datetime.utcnow()
+            }
+        }}
+    )
+
+def store_vital_readings(user_id, user_email, readings):
+    """Persist validated readings in one batch and refresh latest state once"""
+    if not readings:
+        return 0
+    
+    for doc in readings:
+        doc["user_id"] = user_id
+        doc["user_email"] = user_email
+    
+    # One round-trip for the whole batch
+    result = vital_signs_collection.insert_many(readings, ordered=False)
+    vital_signs_series.insert_many(user_email, readings)
+    vital_trends.record_write(user_email, [doc["recorded_at"] for doc in readings])
+    
+    # Latest state is written once per batch, and only if the batch is newer than what is stored
+    latest = max(readings, key=lambda doc: doc["recorded_at"])
+    set_latest_vitals({"email": user_email}, latest)
+    health_summaries.record_vitals(user_email, latest)
+    return len(result.inserted_ids)
+
+def persist_streamed_vitals(user_id, user_email, readings):
+    """Flush callback for the live vitals hub"""
+    inserted = store_vital_readings(user_id, user_email, readings)
+    log_audit(user_email, "vital_signs_stream_flush", {"inserted": inserted})
+
+# Live vitals fan-out with batched persistence
+vitals_hub = VitalsStreamHub(persist_streamed_vitals)
+
+@app.on_event("startup")
+async def start_vitals_hub():
+    vitals_hub.start()
+
+@app.on_event("shutdown")
+async def stop_vitals_hub():
+    await vitals_hub.stop()
+
+# Content-addressed, deduplicated storage for uploaded files
+blob_store = BlobStore(LocalBlobBackend(os.path.join(settings.UPLOAD_DIR, "blobs")))
+
+# OCR worker pool, shared by image reports and scanned PDF pages
+ocr_service = OcrService()
+
+# PDF text extraction in a process pool, cached by file hash
+document_extractor = DocumentExtractor(cache, ocr=ocr_service.recognize_text)
+
+@app.on_event("shutdown")
+async def stop_document_extractor():
+    document_extractor.shutdown()
+    ocr_service.shutdown()
+
+@app.on_event("startup")
+async def start_doctor_directory_refresh():
+    doctor_directory.start()
+    doctor_search.start()
+
+@app.on_event("shutdown")
+async def stop_doctor_directory_refresh():
+    doctor_directory.stop()
+    doctor_search.stop()
+
+async def authorize_vitals_socket(websocket: WebSocket, patient_email: str):
+    """Authenticate a WebSocket from its ?token= query parameter"""
+    token = websocket.query_params.get("token")
+    if not token:
+        return None
+    try:
+        token_data = decode_access_token(token)
+    except HTTPException:
+        return None
+    
+    # Patients may only access their own stream; care team may access any
+    if token_data["email"] != patient_email.lower() and token_data["role"] not in ("doctor", "admin"):
+        return None
+    return token_data
+
+@app.websocket("/api/ws/vitals/{patient_email}/publish")
+async def publish_vitals_stream(websocket: WebSocket, patient_email: str):
+    """Monitors push readings for a patient; each gets an ack with rolling aggregates."""
+    patient_email = patient_email.lower()
+    token_data = await authorize_vitals_socket(websocket, patient_email)
+    if token_data is None:
+        await websocket.close(code=4401)
+        return
+    
+    patient = users_collection.find_one({"email": patient_email}, projection={"_id": 1})
+    if patient is None:
+        await websocket.close(code=4404)
+        return
+    
+    await websocket.accept()
+    try:
+        while True:
+            reading = await websocket.receive_json()
+            ack = await vitals_hub.publish(patient_email, patient["_id"], reading)
+            await websocket.send_json(ack)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in vitals publish stream for {patient_email}: {e}")
+        await websocket.close(code=1011)
+
+@app.websocket("/api/ws/vitals/{patient_email}")
+async def subscribe_vitals_stream(websocket: WebSocket, patient_email: str):
+    """Care team dashboards receive live readings and rolling aggregates."""
+    patient_email = patient_email.lower()
+    token_data = await authorize_vitals_socket(websocket, patient_email)
+    if token_data is None:
+        await websocket.close(code=4401)
+        return
+    
+    await websocket.accept()
+    snapshot = vitals_hub.subscribe(patient_email, websocket)
+    try:
+        await websocket.send_json(snapshot)
+        # Keep the connection open; clients may send pings
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        vitals_hub.unsubscribe(patient_email, websocket)
+
+@app.post("/api/vital-signs/batch", response_model=Dict[str, Any])
+async def save_vital_signs_batch(request: Request, current_user: dict = Depends(get_current_user)):
+    """Save a batch of timestamped vital sign readings (JSON array or NDJSON)."""
+    try:
+        body = await read_body(request, MAX_BATCH_BODY)
+        try:
+            readings = parse_batch_body(body, request.headers.get("content-type"))
+        except BatchFormatError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        
+        if not readings:
+            raise HTTPException(status_code=422, detail="Batch contains no readings")
+        
+        # Vectorized range validation; invalid rows are reported, not stored
+        accepted, rejected = validate_batch(readings)
+        
+        inserted = store_vital_readings(current_user["_id"], current_user["email"], accepted)
+        
+        # Log action
+        log_audit(
+            current_user["email"],
+            "vital_signs_batch_save",
+            {
+                "received": len(readings),
+                "inserted": inserted,
+                "rejected": len(rejected)
+            }
+        )
+        
+        return {
+            "message": "Vital signs batch processed",
+            "received": len(readings),
+            "inserted": inserted,
+            "rejected": len(rejected),
+            "rejections": rejected[:MAX_REJECTION_DETAILS]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error saving vital signs batch: {e}")
+        raise HTTPException(status_code=500, detail="Error saving vital signs batch")
+
+@app.get("/api/vital-signs/series", response_model=Dict[str, Any])
+async def get_vital_signs_series(
+    metric: str = "heartRate",
+    window: str = "hour",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    percentiles: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get a downsampled vital sign series (min/max/mean/percentiles per window)."""
+    try:
+        if metric not in VITAL_METRICS:
+            raise HTTPException(status_code=422, detail=f"Metric must be one of: {', '.join(VITAL_METRICS)}")
+        if window not in VITAL_WINDOWS:
+            raise HTTPException(status_code=422, detail=f"Window must be one of: {', '.join(VITAL_WINDOWS)}")
+        
+        # Parse time range, defaulting to the last 7 days
+        try:
+            end_dt = parse_iso_datetime(end) if end else datetime.utcnow()
+            start_dt = parse_iso_datetime(start) if start else end_dt - timedelta(days=7)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="start and end must be ISO 8601 datetimes")
+        if start_dt >= end_dt:
+            raise HTTPException(status_code=422, detail="start must be before end")
+        try:
+            if not end:
+                # "Now" is rounded up to the window boundary so repeat requests share a cache key
+                end_dt = window_ceiling(end_dt, choose_window(start_dt, end_dt, window))
+                if not start:
+                    start_dt = end_dt - timedelta(days=7)
+            # Rejects ranges too long to fit MAX_POINTS even at the coarsest window
+            choose_window(start_dt, end_dt, window)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        
+        # Parse requested percentiles, e.g. "50,90,99"
+        percentile_list = None
+        if percentiles:
+            try:
+                percentile_list = [float(p) for p in percentiles.split(",") if p.strip()]
+            except ValueError:
+                raise HTTPException(status_code=422, detail="percentiles must be comma-separated numbers")
+            if any(p < 0 or p > 100 for p in percentile_list) or len(percentile_list) > 5:
+                raise HTTPException(status_code=422, detail="Up to 5 percentiles between 0 and 100 are allowed")
+        
+        series = await cache.get_or_load(
+            "vital_series",
+            (current_user["email"], metric, start_dt.isoformat(), end_dt.isoformat(), window, percentile_list),
+            lambda: asyncio.to_thread(
+                vital_signs_series.downsample,
+                current_user["email"],
+                metric,
+                start_dt,
+                end_dt,
+                window,
+                percentile_list
+            ),
+            ttl=30
+        )
+        
+        return MongoJSONResponse({
+            "message": "Vital signs series retrieved successfully",
+            "data": series
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving vital signs series: {e}")
+        raise HTTPException(status_code=500, detail="Error retrieving vital signs series")
+
+@app.get("/api/vital-signs/trends", response_model=Dict[str, Any])
+async def get_vital_signs_trends(current_user: dict = Depends(get_current_user)):
+    """Get rolling means, slopes, z-scores and EWMA anomaly flags for each vital sign."""
+    try:
+        trends = await asyncio.to_thread(vital_trends.analyze, current_user["email"])
+        return {
+            "message": "Vital signs trends computed successfully",
+            "data": trends
+        }
+    except Exception as e:
+        logger.error(f"Error computing vital signs trends: {e}")
+        raise HTTPException(status_code=500, detail="Error computing vital signs trends")
+
 # # Add a new route to explicitly analyze the intent of a message - useful for debugging
 # System prompt to guide PaLM 2
 SYSTEM_PROMPT = """
@@ -1353,120 +1631,187 @@ Example flow:
 If the user provides context about patient data, medical history, or vital signs, incorporate that into your questions and analysis.
 """
 
+prompt_builder = PromptBuilder()
+
+# Shown when the model's final diagnosis cannot be parsed
+UNPARSED_DIAGNOSIS_TEXT = "I’ve analyzed your symptoms and prepared a diagnosis. Please consult a healthcare professional for further evaluation."
+
+def compose_final_diagnosis(final_data):
+    """Turn the model's diagnosis JSON into the reply text and a recommended doctor"""
+    diagnosis = final_data.get("diagnosis", "Unknown")
+    recommendations = final_data.get("recommendations", [])
+    doctor_specialty = final_data.get("doctor_specialty", "General Practitioner")
+    
+    # Find a doctor from the cached directory
+    doctor = doctor_directory.first_for_specialty(doctor_specialty)
+    if doctor:
+        doctor_info = f"{doctor['name']}, a {doctor['specialty']} with {doctor['experience']} experience and rating {doctor['rating']}"
+    else:
+        doctor_info = "a General Practitioner"
+    
+    # Construct the response
+    response_text = f"Based on your symptoms, the possible diagnosis is: {diagnosis}\n\n"
+    response_text += "Recommendations:\n" + "\n".join([f"- {rec}" for rec in recommendations]) + "\n\n"
+    response_text += f"We recommend consulting with {doctor_info} for further evaluation."
+    return response_text, doctor
+
+async def open_chat_session(session_token):
+    """Create a chat session, or load an existing one"""
+    if not session_token:
+        return await chat_sessions.create()
+    session = await chat_sessions.get(session_token)
+    if session is None:
+        raise HTTPException(status_code=400, detail="Invalid or expired session token")
+    return session_token, session
+
+async def save_chat_turn(session_token, session, user_message, assistant_message):
+    """Append a turn, fold old messages into the summary and persist the session"""
+    session["messages"].append({"role": "user", "content": user_message})
+    session["messages"].append({"role": "assistant", "content": assistant_message})
+    await prompt_builder.compact(session, summarize_chat)
+    cap_messages(session)
+    await chat_sessions.save(session_token, session)
+
+async def summarize_chat(prompt: str) -> str:
+    """Summarize aged-out chat messages for the rolling session summary"""
+    return await gemini.generate(prompt)
+
+def chat_contents(session, message):
+    """Bounded history plus the new message, as Gemini contents"""
+    return prompt_builder.build_history(session, message) + [{"role": "user", "parts": [message]}]
+
 @app.post("/api/analyze-intent")
-async def analyze_intent(request: ChatRequest):
+async def analyze_intent(request: ChatRequest, _admitted: None = Depends(admission.guard("chat"))):
     """
     Single endpoint to handle all medical chat interactions using PaLM 2.
     Maintains conversation flow: asks questions, analyzes, predicts diseases, and responds.
     """
     try:
-        # Generate or retrieve session token
-        if not request.session_token:
-            session_token = str(uuid.uuid4())
-            conversations[session_token] = []
-        else:
-            session_token = request.session_token
-            if session_token not in conversations:
-                raise HTTPException(status_code=400, detail="Invalid session token")
-
-        # Get conversation history
-        history = conversations[session_token]
-
         # Validate input
         if not request.message.strip():
             raise HTTPException(status_code=400, detail="Message cannot be empty")
 
-        # Add user message to history
-        history.append({"role": "user", "content": request.message})
-
-        # Construct prompt with system instructions and history
-        prompt = SYSTEM_PROMPT + "\n\nConversation History:\n" + \
-                 "\n".join([f"{msg['role']}: {msg['content']}" for msg in history])
-
-        # Call PaLM 2 API
-        response = model.generate_content(prompt)
-        print(response)
-        assistant_message = response.text.strip()
-        if assistant_message.startswith("FINAL DIAGNOSIS:"):
-            try:
-                # Extract JSON from the response
-                json_start = assistant_message.find("```json") + len("```json")
-                json_end = assistant_message.find("```", json_start)
-                json_str = assistant_message[json_start:json_end].strip()
-                final_data = json.loads(json_str)
-
-                diagnosis = final_data.get("diagnosis", "Unknown")
-                recommendations = final_data.get("recommendations", [])
-                doctor_specialty = final_data.get("doctor_specialty", "General Practitioner")
-
-                # Find a doctor from seed_doctors
-                
-                doctor = doctors_collection.find_one({"specialty": doctor_specialty})
-                if doctor:
-                    doctor_info = f"{doctor['name']}, a {doctor['specialty']} with {doctor['experience']} experience and rating {doctor['rating']}"
-                else:
-                    doctor_info = "a General Practitioner"
-
-                # Construct the response
-                response_text = f"Based on your symptoms, the possible diagnosis is: {diagnosis}\n\n"
-                response_text += "Recommendations:\n" + "\n".join([f"- {rec}" for rec in recommendations]) + "\n\n"
-                response_text += f"We recommend consulting with {doctor_info} for further evaluation."
-
-                # Add to history
-                history.append({"role": "assistant", "content": response_text})
-                conversations[session_token] = history
-
-                return {
-                    "response": response_text,
-                    "session_token": session_token,
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "is_final": True
-                }
-            except json.JSONDecodeError:
+        # Generate or retrieve session token
+        session_token, session = await open_chat_session(request.session_token)
+
+        # Recent turns verbatim plus the rolling summary, within the token budget.
+        # The static prompt goes in the system instruction instead of being resent in every turn's text
+        assistant_message = (await gemini.generate(
+            chat_contents(session, request.message), system_instruction=SYSTEM_PROMPT
+        )).strip()
+        if assistant_message.startswith(FINAL_MARKER):
+            final_data = parse_final_json(assistant_message)
+            if final_data is not None:
+                response_text, _ = compose_final_diagnosis(final_data)
+            else:
                 logger.error("Failed to parse final diagnosis JSON")
-                response_text = "I’ve analyzed your symptoms and prepared a diagnosis. Please consult a healthcare professional for further evaluation."
-                history.append({"role": "assistant", "content": response_text})
-                conversations[session_token] = history
-                return {
-                    "response": response_text,
-                    "session_token": session_token,
-                    "timestamp": datetime.utcnow().isoformat(),
-                    "is_final": True
-                }
+                response_text = UNPARSED_DIAGNOSIS_TEXT
+            is_final = True
         else:
             # Treat as a follow-up question
-            history.append({"role": "assistant", "content": assistant_message})
-            conversations[session_token] = history
-            return {
-                "response": assistant_message,
-                "session_token": session_token,
-                "timestamp": datetime.utcnow().isoformat(),
-                "is_final": False
-            }
+            response_text = assistant_message
+            is_final = False
+
+        await save_chat_turn(session_token, session, request.message, response_text)
+        return {
+            "response": response_text,
+            "session_token": session_token,
+            "timestamp": datetime.utcnow().isoformat(),
+            "is_final": is_final
+        }
 
+    except HTTPException:
+        raise
+    except GeminiUnavailableError as e:
+        logger.error(f"Chat model unavailable: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail="The medical assistant is temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": str(max(1, int(e.retry_after)))}
+        )
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+
+@app.post("/api/analyze-intent/stream")
+async def analyze_intent_stream(request: ChatRequest, _admitted: None = Depends(admission.guard("chat"))):
+    """
+    Streaming variant of analyze_intent using Server-Sent Events.
+    
+    Emits ``session``, then ``token`` events as text arrives. A final
+    diagnosis is not streamed as raw JSON; it is sent as one structured
+    ``final`` event with the recommended doctor. ``done`` closes the stream.
+    """
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    
+    session_token, session = await open_chat_session(request.session_token)
+    contents = chat_contents(session, request.message)
+    
+    async def events():
+        yield sse_event("session", {"session_token": session_token})
+        parser = DiagnosisStreamParser()
+        response_text = None
+        try:
+            async for chunk in gemini.stream(contents, system_instruction=SYSTEM_PROMPT):
+                visible, final_data = parser.feed(chunk)
+                if visible:
+                    yield sse_event("token", {"text": visible})
+                if final_data is not None:
+                    response_text, doctor = compose_final_diagnosis(final_data)
+                    yield sse_event("final", {**final_data, "response": response_text, "doctor": doctor})
+            
+            visible, final_data = parser.finish()
+            if visible:
+                yield sse_event("token", {"text": visible})
+            if final_data is not None:
+                response_text, doctor = compose_final_diagnosis(final_data)
+                yield sse_event("final", {**final_data, "response": response_text, "doctor": doctor})
+            elif parser.is_final and response_text is None:
+                logger.error("Failed to parse final diagnosis JSON")
+                response_text = UNPARSED_DIAGNOSIS_TEXT
+                yield sse_event("final", {"response": response_text, "doctor": None})
+            
+            if response_text is None:
+                response_text = parser.text.strip()
+            await save_chat_turn(session_token, session, request.message, response_text)
+            yield sse_event("done", {
+                "session_token": session_token,
+                "timestamp": datetime.utcnow().isoformat(),
+                "is_final": bool(parser.is_final)
+            })
+        except GeminiUnavailableError as e:
+            logger.error(f"Chat model unavailable: {str(e)}")
+            yield sse_event("error", {
+                "detail": "The medical assistant is temporarily unavailable. Please try again shortly.",
+                "retry_after": max(1, int(e.retry_after))
+            })
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {str(e)}")
+            yield sse_event("error", {"detail": "Error processing request"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 # 
 
 
 @app.post("/api/book-appointment", response_model=Dict[str, Any])
-async def book_appointment(request: Request, current_user: dict = Depends(get_current_user)):
+async def book_appointment(
+    data: BookAppointmentRequest = Depends(json_body(BookAppointmentRequest)),
+    current_user: dict = Depends(get_current_user)
+):
     """Book an appointment with a doctor."""
     try:
-        # Parse request body
-        data = await request.json()
-        doctor_id = data.get("doctor_id")
-        appointment_date = data.get("date")
-        appointment_time = data.get("time")
-        reason = data.get("reason")
-        
-        # Validate required fields
-        if not doctor_id or not appointment_date or not appointment_time or not reason:
-            raise HTTPException(status_code=422, detail="Missing required fields")
-        
-        # Verify doctor exists
-        doctor = doctors_collection.find_one({"_id": doctor_id})
+        doctor_id = data.doctor_id
+        appointment_date = data.date
+        appointment_time = data.time
+        reason = data.reason
+        
+        # Verify doctor exists, falling back to Mongo for doctors added since the last refresh
+        doctor = doctor_directory.get(doctor_id) or doctors_collection.find_one({"_id": doctor_id})
         if not doctor:
             raise HTTPException(status_code=404, detail="Doctor not found")
         
@@ -1489,19 +1834,19 @@ async def book_appointment(request: Request, current_user: dict = Depends(get_cu
             datetime.strptime(appointment_time, "%H:%M")
         except ValueError:
             raise HTTPException(status_code=422, detail="Time must be in HH:MM format")
+        if appointment_time not in SLOT_INDEX:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Time must be one of the available slots: {', '.join(SLOT_TIMES)}"
+            )
         
         # Parse datetime
         appointment_datetime = datetime.strptime(f"{appointment_date} {appointment_time}", "%Y-%m-%d %H:%M")
         
-        # Check for existing appointments at same time
-        existing_appointment = appointments_collection.find_one({
-            "doctor_id": doctor_id,
-            "appointment_date": appointment_date,
-            "appointment_time": appointment_time,
-            "status": "scheduled"
-        })
-        
-        if existing_appointment:
+        # Reserve the slot atomically; concurrent requests cannot both win
+        try:
+            appointment_slots.reserve(doctor_id, appointment_date, appointment_time)
+        except SlotUnavailableError:
             raise HTTPException(status_code=409, detail="This time slot is already booked")
         
         # Generate appointment data
@@ -1522,8 +1867,15 @@ async def book_appointment(request: Request, current_user: dict = Depends(get_cu
             "updated_at": datetime.utcnow()
         }
         
-        # Store in database
-        appointment_id = appointments_collection.insert_one(appointment_data).inserted_id
+        # Store in database; the unique partial index rejects any double booking
+        try:
+            appointment_id = appointments_collection.insert_one(appointment_data).inserted_id
+        except errors.DuplicateKeyError:
+            raise HTTPException(status_code=409, detail="This time slot is already booked")
+        except Exception:
+            appointment_slots.release(doctor_id, appointment_date, appointment_time)
+            raise
+        doctor_search.record_booking(doctor_id, appointment_date, appointment_time)
         
         # Log action
         log_audit(
@@ -1553,193 +1905,390 @@ async def book_appointment(request: Request, current_user: dict = Depends(get_cu
         logger.error(f"Error booking appointment: {e}")
         raise HTTPException(status_code=500, detail="Error booking appointment")
 
-# More API routes would be implemented similarly...
-# Additional API Routes
-
-@app.post("/api/verify-face", response_model=Dict[str, Any])
-async def verify_face(
-    face_image: UploadFile = File(...),
-    background_tasks: BackgroundTasks = BackgroundTasks()
-):
-    """Verify user by face recognition."""
+@app.post("/api/appointments/{appointment_id}/cancel", response_model=Dict[str, Any])
+async def cancel_appointment(appointment_id: str, current_user: dict = Depends(get_current_user)):
+    """Cancel a scheduled appointment and free its slot."""
     try:
-        # Validate file size
-        content = await face_image.read()
-        if len(content) > settings.MAX_UPLOAD_SIZE:
-            raise HTTPException(status_code=413, detail="File size too large")
-            
-        # Validate file type
-        if not face_image.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
+        try:
+            query = {"_id": ObjectId(appointment_id), "status": "scheduled"}
+        except InvalidId:
+            raise HTTPException(status_code=404, detail="Appointment not found")
+        if current_user.get("role") not in ("doctor", "admin"):
+            query["user_email"] = current_user["email"]
+        
+        # Only one request can move the appointment out of "scheduled", so the slot is released once
+        appointment = appointments_collection.find_one_and_update(
+            query,
+            {"$set": {
+                "status": "cancelled",
+                "cancelled_by": current_user["email"],
+                "cancelled_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        if appointment is None:
+            query.pop("status")
+            if appointments_collection.count_documents(query, limit=1):
+                raise HTTPException(status_code=409, detail="Only scheduled appointments can be cancelled")
+            raise HTTPException(status_code=404, detail="Appointment not found")
         
-        # Process image
-        np_image = np.frombuffer(content, dtype=np.uint8)
-        image = cv2.imdecode(np_image, cv2.IMREAD_COLOR)
+        appointment_slots.release(appointment["doctor_id"], appointment["appointment_date"], appointment["appointment_time"])
+        doctor_search.record_release(appointment["doctor_id"], appointment["appointment_date"], appointment["appointment_time"])
         
-        if image is None:
-            raise HTTPException(status_code=400, detail="Invalid image format or corrupted image")
+        log_audit(
+            current_user["email"],
+            "appointment_cancellation",
+            {
+                "appointment_id": appointment_id,
+                "doctor_id": appointment["doctor_id"],
+                "appointment_date": appointment["appointment_date"]
+            }
+        )
+        
+        return {
+            "message": "Appointment cancelled successfully",
+            "appointment_id": appointment_id,
+            "status": "cancelled"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error cancelling appointment: {e}")
+        raise HTTPException(status_code=500, detail="Error cancelling appointment")
+
+@app.get("/api/appointments/availability", response_model=Dict[str, Any])
+async def get_appointment_availability(
+    specialty: Optional[str] = None,
+    doctor_id: Optional[str] = None,
+    days: int = 7,
+    start: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """List free appointment slots by specialty or doctor over the next N days."""
+    try:
+        if not specialty and not doctor_id:
+            raise HTTPException(status_code=422, detail="Either specialty or doctor_id is required")
+        if days < 1 or days > 90:
+            raise HTTPException(status_code=422, detail="days must be between 1 and 90")
         
-        # Enhance image quality for better face detection
         try:
-            # Convert to LAB color space
-            lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            
-            # Apply CLAHE to L channel for better contrast
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-            cl = clahe.apply(l)
-            
-            # Merge channels and convert back to BGR
-            enhanced_lab = cv2.merge((cl, a, b))
-            enhanced_image = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2BGR)
-            
-            # Check if image is dark and needs brightness enhancement
-            brightness = np.mean(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
-            if brightness < 100:  # Dark image
-                alpha = 1.3  # Contrast control
-                beta = 30    # Brightness control
-                enhanced_image = cv2.convertScaleAbs(enhanced_image, alpha=alpha, beta=beta)
-        except Exception as e:
-            logger.warning(f"Image enhancement failed, using original: {e}")
-            enhanced_image = image
+            start_date = datetime.strptime(start, "%Y-%m-%d").date() if start else datetime.utcnow().date()
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Date must be in YYYY-MM-DD format")
         
-        # Face detection - first try with DNN model
-        face_detected = False
-        face_box = None
+        if doctor_id:
+            doctor = doctor_directory.get(doctor_id)
+            doctors = [doctor] if doctor else []
+        else:
+            doctors = doctor_directory.by_specialty(specialty)
         
-        try:
-            # Setup DNN face detector
-            models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
-            os.makedirs(models_dir, exist_ok=True)
-            
-            prototxt_path = os.path.join(models_dir, "deploy.prototxt")
-            model_path = os.path.join(models_dir, "res10_300x300_ssd_iter_140000.caffemodel")
-            
-            # Download model files if they don't exist
-            if not os.path.exists(prototxt_path) or not os.path.exists(model_path):
-                logger.info("DNN model files not found, downloading them...")
-                try:
-                    import urllib.request
-                    
-                    # Download prototxt file
-                    urllib.request.urlretrieve(
-                        "https://raw.githubusercontent.com/opencv/opencv/master/samples/dnn/face_detector/deploy.prototxt",
-                        prototxt_path
-                    )
-                    
-                    # Download caffemodel
-                    urllib.request.urlretrieve(
-                        "https://raw.githubusercontent.com/opencv/opencv_3rdparty/dnn_samples_face_detector_20170830/res10_300x300_ssd_iter_140000.caffemodel",
-                        model_path
-                    )
-                    
-                    logger.info("DNN model files downloaded successfully")
-                except Exception as download_error:
-                    logger.error(f"Error downloading DNN model files: {download_error}")
-            
-            # Use DNN face detector if model files exist
-            if os.path.exists(prototxt_path) and os.path.exists(model_path):
-                net = cv2.dnn.readNetFromCaffe(prototxt_path, model_path)
-                
-                # Preprocess image
-                blob = cv2.dnn.blobFromImage(
-                    cv2.resize(enhanced_image, (300, 300)), 
-                    1.0, 
-                    (300, 300), 
-                    (104.0, 177.0, 123.0),
-                    swapRB=False
-                )
-                
-                # Detect faces
-                net.setInput(blob)
-                detections = net.forward()
-                
-                # Process detections
-                height, width = enhanced_image.shape[:2]
-                best_confidence = 0
-                
-                for i in range(detections.shape[2]):
-                    confidence = detections[0, 0, i, 2]
-                    
-                    if confidence > 0.5 and confidence > best_confidence:  # Confidence threshold
-                        best_confidence = confidence
-                        box = detections[0, 0, i, 3:7] * np.array([width, height, width, height])
-                        (x1, y1, x2, y2) = box.astype("int")
-                        
-                        # Store face box
-                        face_box = (max(0, x1), max(0, y1), min(width, x2 - x1), min(height, y2 - y1))
-                        face_detected = True
-                        
-                        logger.info(f"Face detected with DNN, confidence: {confidence:.2f}")
-        except Exception as dnn_error:
-            logger.error(f"DNN face detection error: {dnn_error}")
+        slots = appointment_slots.free_slots(doctors, start_date, days)
         
-        # If DNN failed, try with Haar Cascade
-        if not face_detected:
+        return {
+            "message": "Availability retrieved successfully",
+            "slot_minutes": SLOT_MINUTES,
+            "data": slots
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving appointment availability: {e}")
+        raise HTTPException(status_code=500, detail="Error retrieving appointment availability")
+
+@app.get("/api/doctors/search", response_model=Dict[str, Any])
+async def search_doctors(
+    specialty: Optional[str] = None,
+    date: Optional[str] = None,
+    min_rating: Optional[float] = None,
+    page: int = 1,
+    page_size: int = 10,
+    current_user: dict = Depends(get_current_user)
+):
+    """Search doctors by specialty, date with free slots and rating, best ranked first."""
+    try:
+        if date:
             try:
-                gray = cv2.cvtColor(enhanced_image, cv2.COLOR_BGR2GRAY)
-                
-                # Try with different cascade classifiers and parameters
-                face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+                datetime.strptime(date, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=422, detail="Date must be in YYYY-MM-DD format")
+        if min_rating is not None and (min_rating < 0 or min_rating > 5):
+            raise HTTPException(status_code=422, detail="min_rating must be between 0 and 5")
+        if page < 1 or page_size < 1:
+            raise HTTPException(status_code=422, detail="page and page_size must be positive")
+        
+        results = doctor_search.search(
+            specialty=specialty,
+            date=date,
+            min_rating=min_rating,
+            page=page,
+            page_size=page_size
+        )
+        
+        return {
+            "message": "Doctors retrieved successfully",
+            "data": results["items"],
+            "page": results["page"],
+            "page_size": results["page_size"],
+            "total": results["total"]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching doctors: {e}")
+        raise HTTPException(status_code=500, detail="Error searching doctors")
+
+@app.post("/api/admin/doctors/refresh", response_model=Dict[str, Any])
+async def refresh_doctor_directory(current_user: dict = Depends(admin_required)):
+    """Reload the in-memory doctor directory after roster changes."""
+    try:
+        count = await doctor_directory.refresh()
+        await asyncio.to_thread(doctor_search.rebuild)
+        log_audit(current_user["email"], "doctor_directory_refresh", {"doctors": count})
+        return {
+            "message": "Doctor directory refreshed",
+            "doctors": count,
+            "version": doctor_directory.version
+        }
+    except Exception as e:
+        logger.error(f"Error refreshing doctor directory: {e}")
+        raise HTTPException(status_code=500, detail="Error refreshing doctor directory")
+
+# More API routes would be implemented similarly...
+# Additional API Routes
+
+# Face detectors are loaded once per ML thread; OpenCV models are not safe to share across threads
+_face_models = threading.local()
+
+def _face_detectors():
+    """The DNN face detector (None if its files are unavailable) and Haar cascade for this thread."""
+    if not hasattr(_face_models, "cascade"):
+        models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+        os.makedirs(models_dir, exist_ok=True)
+        
+        prototxt_path = os.path.join(models_dir, "deploy.prototxt")
+        model_path = os.path.join(models_dir, "res10_300x300_ssd_iter_140000.caffemodel")
+        
+        # Download model files if they don't exist
+        if not os.path.exists(prototxt_path) or not os.path.exists(model_path):
+            logger.info("DNN model files not found, downloading them...")
+            try:
+                import urllib.request
                 
-                # First attempt - standard parameters
-                faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+                # Download prototxt file
+                urllib.request.urlretrieve(
+                    "https://raw.githubusercontent.com/opencv/opencv/master/samples/dnn/face_detector/deploy.prototxt",
+                    prototxt_path
+                )
                 
-                # Second attempt - more lenient parameters
-                if len(faces) == 0:
-                    faces = face_cascade.detectMultiScale(
-                        gray, 
-                        scaleFactor=1.05, 
-                        minNeighbors=3, 
-                        minSize=(30, 30)
-                    )
+                # Download caffemodel
+                urllib.request.urlretrieve(
+                    "https://raw.githubusercontent.com/opencv/opencv_3rdparty/dnn_samples_face_detector_20170830/res10_300x300_ssd_iter_140000.caffemodel",
+                    model_path
+                )
                 
-                # Third attempt - even more lenient
-                if len(faces) == 0:
-                    faces = face_cascade.detectMultiScale(
-                        gray, 
-                        scaleFactor=1.03, 
-                        minNeighbors=2, 
-                        minSize=(20, 20)
-                    )
+                logger.info("DNN model files downloaded successfully")
+            except Exception as download_error:
+                logger.error(f"Error downloading DNN model files: {download_error}")
+        
+        _face_models.net = None
+        if os.path.exists(prototxt_path) and os.path.exists(model_path):
+            try:
+                _face_models.net = cv2.dnn.readNetFromCaffe(prototxt_path, model_path)
+            except Exception as e:
+                logger.error(f"DNN face detector failed to load: {e}")
+        _face_models.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        _face_models.hog = cv2.HOGDescriptor()
+    return _face_models
+
+def extract_face_features(content: bytes) -> Optional[np.ndarray]:
+    """Normalized HOG features of the main face in an image, or None if no face is found; runs on the ML pool."""
+    # Process image
+    np_image = np.frombuffer(content, dtype=np.uint8)
+    image = cv2.imdecode(np_image, cv2.IMREAD_COLOR)
+    
+    if image is None:
+        raise ValueError("Invalid image format or corrupted image")
+    
+    # Enhance image quality for better face detection
+    try:
+        # Convert to LAB color space
+        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+        l, a, b = cv2.split(lab)
+        
+        # Apply CLAHE to L channel for better contrast
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        cl = clahe.apply(l)
+        
+        # Merge channels and convert back to BGR
+        enhanced_lab = cv2.merge((cl, a, b))
+        enhanced_image = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2BGR)
+        
+        # Check if image is dark and needs brightness enhancement
+        brightness = np.mean(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+        if brightness < 100:  # Dark image
+            alpha = 1.3  # Contrast control
+            beta = 30    # Brightness control
+            enhanced_image = cv2.convertScaleAbs(enhanced_image, alpha=alpha, beta=beta)
+    except Exception as e:
+        logger.warning(f"Image enhancement failed, using original: {e}")
+        enhanced_image = image
+    
+    detectors = _face_detectors()
+    
+    # Face detection - first try with DNN model
+    face_detected = False
+    face_box = None
+    
+    if detectors.net is not None:
+        try:
+            # Preprocess image
+            blob = cv2.dnn.blobFromImage(
+                cv2.resize(enhanced_image, (300, 300)), 
+                1.0, 
+                (300, 300), 
+                (104.0, 177.0, 123.0),
+                swapRB=False
+            )
+            
+            # Detect faces
+            detectors.net.setInput(blob)
+            detections = detectors.net.forward()
+            
+            # Process detections
+            height, width = enhanced_image.shape[:2]
+            best_confidence = 0
+            
+            for i in range(detections.shape[2]):
+                confidence = detections[0, 0, i, 2]
                 
-                # If faces found
-                if len(faces) > 0:
-                    # Get the largest face if multiple detected
-                    if len(faces) > 1:
-                        faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
+                if confidence > 0.5 and confidence > best_confidence:  # Confidence threshold
+                    best_confidence = confidence
+                    box = detections[0, 0, i, 3:7] * np.array([width, height, width, height])
+                    (x1, y1, x2, y2) = box.astype("int")
                     
-                    face_box = tuple(faces[0])
+                    # Store face box
+                    face_box = (max(0, x1), max(0, y1), min(width, x2 - x1), min(height, y2 - y1))
                     face_detected = True
-                    logger.info("Face detected with Haar Cascade")
-            except Exception as cascade_error:
-                logger.error(f"Haar Cascade face detection error: {cascade_error}")
+                    
+                    logger.info(f"Face detected with DNN, confidence: {confidence:.2f}")
+        except Exception as dnn_error:
+            logger.error(f"DNN face detection error: {dnn_error}")
+    
+    # If DNN failed, try with Haar Cascade
+    if not face_detected:
+        try:
+            gray = cv2.cvtColor(enhanced_image, cv2.COLOR_BGR2GRAY)
+            face_cascade = detectors.cascade
+            
+            # First attempt - standard parameters
+            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+            
+            # Second attempt - more lenient parameters
+            if len(faces) == 0:
+                faces = face_cascade.detectMultiScale(
+                    gray, 
+                    scaleFactor=1.05, 
+                    minNeighbors=3, 
+                    minSize=(30, 30)
+                )
+            
+            # Third attempt - even more lenient
+            if len(faces) == 0:
+                faces = face_cascade.detectMultiScale(
+                    gray, 
+                    scaleFactor=1.03, 
+                    minNeighbors=2, 
+                    minSize=(20, 20)
+                )
+            
+            # If faces found
+            if len(faces) > 0:
+                # Get the largest face if multiple detected
+                if len(faces) > 1:
+                    faces = sorted(faces, key=lambda x: x[2] * x[3], reverse=True)
+                
+                face_box = tuple(faces[0])
+                face_detected = True
+                logger.info("Face detected with Haar Cascade")
+        except Exception as cascade_error:
+            logger.error(f"Haar Cascade face detection error: {cascade_error}")
+    
+    if not face_detected or face_box is None:
+        return None
+    
+    # Extract face from image
+    x, y, w, h = face_box
+    face_img = enhanced_image[y:y+h, x:x+w]
+    
+    # Resize to standard size
+    face_img = cv2.resize(face_img, (150, 150))
+    
+    # Use HOG features for recognition
+    face_features = detectors.hog.compute(face_img).flatten()
+    
+    # Normalize features
+    face_features = face_features.astype(np.float32)
+    return face_features / np.linalg.norm(face_features)
+
+def best_face_match(face_features: np.ndarray, users: List[dict]) -> Optional[Dict[str, Any]]:
+    """The registered user whose stored features are most similar (cosine similarity)."""
+    best_match = None
+    best_similarity = -1
+    
+    for user in users:
+        if "face_features" not in user:
+            continue
+        
+        # Convert stored features to numpy array
+        stored_features = np.array(user["face_features"], dtype=np.float32)
+        
+        # Calculate similarity (cosine similarity)
+        similarity = np.dot(face_features, stored_features) / (
+            np.linalg.norm(face_features) * np.linalg.norm(stored_features)
+        )
+        
+        if similarity > best_similarity:
+            best_similarity = similarity
+            best_match = {
+                "user_id": str(user["_id"]),
+                "email": user["email"],
+                "name": user.get("name", ""),
+                "role": user.get("role", "patient"),
+                "confidence": float(similarity)
+            }
+    return best_match
+
+@app.post("/api/verify-face", response_model=Dict[str, Any])
+async def verify_face(
+    face_image: UploadFile = File(...),
+    background_tasks: BackgroundTasks = BackgroundTasks(),
+    _admitted: None = Depends(admission.guard("face"))
+):
+    """Verify user by face recognition."""
+    try:
+        # Stream the upload in chunks, enforcing the size limit as it arrives
+        with await ingest_upload(face_image, settings.MAX_UPLOAD_SIZE) as upload:
+            content = upload.read()
+            
+        # Validate file type
+        if not face_image.content_type.startswith("image/"):
+            raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
+        
+        # Decoding, enhancement, detection and HOG run on the ML thread pool
+        loop = asyncio.get_running_loop()
+        try:
+            face_features = await loop.run_in_executor(ml_executor, extract_face_features, content)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid image format or corrupted image")
         
         # Return if no face detected
-        if not face_detected or face_box is None:
+        if face_features is None:
             return {
                 "verified": False,
                 "message": "No face detected in the image. Please try again with better lighting and make sure your face is clearly visible."
             }
         
-        # Extract face from image
-        x, y, w, h = face_box
-        face_img = enhanced_image[y:y+h, x:x+w]
-        
-        # Resize to standard size
-        face_img = cv2.resize(face_img, (150, 150))
-        
-        # Extract face features
         try:
-            # Use HOG features for recognition
-            hog = cv2.HOGDescriptor()
-            h = hog.compute(face_img)
-            face_features = h.flatten()
-            
-            # Normalize features
-            face_features = face_features.astype(np.float32)
-            face_features = face_features / np.linalg.norm(face_features)
-            
             # Find users with registered face features
             users_with_faces = list(users_collection.find(
                 {"face_features": {"$exists": True}},
@@ -1747,32 +2296,9 @@ async def verify_face(
             ))
             
             # Compare with stored features
-            best_match = None
-            best_similarity = -1
+            best_match = await loop.run_in_executor(ml_executor, best_face_match, face_features, users_with_faces)
             threshold = 0.6  # Similarity threshold
             
-            for user in users_with_faces:
-                if "face_features" not in user:
-                    continue
-                
-                # Convert stored features to numpy array
-                stored_features = np.array(user["face_features"], dtype=np.float32)
-                
-                # Calculate similarity (cosine similarity)
-                similarity = np.dot(face_features, stored_features) / (
-                    np.linalg.norm(face_features) * np.linalg.norm(stored_features)
-                )
-                
-                if similarity > best_similarity:
-                    best_similarity = similarity
-                    best_match = {
-                        "user_id": str(user["_id"]),
-                        "email": user["email"],
-                        "name": user.get("name", ""),
-                        "role": user.get("role", "patient"),
-                        "confidence": float(similarity)
-                    }
-            
             # If match found with sufficient confidence
             if best_match and best_match["confidence"] > threshold:
                 # Create access token
@@ -1811,6 +2337,8 @@ async def verify_face(
             "verified": False,
             "message": "Face not recognized. Please register or try again with better lighting."
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Unexpected error in face verification: {e}")
         raise HTTPException(
@@ -1825,10 +2353,9 @@ async def register_face(
 ):
     """Register a user's face for biometric authentication."""
     try:
-        # Validate file size
-        content = await face_image.read()
-        if len(content) > settings.MAX_UPLOAD_SIZE:
-            raise HTTPException(status_code=413, detail="File size too large")
+        # Stream the upload in chunks, enforcing the size limit as it arrives
+        with await ingest_upload(face_image, settings.MAX_UPLOAD_SIZE) as upload:
+            content = upload.read()
             
         # Validate file type
         if not face_image.content_type.startswith("image/"):
@@ -1841,34 +2368,12 @@ async def register_face(
         if image is None:
             raise HTTPException(status_code=400, detail="Invalid image format or corrupted image")
         
-        # Ensure faces directory exists
-        face_dir = os.path.join(settings.UPLOAD_DIR, "faces")
-        os.makedirs(face_dir, exist_ok=True)
-        
-        # Create user-specific directory
-        user_face_dir = os.path.join(face_dir, str(current_user["_id"]))
-        os.makedirs(user_face_dir, exist_ok=True)
-        
-        # Save original image securely
-        secure_name = secure_filename(face_image.filename)
-        filepath = os.path.join(user_face_dir, secure_name)
-        
-        with open(filepath, "wb") as f:
-            f.seek(0)
-            f.write(content)
-        
         # Detect faces
         face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         faces = face_cascade.detectMultiScale(gray, 1.3, 5)
         
         if len(faces) == 0:
-            # Remove saved image since we couldn't process it
-            try:
-                os.remove(filepath)
-            except:
-                pass
-                
             raise HTTPException(
                 status_code=400, 
                 detail="No face detected in the image. Please try again with a clearer photo."
@@ -1893,10 +2398,8 @@ async def register_face(
         # Extract face region
         face_img = image[y:y+h, x:x+w]
         
-        # Save cropped face image
-        face_filename = f"face_{secure_filename(face_image.filename)}"
-        face_filepath = os.path.join(user_face_dir, face_filename)
-        cv2.imwrite(face_filepath, face_img)
+        # Only the cropped face is kept, not the original photo
+        face_jpeg = cv2.imencode(".jpg", face_img)[1].tobytes()
         
         # Resize for consistent processing
         face_img = cv2.resize(face_img, (150, 150))
@@ -1915,6 +2418,9 @@ async def register_face(
             # Convert numpy array to list for MongoDB storage
             face_features_list = face_features.tolist()
             
+            # Stored only once features succeed, so failed attempts leave nothing behind
+            face_filepath = (await blob_store.put_bytes(face_jpeg, ".jpg"))["path"]
+            
             # Check if user already has a face registered
             existing_face = users_collection.find_one(
                 {"_id": current_user["_id"], "face_features": {"$exists": True}}
@@ -1950,14 +2456,6 @@ async def register_face(
             }
             
         except Exception as e:
-            # Clean up on error
-            try:
-                os.remove(filepath)
-                if os.path.exists(face_filepath):
-                    os.remove(face_filepath)
-            except:
-                pass
-                
             logger.error(f"Error in face feature extraction: {str(e)}", exc_info=True)
             raise HTTPException(
                 status_code=500,
@@ -1979,40 +2477,46 @@ async def upload_aadhaar(
     current_user: dict = Depends(get_current_user)
 ):
     """Process Aadhaar card and store extracted details."""
+    upload = None
     try:
-        # Validate file size
-        content = await aadhaar_image.read()
-        if len(content) > settings.MAX_UPLOAD_SIZE:
-            raise HTTPException(status_code=413, detail="File size too large")
+        # Stream the upload in chunks, enforcing the size limit as it arrives
+        upload = await ingest_upload(aadhaar_image, settings.MAX_UPLOAD_SIZE)
+        content = upload.read()
             
         # Validate file type
         if not aadhaar_image.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Process image
-        np_image = np.frombuffer(content, dtype=np.uint8)
-        image = cv2.imdecode(np_image, cv2.IMREAD_COLOR)
-        
-        if image is None:
+        # Locate the card and OCR only its text regions, in the OCR worker pool
+        try:
+            extracted = await ocr_service.run(extract_aadhaar, content)
+        except OcrBusyError:
+            raise HTTPException(status_code=503, detail="OCR is busy. Please try again shortly.", headers={"Retry-After": "5"})
+        except ValueError:
             raise HTTPException(status_code=400, detail="Invalid image format or corrupted file")
         
-        # In production, implement OCR using libraries like Tesseract, Azure Computer Vision, etc.
-        # For this demo, we'll use current user details
+        aadhaar_number = extracted["aadhaar_number"]
+        if aadhaar_number is None:
+            raise HTTPException(
+                status_code=422,
+                detail="Could not read a valid Aadhaar number. Please upload a clear photo of the front of the card."
+            )
+        
+        # The full number is never stored: only a masked form and a keyed hash
         details = {
-            "name": current_user.get("name", "John Doe"),
-            "dob": current_user.get("dob", "1990-01-01"),
-            "gender": current_user.get("gender", "Male"),
-            "aadhaar_number": f"XXXX XXXX {random.randint(1000, 9999)}",
-            "address": "123 Sample Street, Example City, State - 560001"
+            "name": extracted["name"],
+            "dob": extracted["dob"],
+            "gender": extracted["gender"],
+            "aadhaar_number": mask_aadhaar(aadhaar_number),
+            "aadhaar_hash": aadhaar_fingerprint(aadhaar_number, settings.SECRET_KEY),
+            "ocr_confidence": extracted["confidence"],
+            "card_found": extracted["card_found"]
         }
         
-        # Save file securely
+        # Save file by content hash; re-uploads of the same card reuse the stored copy
+        blob = await blob_store.put_upload(upload)
         secure_name = secure_filename(aadhaar_image.filename)
-        filepath = os.path.join(settings.UPLOAD_DIR, "aadhaar", secure_name)
-        
-        with open(filepath, "wb") as f:
-            f.seek(0)
-            f.write(content)
+        filepath = blob["path"]
         
         # Store in database
         details["user_id"] = current_user["_id"]
@@ -2020,6 +2524,7 @@ async def upload_aadhaar(
         details["processed_at"] = datetime.utcnow()
         details["file_path"] = filepath
         details["file_name"] = secure_name
+        details["blob_key"] = blob["key"]
         
         # Update user record
         users_collection.update_one(
@@ -2061,18 +2566,85 @@ async def upload_aadhaar(
     except Exception as e:
         logger.error(f"Error processing Aadhaar upload: {e}")
         raise HTTPException(status_code=500, detail="Error processing Aadhaar card")
+    finally:
+        if upload is not None:
+            upload.close()
+
+async def analyze_report_with_gemini(report_text):
+    """Ask Gemini to analyze a report the rule-based parser could not read"""
+    try:
+        # Define a prompt for Gemini to analyze the blood report
+        prompt = f"""
+        You are a medical AI assistant. Analyze the following blood test report and provide a detailed analysis in JSON format. Include:
+        - A list of abnormal values (if any) with their normal ranges and severity levels (low, moderate, high).
+        - An overall severity score from 0 to 10 (0 being normal, 10 being critical).
+        - Recommendations for the patient based on the findings.
+
+        Blood Report:
+        {report_text}
+
+        Return the response in this JSON structure:
+        {{
+            "abnormalValues": [
+                {{"parameter": "string", "value": "string", "normalRange": "string", "severity": "string"}}
+            ],
+            "severityScore": number,
+            "recommendations": ["string"]
+        }}
+        """
+        
+        # Call Gemini API
+        analysis_text = (await gemini.generate(prompt)).strip()
+        
+        # Parse the response as JSON
+        try:
+            analysis_results = json.loads(analysis_text)
+        except json.JSONDecodeError as e:
+            logger.error(f"Gemini response parsing failed: {str(e)}. Response: {analysis_text}")
+            # Fallback response in case JSON parsing fails
+            analysis_results = {
+                "abnormalValues": [],
+                "severityScore": 0,
+                "recommendations": ["Unable to analyze report fully. Consult a doctor for detailed evaluation."],
+                "source": "fallback"
+            }
+        
+        # Validate the structure of analysis_results
+        if not isinstance(analysis_results, dict) or \
+           "abnormalValues" not in analysis_results or \
+           "severityScore" not in analysis_results or \
+           "recommendations" not in analysis_results:
+            logger.warning("Invalid Gemini response structure. Using fallback.")
+            analysis_results = {
+                "abnormalValues": [],
+                "severityScore": 0,
+                "recommendations": ["Error in analysis. Please consult a healthcare professional."],
+                "source": "fallback"
+            }
+            
+    except Exception as gemini_error:
+        logger.error(f"Gemini API error: {str(gemini_error)}")
+        # Fallback in case Gemini API fails
+        analysis_results = {
+            "abnormalValues": [],
+            "severityScore": 0,
+            "recommendations": ["Analysis unavailable due to technical issues. Please try again or consult a doctor."],
+            "source": "fallback"
+        }
+    analysis_results.setdefault("source", "gemini")
+    return analysis_results
 
 @app.post("/api/analyze-blood-report", response_model=Dict[str, Any])
 async def analyze_blood_report(
     blood_report: UploadFile = File(...),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    _admitted: None = Depends(admission.guard("blood_report"))
 ):
-    """Analyze blood test report using Gemini API."""
+    """Analyze a blood test report with the rule-based lab parser, falling back to Gemini."""
+    upload = None
     try:
-        # Validate file size
-        content = await blood_report.read()
-        if len(content) > settings.MAX_UPLOAD_SIZE:
-            raise HTTPException(status_code=413, detail="File size too large")
+        # Stream the upload in chunks, enforcing the size limit as it arrives
+        upload = await ingest_upload(blood_report, settings.MAX_UPLOAD_SIZE)
             
         # Validate file type
         valid_types = ["application/pdf", "image/jpeg", "image/png", "image/tiff", "text/plain"]
@@ -2081,103 +2653,55 @@ async def analyze_blood_report(
         
         # Process based on file type
         report_text = ""
+        ocr_confidence = None
+        blob = None
         if blood_report.content_type == "text/plain":
-            report_text = content.decode("utf-8")
+            report_text = upload.read().decode("utf-8")
         elif blood_report.content_type == "application/pdf":
-            # In production, use a library like PyPDF2, pdfplumber, or pdf2image + Tesseract to extract text
-            # For demo purposes, we'll use a placeholder implementation
+            # Stored first, so extraction workers open the file instead of each receiving its bytes
+            blob = await blob_store.put_upload(upload)
+            # Pages are extracted in parallel off the event loop; scanned pages go to OCR
             try:
-                import PyPDF2
-                from io import BytesIO
-                
-                pdf_reader = PyPDF2.PdfReader(BytesIO(content))
-                report_text = ""
-                for page_num in range(len(pdf_reader.pages)):
-                    report_text += pdf_reader.pages[page_num].extract_text()
+                extraction = await document_extractor.extract_pdf(blob["path"], upload.sha256)
+                report_text = extraction["text"]
+                if extraction["truncated"]:
+                    logger.warning(f"Blood report PDF truncated to {extraction['pages_extracted']} of {extraction['page_count']} pages")
             except Exception as e:
-                logger.warning(f"PyPDF2 extraction failed: {str(e)}. Using fallback text.")
-                # Fallback if PyPDF2 is not available or fails
-                report_text = "Hemoglobin: 14.2 g/dL\nWhite Blood Cells: 7.5 x10^9/L\nPlatelets: 250 x10^9/L\nGlucose: 95 mg/dL"
+                logger.warning(f"PDF extraction failed: {str(e)}")
+                raise HTTPException(status_code=422, detail="Could not read text from the uploaded PDF.")
         else:
-            # For images, in production use Tesseract OCR or a cloud OCR service
+            # Preprocessed and OCR'd in the worker pool, off the event loop
             try:
-                import pytesseract
-                from PIL import Image
-                from io import BytesIO
-                
-                image = Image.open(BytesIO(content))
-                report_text = pytesseract.image_to_string(image)
+                ocr_result = await ocr_service.recognize(upload.read())
+                report_text = ocr_result["text"]
+                ocr_confidence = ocr_result["mean_confidence"]
+            except OcrBusyError:
+                raise HTTPException(status_code=503, detail="OCR is busy. Please try again shortly.", headers={"Retry-After": "5"})
             except Exception as e:
-                logger.warning(f"OCR extraction failed: {str(e)}. Using fallback text.")
-                # Fallback if OCR dependencies are not available
-                report_text = "Hemoglobin: 13.8 g/dL\nWhite Blood Cells: 6.9 x10^9/L\nPlatelets: 230 x10^9/L\nGlucose: 92 mg/dL"
+                logger.warning(f"OCR extraction failed: {str(e)}")
+                raise HTTPException(status_code=422, detail="Could not read text from the uploaded image.")
+
+        if not report_text.strip():
+            raise HTTPException(status_code=422, detail="No text could be extracted from the uploaded report.")
 
-        # Save file in a secure manner
+        # Save file by content hash; identical reports share one stored copy
+        if blob is None:
+            blob = await blob_store.put_upload(upload)
         secure_name = secure_filename(blood_report.filename)
-        filepath = os.path.join(settings.UPLOAD_DIR, "blood_reports", secure_name)
-        
-        with open(filepath, "wb") as f:
-            f.seek(0)
-            f.write(content)
-        
-        # Analyze with Gemini API
-        try:
-            # Define a prompt for Gemini to analyze the blood report
-            prompt = f"""
-            You are a medical AI assistant. Analyze the following blood test report and provide a detailed analysis in JSON format. Include:
-            - A list of abnormal values (if any) with their normal ranges and severity levels (low, moderate, high).
-            - An overall severity score from 0 to 10 (0 being normal, 10 being critical).
-            - Recommendations for the patient based on the findings.
-
-            Blood Report:
-            {report_text}
-
-            Return the response in this JSON structure:
-            {{
-                "abnormalValues": [
-                    {{"parameter": "string", "value": "string", "normalRange": "string", "severity": "string"}}
-                ],
-                "severityScore": number,
-                "recommendations": ["string"]
-            }}
-            """
-            
-            # Call Gemini API
-            response = model.generate_content(prompt)
-            analysis_text = response.text.strip()
-            
-            # Parse the response as JSON
-            try:
-                analysis_results = json.loads(analysis_text)
-            except json.JSONDecodeError as e:
-                logger.error(f"Gemini response parsing failed: {str(e)}. Response: {analysis_text}")
-                # Fallback response in case JSON parsing fails
-                analysis_results = {
-                    "abnormalValues": [],
-                    "severityScore": 0,
-                    "recommendations": ["Unable to analyze report fully. Consult a doctor for detailed evaluation."]
-                }
-            
-            # Validate the structure of analysis_results
-            if not isinstance(analysis_results, dict) or \
-               "abnormalValues" not in analysis_results or \
-               "severityScore" not in analysis_results or \
-               "recommendations" not in analysis_results:
-                logger.warning("Invalid Gemini response structure. Using fallback.")
-                analysis_results = {
-                    "abnormalValues": [],
-                    "severityScore": 0,
-                    "recommendations": ["Error in analysis. Please consult a healthcare professional."]
-                }
-                
-        except Exception as gemini_error:
-            logger.error(f"Gemini API error: {str(gemini_error)}")
-            # Fallback in case Gemini API fails
-            analysis_results = {
-                "abnormalValues": [],
-                "severityScore": 0,
-                "recommendations": ["Analysis unavailable due to technical issues. Please try again or consult a doctor."]
-            }
+        filepath = blob["path"]
+        
+        # Well-formed reports are analyzed locally; only reports the rules cannot read go to Gemini
+        parsed_report = lab_panel.parse_report(report_text)
+        sex = lab_panel.patient_sex(current_user.get("gender"))
+        age = lab_panel.patient_age(current_user.get("dob"))
+        if parsed_report.confident:
+            analysis_results = lab_panel.analyze(parsed_report, sex, age)
+        else:
+            analysis_results = await analyze_report_with_gemini(report_text)
+            if analysis_results.get("source") == "fallback" and parsed_report.measurements:
+                # A partial local analysis beats an empty one
+                analysis_results = lab_panel.analyze(parsed_report, sex, age)
+                analysis_results["source"] = "rules_partial"
         
         # Store results in database
         report_data = {
@@ -2187,13 +2711,23 @@ async def analyze_blood_report(
             "report_text": report_text,
             "filename": secure_name,
             "file_path": filepath,
+            "blob_key": blob["key"],
             "content_type": blood_report.content_type,
-            "file_size": len(content),
+            "file_size": upload.size,
+            "sha256": upload.sha256,
+            "ocr_confidence": ocr_confidence,
             "analysis_results": analysis_results,
             "created_at": datetime.utcnow()
         }
         
         report_id = medical_reports_collection.insert_one(report_data).inserted_id
+        health_summaries.record_report(
+            current_user["email"],
+            "blood",
+            str(report_id),
+            analysis_results.get("severityScore", 0),
+            report_data["created_at"]
+        )
         
         # Log action
         log_audit(
@@ -2232,19 +2766,22 @@ async def analyze_blood_report(
     except Exception as e:
         logger.error(f"Error analyzing blood report: {e}")
         raise HTTPException(status_code=500, detail="Error analyzing blood report")
+    finally:
+        if upload is not None:
+            upload.close()
     
     
 @app.post("/api/analyze-xray", response_model=Dict[str, Any])
 async def analyze_xray(
     xray_image: UploadFile = File(...),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    _admitted: None = Depends(admission.guard("xray"))
 ):
     """Analyze chest X-ray image with comprehensive medical analysis pipeline."""
+    upload = None
     try:
         # ==================== File Validation ====================
-        content = await xray_image.read()
-        if len(content) > settings.MAX_UPLOAD_SIZE:
-            raise HTTPException(status_code=413, detail="File size exceeds limit")
+        upload = await ingest_upload(xray_image, settings.MAX_UPLOAD_SIZE)
 
         # Enhanced DICOM validation
         is_dicom = (
@@ -2260,134 +2797,36 @@ async def analyze_xray(
         analysis_dir = os.path.join(settings.UPLOAD_DIR, "xrays", analysis_id)
         os.makedirs(analysis_dir, exist_ok=True)
 
+        # The original goes to the content-addressed store; derived images stay per analysis
+        blob = await blob_store.put_upload(upload)
         secure_name = secure_filename(xray_image.filename)
-        original_path = os.path.join(analysis_dir, secure_name)
-        with open(original_path, "wb") as f:
-            f.write(content)
+        original_path = blob["path"]
 
         # ==================== Image Processing ====================
+        # Decoding, inference and report generation run on the ML thread pool, off the event loop
+        loop = asyncio.get_running_loop()
+        processed_path = os.path.join(analysis_dir, "processed.jpg")
         try:
-            if is_dicom:
-                with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                    tmp.write(content)
-                    ds = pydicom.dcmread(tmp.name)
-                    img_array = ds.pixel_array
-                    
-                    if getattr(ds, 'PhotometricInterpretation', '') == "MONOCHROME1":
-                        img_array = np.amax(img_array) - img_array
-                    
-                    img_array = exposure.rescale_intensity(img_array, out_range=(0, 255))
-                    pil_image = Image.fromarray(img_array.astype(np.uint8)).convert('RGB')
-            else:
-                pil_image = Image.open(BytesIO(content)).convert('RGB')
-
-            processed_path = os.path.join(analysis_dir, "processed.jpg")
-            pil_image.save(processed_path)
+            # Decoded straight from the spooled upload rather than a copy in memory
+            pil_image = await loop.run_in_executor(ml_executor, decode_xray, upload.open(), is_dicom, processed_path)
         except Exception as e:
             logger.error(f"Image processing failed: {str(e)}")
             raise HTTPException(status_code=400, detail="Invalid image format")
 
         # ==================== Model Inference ====================
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        logger.info(f"Using device: {device}")
-
-        # Model configuration with verified models
-        model_configs = [
-            {
-                "type": "huggingface",
-                "name": "microsoft/BiomedVLP-CXR-BERT-general",
-                "fine_tuned": True,
-                "classes": [
-                    "Atelectasis", "Cardiomegaly", "Consolidation", "Edema",
-                    "Effusion", "Emphysema", "Fibrosis", "Hernia", "Infiltration",
-                    "Mass", "Nodule", "Pleural_Thickening", "Pneumonia", "Pneumothorax"
-                ],
-                "weights": None
-            },
-            {
-                "type": "torchvision",
-                "name": "densenet121",
-                "weights": torchvision.models.DenseNet121_Weights.DEFAULT,
-                "classes": [
-                    "Atelectasis", "Consolidation", "Infiltration", "Pneumothorax",
-                    "Edema", "Emphysema", "Fibrosis", "Effusion", "Pneumonia",
-                    "Pleural_Thickening", "Cardiomegaly", "Nodule", "Mass", "Hernia"
-                ]
-            }
-        ]
-
-        model, processor, model_metadata = None, None, {}
-        for cfg in model_configs:
-            try:
-                if cfg["type"] == "huggingface":
-                    processor = AutoImageProcessor.from_pretrained(cfg["name"])
-                    model = AutoModelForImageClassification.from_pretrained(cfg["name"]).to(device)
-                else:
-                    processor = cfg["weights"].transforms()
-                    model = getattr(torchvision.models, cfg["name"])(weights=cfg["weights"]).to(device)
-                
-                model.eval()
-                model_metadata = cfg
-                break
-            except Exception as e:
-                logger.warning(f"Model {cfg['name']} failed: {str(e)}")
-                continue
-
-        if not model:
-            raise HTTPException(status_code=503, detail="All models failed to load")
-
-        # Preprocess and run inference
-        prompt='tThis is a chest X-ray image for analysis'
+        # Models are loaded once and cached; heatmap and report text come from the same run
         try:
-            if model_metadata["type"] == "huggingface":
-                inputs = processor(pil_image,text=prompt, return_tensors="pt").to(device)
-                img_tensor = inputs.pixel_values
-            else:
-                img_tensor = processor(pil_image).unsqueeze(0).to(device)
-            
-            with torch.no_grad():
-                outputs = model(img_tensor)
-                logits = outputs.logits if hasattr(outputs, 'logits') else outputs
-                preds = torch.sigmoid(logits).cpu().numpy()[0]
-        except Exception as e:
+            inference = await loop.run_in_executor(ml_executor, analyze_xray_image, pil_image, processed_path, analysis_dir)
+        except ModelUnavailableError:
+            raise HTTPException(status_code=503, detail="All models failed to load")
+        except InferenceError as e:
             logger.error(f"Inference failed: {str(e)}")
             raise HTTPException(status_code=500, detail="Model inference error")
 
-        # ==================== Heatmap Generation ====================
-        heatmap_path = None
-        try:
-            # Fixed missing parenthesis here
-            target_layer = next((module for module in model.modules() 
-                               if isinstance(module, torch.nn.Conv2d)), None)
-            
-            if target_layer:
-                cam = GradCAM(model=model, target_layers=[target_layer])
-                grayscale_cam = cam(input_tensor=img_tensor, targets=None)[0]
-                
-                # Resize to original image dimensions
-                img_width, img_height = pil_image.size
-                heatmap = cv2.resize(grayscale_cam, (img_width, img_height))
-                heatmap = cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
-                
-                img = cv2.imread(processed_path)
-                if img is not None:
-                    superimposed_img = cv2.addWeighted(img, 0.6, heatmap, 0.4, 0)
-                    heatmap_path = os.path.join(analysis_dir, "heatmap.jpg")
-                    cv2.imwrite(heatmap_path, superimposed_img)
-        except Exception as e:
-            logger.error(f"Heatmap generation failed: {str(e)}")
-
-        # ==================== Medical Report Generation ====================
-        report_text = "Normal chest X-ray findings."
-        try:
-            report_processor = AutoProcessor.from_pretrained("microsoft/BiomedVLP-CXR-BERT-general")
-            report_model = BlipForConditionalGeneration.from_pretrained("microsoft/BiomedVLP-CXR-BERT-general").to(device)
-            
-            inputs = report_processor(pil_image, return_tensors="pt").to(device)
-            report_ids = report_model.generate(**inputs, max_length=150)
-            report_text = report_processor.decode(report_ids[0], skip_special_tokens=True)
-        except Exception as e:
-            logger.warning(f"Report generation failed: {str(e)}")
+        preds = inference["preds"]
+        model_metadata = inference["model_metadata"]
+        heatmap_path = inference["heatmap_path"]
+        report_text = inference["report_text"]
 
         # ==================== Clinical Analysis ====================
         findings = []
@@ -2441,9 +2880,11 @@ async def analyze_xray(
             "report_type": "xray",
             "filename": secure_name,
             "file_path": original_path,
+            "blob_key": blob["key"],
             "heatmap_path": heatmap_path,
             "content_type": xray_image.content_type,
-            "file_size": len(content),
+            "file_size": upload.size,
+            "sha256": upload.sha256,
             "analysis_results": analysis_results,
             "is_dicom": is_dicom,
             "analysis_id": analysis_id,
@@ -2453,6 +2894,13 @@ async def analyze_xray(
         try:
             # Main report insertion
             report_id = medical_reports_collection.insert_one(report_data).inserted_id
+            health_summaries.record_report(
+                current_user["email"],
+                "xray",
+                str(report_id),
+                severity_score,
+                report_data["created_at"]
+            )
             
             # Audit logging
             log_audit(
@@ -2497,98 +2945,33 @@ async def analyze_xray(
     except Exception as e:
         logger.error(f"Analysis pipeline failed: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Medical analysis system error")
+    finally:
+        if upload is not None:
+            upload.close()
 
 @app.post("/api/health-assessment", response_model=Dict[str, Any])
 async def complete_health_assessment(
-    request: Request,
+    data: HealthAssessmentRequest = Depends(json_body(HealthAssessmentRequest, MAX_ASSESSMENT_BODY)),
     current_user: dict = Depends(get_current_user)
 ):
     """Complete a comprehensive health assessment."""
     try:
-        # Get request body
-        data = await request.json()
-        
-        # Validate required data
-        required_sections = ["medicalHistory", "vitalSigns"]
-        for section in required_sections:
-            if section not in data:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Missing required section: {section}"
-                )
-        
         # Combine information from various sources
-        medical_history = data.get("medicalHistory", {})
-        vital_signs = data.get("vitalSigns", {})
-        document_analysis = data.get("documentAnalysis", {})
-        ai_consultation = data.get("aiConsultation", {})
+        medical_history = data.medicalHistory.model_dump(exclude_none=True) if data.medicalHistory else {}
+        vital_signs = data.vitalSigns.model_dump(exclude_none=True) if data.vitalSigns else {}
+        document_analysis = data.documentAnalysis or {}
+        ai_consultation = data.aiConsultation or {}
         
-        # Validate risk factors
+        # Derive risk factors with the same rules used by the health summary
         risk_factors = []
-        
-        # Check vital signs
-        # Added null checks to prevent TypeError
-        heart_rate = vital_signs.get("heartRate")
-        if heart_rate is not None and isinstance(heart_rate, (int, float)) and heart_rate > 100:
-            risk_factors.append("Elevated heart rate")
-        if heart_rate is not None and isinstance(heart_rate, (int, float)) and heart_rate < 60:
-            risk_factors.append("Low heart rate")
-            
-        # Parse blood pressure if available
-        bp_str = vital_signs.get("bloodPressure", "")
-        if bp_str and isinstance(bp_str, str) and "/" in bp_str:
-            try:
-                systolic, diastolic = map(int, bp_str.split("/"))
-                if systolic > 140 or diastolic > 90:
-                    risk_factors.append("Hypertension risk")
-                if systolic < 90 or diastolic < 60:
-                    risk_factors.append("Hypotension risk")
-            except ValueError:
-                pass  # Skip if values can't be parsed
-                
-        oxygen_level = vital_signs.get("oxygenLevel")
-        if oxygen_level is not None and isinstance(oxygen_level, (int, float)) and oxygen_level < 95:
-            risk_factors.append("Low blood oxygen")
-            
-        temperature = vital_signs.get("temperature")
-        if temperature is not None and isinstance(temperature, (int, float)) and temperature > 37.5:
-            risk_factors.append("Elevated temperature")
-        
-        # Check medical history risk factors
-        if medical_history and isinstance(medical_history, dict) and medical_history.get("conditions"):
-            conditions = medical_history.get("conditions", [])
-            if isinstance(conditions, list):
-                for condition in conditions:
-                    if isinstance(condition, str):  # Ensure condition is a string
-                        condition_lower = condition.lower()
-                        if "diabetes" in condition_lower:
-                            risk_factors.append("Diabetes")
-                        if "hypertension" in condition_lower or "high blood pressure" in condition_lower:
-                            risk_factors.append("Hypertension")
-                        if "heart" in condition_lower and "disease" in condition_lower:
-                            risk_factors.append("Heart disease")
+        risk_factors.extend(vital_risk_factors(vital_signs))
+        risk_factors.extend(history_risk_factors(medical_history))
         
         # Calculate BMI if height and weight are available
         height_cm = medical_history.get("height") if medical_history else None
         weight_kg = medical_history.get("weight") if medical_history else None
-        bmi = None
-        
-        if height_cm is not None and weight_kg is not None:
-            try:
-                height_cm = float(height_cm)
-                weight_kg = float(weight_kg)
-                if height_cm > 0:  # Prevent division by zero
-                    height_m = height_cm / 100  # Convert to meters
-                    bmi = weight_kg / (height_m * height_m)
-                    
-                    if bmi < 18.5:
-                        risk_factors.append("Underweight")
-                    elif bmi >= 25:
-                        risk_factors.append("Overweight")
-                    elif bmi >= 30:
-                        risk_factors.append("Obesity")
-            except (ValueError, ZeroDivisionError, TypeError):
-                pass  # Skip BMI calculation if there's an error
+        bmi = calculate_bmi(height_cm, weight_kg)
+        risk_factors.extend(bmi_risk_factors(bmi))
         
         # Calculate overall health score
         health_score = 80  # Base score
@@ -2660,6 +3043,7 @@ async def complete_health_assessment(
         }
         
         assessment_id = health_assessments_collection.insert_one(assessment_data).inserted_id
+        health_summaries.record_assessment(current_user["email"], assessment_data)
         
         # Find appropriate doctors based on conditions and risk factors
         specialties_needed = set()
@@ -2696,15 +3080,7 @@ async def complete_health_assessment(
         # Find doctors with these specialties
         doctor_matches = []
         for specialty in specialties_needed:
-            doctors = list(doctors_collection.find(
-                {"specialty": specialty},
-                limit=2
-            ))
-            
-            for doctor in doctors:
-                if "_id" in doctor:
-                    doctor["_id"] = str(doctor["_id"])
-                doctor_matches.append(doctor)
+            doctor_matches.extend(doctor_directory.by_specialty(specialty, limit=2))
         
         # Log action
         try:
@@ -2735,31 +3111,58 @@ async def complete_health_assessment(
         logger.error(f"Error completing health assessment: {str(e)}")
         raise HTTPException(status_code=500, detail="Error completing health assessment")
 
-@app.get("/api/user/profile", response_model=Dict[str, Any])
-async def get_user_profile(current_user: dict = Depends(get_current_user)):
-    """Get current user profile information."""
-    try:
-        # Get recent medical information
+def load_profile_health(user_email, summary):
+    """Latest vitals, history, reports and assessment shown on the profile"""
+    recent_vitals = summary.get("latest_vitals")
+    if recent_vitals is None and not summary.get("counts", {}).get("vital_signs"):
+        # Users with data predating the summary
         recent_vitals = vital_signs_collection.find_one(
-            {"user_email": current_user["email"]},
+            {"user_email": user_email},
             sort=[("recorded_at", -1)]
         )
-        
+    
+    recent_medical_history = summary.get("latest_medical_history")
+    if recent_medical_history is None and not summary.get("counts", {}).get("medical_history"):
         recent_medical_history = medical_history_collection.find_one(
-            {"user_email": current_user["email"]},
+            {"user_email": user_email},
             sort=[("created_at", -1)]
         )
-        
-        recent_reports = list(medical_reports_collection.find(
-            {"user_email": current_user["email"]},
-            sort=[("created_at", -1)],
-            limit=5
-        ))
-        
+    
+    recent_reports = list(medical_reports_collection.find(
+        {"user_email": user_email},
+        sort=[("created_at", -1)],
+        limit=5
+    ))
+    
+    recent_health_assessment = summary.get("latest_assessment")
+    if recent_health_assessment is None:
         recent_health_assessment = health_assessments_collection.find_one(
-            {"user_email": current_user["email"]},
+            {"user_email": user_email},
             sort=[("created_at", -1)]
         )
+    
+    return {
+        "vital_signs": recent_vitals,
+        "medical_history": recent_medical_history,
+        "recent_reports": recent_reports,
+        "recent_health_assessment": recent_health_assessment
+    }
+
+@app.get("/api/user/profile", response_model=Dict[str, Any])
+async def get_user_profile(current_user: dict = Depends(get_current_user)):
+    """Get current user profile information."""
+    try:
+        # Latest state comes from the materialized summary (single point lookup)
+        summary = health_summaries.get(current_user["email"]) or {}
+        
+        # Keyed by the summary's update time, so any health data write
+        # produces a new key and stale entries simply age out
+        health = await cache.get_or_load(
+            "profile_health",
+            (current_user["email"], str(summary.get("updated_at"))),
+            lambda: asyncio.to_thread(load_profile_health, current_user["email"], summary),
+            ttl=300
+        )
         
         # Get upcoming appointments
         upcoming_appointments = list(appointments_collection.find(
@@ -2774,18 +3177,16 @@ async def get_user_profile(current_user: dict = Depends(get_current_user)):
         # Join doctor information with appointments
         for appointment in upcoming_appointments:
             if "doctor_id" in appointment:
-                doctor = doctors_collection.find_one({"_id": appointment["doctor_id"]})
+                doctor = doctor_directory.get(appointment["doctor_id"])
                 if doctor:
-                    appointment["doctor"] = sanitize_document(doctor)
+                    appointment["doctor"] = doctor
         
         # Format the response
         profile_data = {
             "user": current_user,
-            "vital_signs": sanitize_document(recent_vitals),
-            "medical_history": sanitize_document(recent_medical_history),
-            "recent_reports": sanitize_document(recent_reports),
-            "recent_health_assessment": sanitize_document(recent_health_assessment),
-            "upcoming_appointments": sanitize_document(upcoming_appointments)
+            **health,
+            "upcoming_appointments": upcoming_appointments,
+            "health_summary": summary or None
         }
         
         # Log action
@@ -2795,14 +3196,120 @@ async def get_user_profile(current_user: dict = Depends(get_current_user)):
             {}
         )
         
-        return {
+        return MongoJSONResponse({
             "message": "Profile retrieved successfully",
             "data": profile_data
-        }
+        })
     except Exception as e:
         logger.error(f"Error retrieving user profile: {e}")
         raise HTTPException(status_code=500, detail="Error retrieving user profile")
 
+@app.get("/api/user/health-summary", response_model=Dict[str, Any])
+async def get_health_summary(current_user: dict = Depends(get_current_user)):
+    """Get the materialized health summary for the current user."""
+    try:
+        summary = health_summaries.get(current_user["email"])
+        return MongoJSONResponse({
+            "message": "Health summary retrieved successfully",
+            "data": summary
+        })
+    except Exception as e:
+        logger.error(f"Error retrieving health summary: {e}")
+        raise HTTPException(status_code=500, detail="Error retrieving health summary")
+
+# Heavy fields left out of history listings
+REPORT_LIST_PROJECTION = {"report_text": 0, "file_path": 0, "analysis_results.medical_report": 0}
+ASSESSMENT_LIST_PROJECTION = {"medical_history": 0, "vital_signs": 0, "document_analysis": 0, "ai_consultation": 0}
+
+def paginated_history(collection, query, cursor, limit, projection=None):
+    """Run a keyset page query and shape the list response"""
+    try:
+        page = keyset_page(collection, query, cursor=cursor, limit=limit, projection=projection)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {
+        "data": page["items"],
+        "next_cursor": page["next_cursor"],
+        "has_more": page["has_more"]
+    }
+
+@app.get("/api/user/reports", response_model=Dict[str, Any])
+async def list_medical_reports(
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    report_type: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """List the user's medical reports, newest first, using cursor pagination."""
+    try:
+        query = {"user_email": current_user["email"]}
+        if report_type:
+            query["report_type"] = report_type
+        page = paginated_history(medical_reports_collection, query, cursor, limit, REPORT_LIST_PROJECTION)
+        return MongoJSONResponse({"message": "Reports retrieved successfully", **page})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing medical reports: {e}")
+        raise HTTPException(status_code=500, detail="Error listing medical reports")
+
+@app.get("/api/user/assessments", response_model=Dict[str, Any])
+async def list_health_assessments(
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    current_user: dict = Depends(get_current_user)
+):
+    """List the user's health assessments, newest first, using cursor pagination."""
+    try:
+        query = {"user_email": current_user["email"]}
+        page = paginated_history(health_assessments_collection, query, cursor, limit, ASSESSMENT_LIST_PROJECTION)
+        return MongoJSONResponse({"message": "Assessments retrieved successfully", **page})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing health assessments: {e}")
+        raise HTTPException(status_code=500, detail="Error listing health assessments")
+
+@app.get("/api/user/health-history", response_model=Dict[str, Any])
+async def list_health_history(
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    entry_type: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """List the user's health history entries, newest first, using cursor pagination."""
+    try:
+        query = {"user_email": current_user["email"]}
+        if entry_type:
+            query["entry_type"] = entry_type
+        page = paginated_history(db["health_history"], query, cursor, limit)
+        return MongoJSONResponse({"message": "Health history retrieved successfully", **page})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing health history: {e}")
+        raise HTTPException(status_code=500, detail="Error listing health history")
+
+@app.get("/api/user/appointments", response_model=Dict[str, Any])
+async def list_appointments(
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    status: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """List the user's appointments by booking time, newest first, using cursor pagination."""
+    try:
+        query = {"user_email": current_user["email"]}
+        if status:
+            query["status"] = status
+        page = paginated_history(appointments_collection, query, cursor, limit, {"notes": 0})
+        return MongoJSONResponse({"message": "Appointments retrieved successfully", **page})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error listing appointments: {e}")
+        raise HTTPException(status_code=500, detail="Error listing appointments")
+
 # Keep the remaining routes (analyze-blood-report, analyze-xray, etc.) with the same simplification approach
 
 
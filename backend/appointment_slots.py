@@ -0,0 +1,157 @@
+"""
+Appointment slot availability engine.
+
+Each doctor/day pair is a compact ``doctor_slots`` document whose
+``booked_mask`` integer holds one bit per slot of the working day. Reserving a
+slot is a single conditional ``$bit`` update that only matches when the bit
+is clear, so two concurrent bookings for the same slot cannot both succeed.
+A unique partial index on scheduled appointments backs this up at the
+appointment level. Whenever an appointment leaves ``scheduled`` its bit is
+released; appointments booked before bitmaps existed are backfilled by a
+migration.
+"""
+import logging
+from datetime import datetime, timedelta, date as date_cls
+from typing import Optional, Dict, Any, List, Iterable
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger("hospital_ai")
+
+SLOTS_COLLECTION = "doctor_slots"
+
+# Working day grid
+DAY_START = "09:00"
+DAY_END = "17:00"
+SLOT_MINUTES = 30
+
+
+def build_slot_times(day_start: str = DAY_START, day_end: str = DAY_END, minutes: int = SLOT_MINUTES) -> List[str]:
+    """Return the HH:MM start times of every slot in the working day."""
+    current = datetime.strptime(day_start, "%H:%M")
+    end = datetime.strptime(day_end, "%H:%M")
+    times = []
+    while current < end:
+        times.append(current.strftime("%H:%M"))
+        current += timedelta(minutes=minutes)
+    return times
+
+
+SLOT_TIMES = build_slot_times()
+SLOT_INDEX = {t: i for i, t in enumerate(SLOT_TIMES)}
+FULL_MASK = (1 << len(SLOT_TIMES)) - 1
+
+
+def slot_key(doctor_id, date: str) -> str:
+    return f"{doctor_id}:{date}"
+
+
+def free_times(mask: int) -> List[str]:
+    """Decode a booked bitmap into the list of free slot times."""
+    return [t for i, t in enumerate(SLOT_TIMES) if not (mask >> i) & 1]
+
+
+class SlotUnavailableError(Exception):
+    """Raised when a slot is already reserved."""
+
+
+class AppointmentSlotEngine:
+    """Per-doctor/per-day slot bitmaps with atomic reservation."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def reserve(self, doctor_id, date: str, time: str) -> Dict[str, Any]:
+        """Atomically mark a slot as booked, raising if it is already taken."""
+        index = SLOT_INDEX.get(time)
+        if index is None:
+            raise ValueError(f"Time must be one of the available slots: {', '.join(SLOT_TIMES)}")
+        bit = 1 << index
+        doctor_id = str(doctor_id)
+        key = slot_key(doctor_id, date)
+
+        # Create the day document on first use
+        self.collection.update_one(
+            {"_id": key},
+            {"$setOnInsert": {
+                "doctor_id": doctor_id,
+                "date": date,
+                "booked_mask": 0,
+                "booked_count": 0
+            }},
+            upsert=True
+        )
+
+        # Only matches while the slot bit is still clear
+        updated = self.collection.find_one_and_update(
+            {"_id": key, "booked_mask": {"$bitsAllClear": bit}},
+            {
+                "$bit": {"booked_mask": {"or": bit}},
+                "$inc": {"booked_count": 1},
+                "$set": {"updated_at": datetime.utcnow()}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if updated is None:
+            raise SlotUnavailableError(f"Slot {date} {time} is already booked")
+        return updated
+
+    def release(self, doctor_id, date: str, time: str):
+        """Clear a slot bit, e.g. after a failed insert or a cancellation."""
+        index = SLOT_INDEX.get(time)
+        if index is None:
+            return
+        bit = 1 << index
+        try:
+            self.collection.update_one(
+                {"_id": slot_key(doctor_id, date), "booked_mask": {"$bitsAllSet": bit}},
+                {
+                    "$bit": {"booked_mask": {"and": FULL_MASK ^ bit}},
+                    "$inc": {"booked_count": -1},
+                    "$set": {"updated_at": datetime.utcnow()}
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error releasing slot {doctor_id} {date} {time}: {e}")
+
+    def booked_masks(self, doctor_ids: Iterable, start: str, end: str) -> Dict[str, int]:
+        """Load booked bitmaps for many doctors over a date range in one query."""
+        cursor = self.collection.find(
+            {"doctor_id": {"$in": list(doctor_ids)}, "date": {"$gte": start, "$lte": end}},
+            projection={"_id": 1, "booked_mask": 1}
+        )
+        return {doc["_id"]: doc.get("booked_mask", 0) for doc in cursor}
+
+    def free_slots(
+        self,
+        doctors: List[Dict[str, Any]],
+        start: date_cls,
+        days: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Return free slots for the given doctors over ``days`` days from ``start``.
+
+        Doctors are only offered on dates listed in their ``availability``.
+        """
+        start_str = start.isoformat()
+        end_str = (start + timedelta(days=days - 1)).isoformat()
+        masks = self.booked_masks([str(d["_id"]) for d in doctors], start_str, end_str)
+
+        results = []
+        for doctor in doctors:
+            doctor_id = str(doctor["_id"])
+            for day in sorted(doctor.get("availability", [])):
+                if day < start_str or day > end_str:
+                    continue
+                mask = masks.get(slot_key(doctor_id, day), 0)
+                if mask == FULL_MASK:
+                    continue
+                results.append({
+                    "doctor_id": doctor_id,
+                    "doctor_name": doctor.get("name"),
+                    "specialty": doctor.get("specialty"),
+                    "date": day,
+                    "free_times": free_times(mask)
+                })
+        results.sort(key=lambda r: (r["date"], r["doctor_name"] or ""))
+        return results
@@ -0,0 +1,131 @@
+"""
+Content-addressed storage for uploaded files.
+
+A blob's key is the SHA-256 of its bytes plus the original extension, and
+it lives at ``<root>/<h[0:2]>/<h[2:4]>/<key>`` so no directory grows too
+large. Storing the same bytes twice finds the existing blob and writes
+nothing. Writes happen on a worker thread into a temporary file that is
+renamed into place, so the event loop never waits on disk and a blob is
+never seen half-written.
+
+Because a blob may be shared by many records, blobs are only written once
+an upload has been accepted, and are never deleted to undo a failed
+request. ``BlobBackend`` is the storage interface; ``LocalBlobBackend`` is
+the filesystem implementation, and an S3-compatible backend can implement
+the same four methods.
+"""
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+import logging
+import os
+import tempfile
+from typing import Any, Dict, Iterable, Optional
+
+from uploads import IngestedUpload
+
+logger = logging.getLogger("hospital_ai")
+
+MAX_EXTENSION_LENGTH = 10
+
+
+class BlobBackend(ABC):
+    """Storage interface for content-addressed blobs."""
+
+    @abstractmethod
+    async def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def put(self, key: str, chunks: Iterable[bytes]):
+        ...
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def locate(self, key: str) -> str:
+        """Where the blob lives: a file path, or a URL for remote backends."""
+
+
+class LocalBlobBackend(BlobBackend):
+    """Blobs as files in sharded directories under ``root``."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def locate(self, key: str) -> str:
+        return os.path.join(self.root, key[0:2], key[2:4], key)
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(os.path.exists, self.locate(key))
+
+    def _write(self, key: str, chunks: Iterable[bytes]):
+        path = self.locate(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            # Atomic: concurrent writers of the same content simply replace each other
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    async def put(self, key: str, chunks: Iterable[bytes]):
+        await asyncio.to_thread(self._write, key, chunks)
+
+    async def get(self, key: str) -> bytes:
+        def read():
+            with open(self.locate(key), "rb") as f:
+                return f.read()
+
+        return await asyncio.to_thread(read)
+
+
+def blob_key(sha256: str, filename: Optional[str] = None) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if len(ext) > MAX_EXTENSION_LENGTH or not ext[1:].isalnum():
+        ext = ""
+    return f"{sha256}{ext}"
+
+
+class BlobStore:
+    """Deduplicating writes of uploads and derived files to a backend."""
+
+    def __init__(self, backend: BlobBackend):
+        self.backend = backend
+        self.writes = 0
+        self.deduplicated = 0
+
+    async def _store(self, key: str, size: int, chunks: Iterable[bytes]) -> Dict[str, Any]:
+        created = not await self.backend.exists(key)
+        if created:
+            await self.backend.put(key, chunks)
+            self.writes += 1
+        else:
+            self.deduplicated += 1
+        return {"key": key, "path": self.backend.locate(key), "size": size, "created": created}
+
+    async def put_upload(self, upload: IngestedUpload) -> Dict[str, Any]:
+        """Store an ingested upload, reusing its streamed SHA-256."""
+        key = blob_key(upload.sha256, upload.filename)
+        return await self._store(key, upload.size, upload.iter_chunks())
+
+    async def put_bytes(self, data: bytes, extension: str = "") -> Dict[str, Any]:
+        """Store bytes produced by the server, such as a cropped face."""
+        key = blob_key(hashlib.sha256(data).hexdigest(), f"blob{extension}")
+        return await self._store(key, len(data), [data])
+
+    async def get(self, key: str) -> bytes:
+        return await self.backend.get(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"writes": self.writes, "deduplicated": self.deduplicated}
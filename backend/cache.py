@@ -0,0 +1,237 @@
+"""
+Two-tier cache: an in-process LRU in front of Redis.
+
+Values are stored as orjson-encoded JSON (never pickle), so cached data is
+safe to share between workers and comes back as plain JSON types: ObjectIds
+and datetimes are returned as strings. Every key carries a version, so
+changing a cached payload's shape only requires bumping the version.
+
+Entries have a soft TTL shortly before the hard TTL. A read past the soft
+TTL returns the cached value and refreshes it in the background, and
+concurrent misses for the same key share one loader call, so an expiring
+hot key does not stampede the database.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import orjson
+
+from serialization import dumps
+
+logger = logging.getLogger("hospital_ai")
+
+# Fraction of the TTL after which a read triggers a background refresh
+EARLY_REFRESH_FRACTION = 0.8
+
+# Seconds to skip Redis after it fails
+REDIS_RETRY_INTERVAL = 30
+
+
+class CacheStats:
+    """Hit and miss counters for one cache name."""
+
+    def __init__(self):
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "hit_rate": round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else None
+        }
+
+
+class LocalLRU:
+    """Bounded in-process tier holding encoded values with their expiry times."""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[bytes, float, float]]" = OrderedDict()
+
+    def get(self, key: str, now: float) -> Optional[Tuple[bytes, float]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        raw, soft_expires, hard_expires = entry
+        if now >= hard_expires:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return raw, soft_expires
+
+    def set(self, key: str, raw: bytes, soft_expires: float, hard_expires: float):
+        self._entries[key] = (raw, soft_expires, hard_expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def make_key(name: str, version: str, parts: Tuple) -> str:
+    digest = hashlib.sha1(dumps(list(parts))).hexdigest()
+    return f"{name}:v{version}:{digest}"
+
+
+class TwoTierCache:
+    """Async get-or-load cache with LRU and Redis tiers."""
+
+    def __init__(self, redis_client=None, prefix: str = "cache", local_entries: int = 2048):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.local = LocalLRU(local_entries)
+        self.stats: Dict[str, CacheStats] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._redis_down_until = 0.0
+
+    def _stats(self, name: str) -> CacheStats:
+        if name not in self.stats:
+            self.stats[name] = CacheStats()
+        return self.stats[name]
+
+    def _redis_usable(self) -> bool:
+        return self.redis is not None and time.time() >= self._redis_down_until
+
+    def _redis_failed(self, stats: CacheStats, e: Exception):
+        stats.errors += 1
+        self._redis_down_until = time.time() + REDIS_RETRY_INTERVAL
+        logger.warning(f"Redis cache tier unavailable: {e}")
+
+    async def _read(self, name: str, key: str) -> Optional[Tuple[bytes, float]]:
+        """Return (encoded value, soft expiry) from the nearest tier that has it."""
+        stats = self._stats(name)
+        now = time.time()
+        local = self.local.get(key, now)
+        if local is not None:
+            stats.local_hits += 1
+            return local
+
+        if self._redis_usable():
+            try:
+                envelope = await self.redis.get(f"{self.prefix}:{key}")
+            except Exception as e:
+                self._redis_failed(stats, e)
+                envelope = None
+            if envelope is not None:
+                # Envelope is "<soft expiry>|<hard expiry>|<json>"
+                soft, hard, raw = envelope.split(b"|", 2)
+                self.local.set(key, raw, float(soft), float(hard))
+                stats.redis_hits += 1
+                return raw, float(soft)
+
+        stats.misses += 1
+        return None
+
+    async def _write(self, name: str, key: str, raw: bytes, ttl: float):
+        now = time.time()
+        soft_expires = now + ttl * EARLY_REFRESH_FRACTION
+        hard_expires = now + ttl
+        self.local.set(key, raw, soft_expires, hard_expires)
+        if self._redis_usable():
+            try:
+                await self.redis.set(
+                    f"{self.prefix}:{key}",
+                    f"{soft_expires:.3f}|{hard_expires:.3f}|".encode("ascii") + raw,
+                    px=int(ttl * 1000)
+                )
+            except Exception as e:
+                self._redis_failed(self._stats(name), e)
+
+    async def _load(self, name: str, key: str, loader: Callable[[], Awaitable[Any]], ttl: float) -> bytes:
+        """Run the loader once per key however many callers are waiting on it."""
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            raw = dumps(await loader())
+            await self._write(name, key, raw, ttl)
+            future.set_result(raw)
+            return raw
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._inflight[key]
+
+    async def _refresh(self, name: str, key: str, loader, ttl: float):
+        self._stats(name).refreshes += 1
+        try:
+            await self._load(name, key, loader, ttl)
+        except Exception as e:
+            logger.error(f"Background refresh of {name} cache failed: {e}")
+
+    async def get_or_load(
+        self,
+        name: str,
+        parts: Tuple,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: float,
+        version: str = "1"
+    ) -> Any:
+        """Return the cached value for ``parts``, calling ``loader`` on a miss."""
+        key = make_key(name, version, parts)
+        cached = await self._read(name, key)
+        if cached is not None:
+            raw, soft_expires = cached
+            if time.time() >= soft_expires and key not in self._inflight:
+                asyncio.create_task(self._refresh(name, key, loader, ttl))
+            return orjson.loads(raw)
+        return orjson.loads(await self._load(name, key, loader, ttl))
+
+    async def delete(self, name: str, parts: Tuple, version: str = "1"):
+        """Drop one entry from both tiers, e.g. after the underlying data changed."""
+        key = make_key(name, version, parts)
+        self.local.delete(key)
+        if self._redis_usable():
+            try:
+                await self.redis.delete(f"{self.prefix}:{key}")
+            except Exception as e:
+                self._redis_failed(self._stats(name), e)
+
+    def cached(self, name: str, ttl: float, version: str = "1"):
+        """Decorator caching an async function's result by its arguments."""
+
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                parts = (args, sorted(kwargs.items()))
+                return await self.get_or_load(name, parts, lambda: func(*args, **kwargs), ttl, version)
+
+            async def invalidate(*args, **kwargs):
+                await self.delete(name, (args, sorted(kwargs.items())), version)
+
+            wrapper.invalidate = invalidate
+            return wrapper
+
+        return decorator
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "local_entries": len(self.local),
+            "redis": self._redis_usable(),
+            "caches": {name: stats.as_dict() for name, stats in self.stats.items()}
+        }
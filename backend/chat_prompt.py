@@ -0,0 +1,137 @@
+"""
+Token-budgeted prompt construction for the medical chat.
+
+The static system prompt is sent as the model's system instruction and the
+conversation as Gemini chat history. Only the most recent messages are kept
+verbatim; older ones are folded, a batch at a time, into a rolling summary
+stored on the session. Per-turn payload therefore stays roughly constant
+instead of growing with the length of the conversation.
+"""
+import logging
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+logger = logging.getLogger("hospital_ai")
+
+# Approximate characters per token for English text
+CHARS_PER_TOKEN = 4
+
+# Token budget for summary, history and the new message together
+HISTORY_TOKEN_BUDGET = 3000
+
+# Recent messages kept verbatim (a turn is two messages)
+KEEP_RECENT_MESSAGES = 8
+
+# Older messages are folded into the summary once this many have piled up
+FOLD_BATCH = 4
+
+MAX_SUMMARY_TOKENS = 400
+
+SUMMARY_PROMPT = """You maintain a running clinical summary of a patient's conversation with a medical assistant.
+Update the summary with the new messages below. Keep every reported symptom, duration, severity,
+medication, allergy, relevant history and any answer the patient gave to a question. Drop pleasantries.
+Write at most {max_words} words of plain text.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+
+Updated summary:"""
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[-max_chars:] if keep_end else text[:max_chars]
+
+
+def format_messages(messages: List[Dict[str, str]]) -> str:
+    return "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+
+
+def extractive_summary(summary: str, messages: List[Dict[str, str]]) -> str:
+    """Fallback when the model cannot summarize: append the patient's own words."""
+    notes = [m["content"].strip() for m in messages if m["role"] == "user"]
+    combined = " ".join(filter(None, [summary, "Patient said: " + " | ".join(notes) if notes else ""]))
+    return truncate_to_tokens(combined, MAX_SUMMARY_TOKENS, keep_end=True)
+
+
+def _gemini_message(role: str, content: str) -> Dict[str, Any]:
+    return {"role": "model" if role == "assistant" else "user", "parts": [content]}
+
+
+class PromptBuilder:
+    """Builds bounded chat history and maintains the rolling summary."""
+
+    def __init__(
+        self,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        keep_recent: int = KEEP_RECENT_MESSAGES,
+        fold_batch: int = FOLD_BATCH
+    ):
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.fold_batch = fold_batch
+
+    def build_history(self, session: Dict[str, Any], message: str) -> List[Dict[str, Any]]:
+        """Gemini chat history for the next turn, within the token budget."""
+        summary = session.get("summary", "")
+        remaining = self.token_budget - estimate_tokens(message) - estimate_tokens(summary)
+
+        # Newest messages first until the budget runs out
+        selected = []
+        for entry in reversed(session["messages"][-self.keep_recent:]):
+            cost = estimate_tokens(entry["content"])
+            if cost > remaining:
+                break
+            selected.append(entry)
+            remaining -= cost
+        selected.reverse()
+
+        # Gemini history must start with a user turn
+        while selected and selected[0]["role"] != "user":
+            selected.pop(0)
+
+        history = []
+        if summary:
+            history.append(_gemini_message("user", f"Summary of our conversation so far: {summary}"))
+            history.append(_gemini_message("assistant", "Understood. I will take this into account."))
+        history.extend(_gemini_message(m["role"], m["content"]) for m in selected)
+        return history
+
+    async def compact(self, session: Dict[str, Any], summarize: Optional[Callable[[str], Awaitable[str]]] = None):
+        """
+        Fold messages older than the verbatim window into the rolling summary.
+
+        Only runs once ``fold_batch`` messages have aged out, so the summary
+        model is called once every few turns rather than on every turn.
+        """
+        messages = session["messages"]
+        older = messages[:-self.keep_recent] if len(messages) > self.keep_recent else []
+        if len(older) < self.fold_batch:
+            return
+
+        summary = session.get("summary", "")
+        new_summary = None
+        if summarize is not None:
+            prompt = SUMMARY_PROMPT.format(
+                max_words=MAX_SUMMARY_TOKENS * 3 // 4,
+                summary=summary or "(none)",
+                messages=format_messages(older)
+            )
+            try:
+                new_summary = (await summarize(prompt)).strip()
+            except Exception as e:
+                logger.warning(f"Chat summarization failed, using extractive summary: {e}")
+        if not new_summary:
+            new_summary = extractive_summary(summary, older)
+
+        session["summary"] = truncate_to_tokens(new_summary, MAX_SUMMARY_TOKENS)
+        session["messages"] = messages[-self.keep_recent:]
+        session["summarized_messages"] = session.get("summarized_messages", 0) + len(older)
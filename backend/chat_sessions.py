@@ -0,0 +1,129 @@
+"""
+Chat session storage for the medical chat.
+
+Sessions are small JSON documents keyed by session token. They live in
+Redis so any worker can serve any turn and sessions survive restarts; an
+in-process LRU with the same TTL takes over when Redis is unreachable.
+Each save refreshes the idle timeout, and the message list is capped so a
+long conversation cannot grow without bound.
+"""
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+
+import orjson
+
+logger = logging.getLogger("hospital_ai")
+
+# Idle sessions expire after this many seconds
+SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", "3600"))
+
+# Messages kept per session (a turn is a user and an assistant message)
+MAX_MESSAGES = int(os.getenv("CHAT_MAX_MESSAGES", "40"))
+
+# Sessions kept in memory when Redis is unavailable
+MAX_LOCAL_SESSIONS = 5000
+
+# Seconds to skip Redis after it fails
+REDIS_RETRY_INTERVAL = 30
+
+
+def new_session() -> Dict[str, Any]:
+    return {"messages": [], "created_at": time.time()}
+
+
+def cap_messages(session: Dict[str, Any], max_messages: int = MAX_MESSAGES) -> List[Dict[str, str]]:
+    """Drop the oldest messages beyond the cap and return what was dropped."""
+    messages = session["messages"]
+    overflow = len(messages) - max_messages
+    if overflow <= 0:
+        return []
+    dropped = messages[:overflow]
+    session["messages"] = messages[overflow:]
+    return dropped
+
+
+class LocalSessions:
+    """Bounded in-process session table with idle expiry."""
+
+    def __init__(self, max_sessions: int = MAX_LOCAL_SESSIONS, ttl: int = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[bytes]:
+        entry = self._sessions.get(token)
+        if entry is None:
+            return None
+        raw, expires_at = entry
+        if time.time() >= expires_at:
+            del self._sessions[token]
+            return None
+        self._sessions.move_to_end(token)
+        return raw
+
+    def set(self, token: str, raw: bytes):
+        self._sessions[token] = (raw, time.time() + self.ttl)
+        self._sessions.move_to_end(token)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def delete(self, token: str):
+        self._sessions.pop(token, None)
+
+
+class ChatSessionStore:
+    """Redis-backed chat sessions with a local fallback."""
+
+    def __init__(self, redis_client=None, ttl: int = SESSION_TTL, prefix: str = "chat_session"):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.local = LocalSessions(ttl=ttl)
+        self._redis_down_until = 0.0
+
+    def _redis_usable(self) -> bool:
+        return self.redis is not None and time.time() >= self._redis_down_until
+
+    def _redis_failed(self, e: Exception):
+        self._redis_down_until = time.time() + REDIS_RETRY_INTERVAL
+        logger.warning(f"Redis chat session store unavailable, using local sessions: {e}")
+
+    async def get(self, token: str) -> Optional[Dict[str, Any]]:
+        raw = None
+        if self._redis_usable():
+            try:
+                raw = await self.redis.get(f"{self.prefix}:{token}")
+            except Exception as e:
+                self._redis_failed(e)
+        if raw is None:
+            raw = self.local.get(token)
+        return orjson.loads(raw) if raw is not None else None
+
+    async def save(self, token: str, session: Dict[str, Any]):
+        """Store the session and restart its idle timeout."""
+        raw = orjson.dumps(session)
+        if self._redis_usable():
+            try:
+                await self.redis.set(f"{self.prefix}:{token}", raw, ex=self.ttl)
+                return
+            except Exception as e:
+                self._redis_failed(e)
+        self.local.set(token, raw)
+
+    async def create(self) -> Tuple[str, Dict[str, Any]]:
+        token = str(uuid.uuid4())
+        session = new_session()
+        await self.save(token, session)
+        return token, session
+
+    async def delete(self, token: str):
+        self.local.delete(token)
+        if self._redis_usable():
+            try:
+                await self.redis.delete(f"{self.prefix}:{token}")
+            except Exception as e:
+                self._redis_failed(e)
@@ -0,0 +1,87 @@
+"""
+Streaming helpers for the medical chat.
+
+Chunks arrive from the Gemini gateway's async stream. The parser watches
+the start of the reply for the ``FINAL DIAGNOSIS:`` marker: ordinary replies
+are forwarded chunk by chunk, while a diagnosis is held back and parsed as
+soon as its JSON block is complete.
+"""
+import json
+import re
+from typing import Any, Dict, Optional, Tuple
+
+from serialization import dumps
+
+FINAL_MARKER = "FINAL DIAGNOSIS:"
+
+FENCED_JSON = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> bytes:
+    """Encode one Server-Sent Event."""
+    return b"event: " + event.encode("ascii") + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+def parse_final_json(text: str) -> Optional[Dict[str, Any]]:
+    """Extract the diagnosis JSON from a fenced block, or from bare braces."""
+    match = FENCED_JSON.search(text)
+    candidate = match.group(1) if match else None
+    if candidate is None:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        candidate = text[start:end + 1]
+    try:
+        data = json.loads(candidate)
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class DiagnosisStreamParser:
+    """Splits a streamed reply into visible text or a final diagnosis."""
+
+    def __init__(self):
+        self.text = ""
+        self.is_final: Optional[bool] = None
+        self.final_data: Optional[Dict[str, Any]] = None
+        self._pending = ""
+
+    def feed(self, chunk: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Add a chunk; return text to forward now and the diagnosis once parsed.
+
+        Text is held back only while the reply could still start with the
+        marker, which is at most the first few characters.
+        """
+        self.text += chunk
+        self._pending += chunk
+
+        if self.is_final is None:
+            head = self.text.lstrip()
+            if len(head) >= len(FINAL_MARKER):
+                self.is_final = head.startswith(FINAL_MARKER)
+            elif not FINAL_MARKER.startswith(head):
+                self.is_final = False
+
+        if self.is_final is False:
+            visible, self._pending = self._pending, ""
+            return visible, None
+
+        if self.is_final and self.final_data is None:
+            match = FENCED_JSON.search(self.text)
+            if match:
+                self.final_data = parse_final_json(match.group(0))
+                if self.final_data is not None:
+                    return "", self.final_data
+        return "", None
+
+    def finish(self) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Flush at end of stream, trying a last parse of an unfenced diagnosis."""
+        if self.is_final and self.final_data is None:
+            self.final_data = parse_final_json(self.text)
+            return "", self.final_data
+        if not self.is_final:
+            visible, self._pending = self._pending, ""
+            return visible, None
+        return "", None
@@ -0,0 +1,185 @@
+"""
+In-memory doctor directory.
+
+The doctor roster changes rarely, so it is loaded once into process memory
+and indexed by id, normalized specialty and availability date. Lookups from
+request handlers become dictionary hits; the snapshot is rebuilt on a timer
+or when an admin triggers a refresh.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger("hospital_ai")
+
+# Seconds between background reloads
+REFRESH_INTERVAL = 300
+
+# Alternative spellings mapped to the canonical specialty used in the roster
+SPECIALTY_ALIASES = {
+    "general practitioner": "General Practitioner",
+    "general physician": "General Practitioner",
+    "gp": "General Practitioner",
+    "family medicine": "General Practitioner",
+    "cardiologist": "Cardiologist",
+    "cardiology": "Cardiologist",
+    "pulmonologist": "Pulmonologist",
+    "pulmonology": "Pulmonologist",
+    "chest specialist": "Pulmonologist",
+    "neurologist": "Neurologist",
+    "neurology": "Neurologist",
+    "dermatologist": "Dermatologist",
+    "dermatology": "Dermatologist",
+    "ent specialist": "ENT Specialist",
+    "ent": "ENT Specialist",
+    "otolaryngologist": "ENT Specialist",
+    "endocrinologist": "Endocrinologist",
+    "endocrinology": "Endocrinologist",
+    "gastroenterologist": "Gastroenterologist",
+    "gastroenterology": "Gastroenterologist",
+    "pediatrician": "Pediatrician",
+    "paediatrician": "Pediatrician",
+    "pediatrics": "Pediatrician",
+    "orthopedist": "Orthopedist",
+    "orthopedic": "Orthopedist",
+    "orthopaedic": "Orthopedist",
+    "orthopedic surgeon": "Orthopedist",
+    "orthopedics": "Orthopedist",
+    "ophthalmologist": "Ophthalmologist",
+    "eye specialist": "Ophthalmologist",
+    "psychiatrist": "Psychiatrist",
+    "psychiatry": "Psychiatrist",
+    "urologist": "Urologist",
+    "urology": "Urologist",
+    "rheumatologist": "Rheumatologist",
+    "oncologist": "Oncologist",
+    "oncology": "Oncologist",
+    "gynecologist": "Gynecologist",
+    "gynaecologist": "Gynecologist",
+    "obstetrician": "Gynecologist",
+    "nephrologist": "Nephrologist",
+    "allergist": "Allergist",
+    "geriatrician": "Geriatrician",
+    "sports medicine": "Sports Medicine",
+    "hematologist": "Hematologist",
+    "haematologist": "Hematologist",
+    "infectious disease": "Infectious Disease",
+    "infectious disease specialist": "Infectious Disease"
+}
+
+
+def specialty_key(name: Optional[str]) -> str:
+    """Lower-case, whitespace-collapsed key used for specialty lookups."""
+    if not name:
+        return ""
+    return re.sub(r"\s+", " ", str(name)).strip().lower()
+
+
+def normalize_specialty(name: Optional[str]) -> str:
+    """Map a specialty or one of its aliases to the canonical roster name."""
+    key = specialty_key(name)
+    if key in SPECIALTY_ALIASES:
+        return SPECIALTY_ALIASES[key]
+    # Tolerate plurals such as "Cardiologists"
+    if key.endswith("s") and key[:-1] in SPECIALTY_ALIASES:
+        return SPECIALTY_ALIASES[key[:-1]]
+    return str(name).strip() if name else ""
+
+
+def experience_years(doctor: Dict[str, Any]) -> int:
+    """Parse "15 years" style experience into an integer."""
+    match = re.search(r"\d+", str(doctor.get("experience", "")))
+    return int(match.group()) if match else 0
+
+
+def ranking_key(doctor: Dict[str, Any]):
+    return (-float(doctor.get("rating") or 0), -experience_years(doctor), doctor.get("name", ""))
+
+
+class DirectorySnapshot:
+    """Immutable indexes over one load of the doctors collection."""
+
+    def __init__(self, doctors: List[Dict[str, Any]]):
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_specialty: Dict[str, List[Dict[str, Any]]] = {}
+        self.by_date: Dict[str, List[Dict[str, Any]]] = {}
+
+        for doctor in sorted(doctors, key=ranking_key):
+            doctor["_id"] = str(doctor["_id"])
+            doctor["specialty"] = normalize_specialty(doctor.get("specialty"))
+            self.by_id[doctor["_id"]] = doctor
+            self.by_specialty.setdefault(specialty_key(doctor["specialty"]), []).append(doctor)
+            for day in doctor.get("availability", []) or []:
+                self.by_date.setdefault(day, []).append(doctor)
+
+        self.loaded_at = time.time()
+
+
+class DoctorDirectory:
+    """Cached doctor roster indexed by id, specialty and availability date."""
+
+    def __init__(self, collection, refresh_interval: int = REFRESH_INTERVAL):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self._snapshot = DirectorySnapshot([])
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.version = 0
+
+    def load(self) -> int:
+        """Rebuild the snapshot from Mongo and swap it in atomically."""
+        doctors = list(self.collection.find({}))
+        self._snapshot = DirectorySnapshot(doctors)
+        self.version += 1
+        logger.info(f"Doctor directory loaded with {len(doctors)} doctors")
+        return len(doctors)
+
+    @property
+    def loaded_at(self) -> float:
+        return self._snapshot.loaded_at
+
+    def get(self, doctor_id) -> Optional[Dict[str, Any]]:
+        doctor = self._snapshot.by_id.get(str(doctor_id))
+        return dict(doctor) if doctor else None
+
+    def by_specialty(self, specialty: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Doctors of a specialty (aliases accepted), best rated first."""
+        doctors = self._snapshot.by_specialty.get(specialty_key(normalize_specialty(specialty)), [])
+        if limit is not None:
+            doctors = doctors[:limit]
+        return [dict(d) for d in doctors]
+
+    def first_for_specialty(self, specialty: str) -> Optional[Dict[str, Any]]:
+        doctors = self.by_specialty(specialty, limit=1)
+        return doctors[0] if doctors else None
+
+    def available_on(self, date: str, specialty: Optional[str] = None) -> List[Dict[str, Any]]:
+        doctors = self._snapshot.by_date.get(date, [])
+        if specialty:
+            key = specialty_key(normalize_specialty(specialty))
+            doctors = [d for d in doctors if specialty_key(d["specialty"]) == key]
+        return [dict(d) for d in doctors]
+
+    def all(self) -> List[Dict[str, Any]]:
+        return [dict(d) for d in self._snapshot.by_id.values()]
+
+    async def refresh(self) -> int:
+        return await asyncio.to_thread(self.load)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Doctor directory refresh failed: {e}")
+
+    def start(self):
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
@@ -0,0 +1,213 @@
+"""
+Doctor search backed by a precomputed ranking.
+
+The ranking combines rating, experience, how soon the doctor has a free slot
+and how loaded their upcoming schedule is, so bookings spread across doctors
+instead of always landing on whoever sorts first. Entries are rebuilt from
+the doctor directory and slot bitmaps in the background; searches only
+filter and page an in-memory list.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
+
+from appointment_slots import SLOT_INDEX, FULL_MASK, free_times
+from doctor_directory import experience_years, normalize_specialty, specialty_key
+
+logger = logging.getLogger("hospital_ai")
+
+# Days ahead considered for next-free-slot, load and date filters; matches the booking window
+HORIZON_DAYS = 90
+
+# Seconds between background rebuilds
+REBUILD_INTERVAL = 60
+
+MAX_PAGE_SIZE = 50
+
+# Score weights; each component is normalized to 0..1
+RANKING_WEIGHTS = {
+    "rating": 0.45,
+    "experience": 0.15,
+    "availability": 0.25,
+    "load": 0.15
+}
+
+
+class RankedDoctor:
+    """One doctor's ranking inputs and derived score."""
+
+    def __init__(self, doctor: Dict[str, Any], masks: Dict[str, int]):
+        self.doctor = doctor
+        self.doctor_id = doctor["_id"]
+        self.specialty_key = specialty_key(doctor.get("specialty"))
+        self.rating = float(doctor.get("rating") or 0)
+        self.experience = experience_years(doctor)
+        self.masks = masks
+        self.score = 0.0
+
+    def open_dates(self, today: str, horizon_end: str) -> List[str]:
+        return [
+            day for day in sorted(self.doctor.get("availability", []) or [])
+            if today <= day <= horizon_end and self.masks.get(day, 0) != FULL_MASK
+        ]
+
+    def next_free_slot(self, today: str, horizon_end: str) -> Optional[Dict[str, str]]:
+        for day in self.open_dates(today, horizon_end):
+            times = free_times(self.masks.get(day, 0))
+            if times:
+                return {"date": day, "time": times[0]}
+        return None
+
+    def booked_slots(self) -> int:
+        return sum(bin(mask).count("1") for mask in self.masks.values())
+
+    def has_free_slot_on(self, day: str, today: str, horizon_end: str) -> bool:
+        # Masks are only loaded inside the horizon, so later dates cannot be judged free
+        return (
+            today <= day <= horizon_end
+            and day in (self.doctor.get("availability") or [])
+            and self.masks.get(day, 0) != FULL_MASK
+        )
+
+
+class DoctorSearchIndex:
+    """In-memory ranked doctor list with filtering and pagination."""
+
+    def __init__(self, directory, slot_engine, rebuild_interval: int = REBUILD_INTERVAL):
+        self.directory = directory
+        self.slot_engine = slot_engine
+        self.rebuild_interval = rebuild_interval
+        self._entries: List[RankedDoctor] = []
+        self._by_id: Dict[str, RankedDoctor] = {}
+        self._dirty = False
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self.built_at = 0.0
+
+    def _window(self):
+        today = datetime.utcnow().date()
+        return today.isoformat(), (today + timedelta(days=HORIZON_DAYS - 1)).isoformat()
+
+    def rebuild(self) -> int:
+        """Recompute ranking inputs from the directory and slot bitmaps."""
+        doctors = self.directory.all()
+        today, horizon_end = self._window()
+        masks = self.slot_engine.booked_masks([d["_id"] for d in doctors], today, horizon_end)
+
+        # Keys are "<doctor_id>:<date>"; group them by doctor in one pass
+        by_doctor: Dict[str, Dict[str, int]] = {}
+        for key, mask in masks.items():
+            doctor_id, _, day = key.rpartition(":")
+            by_doctor.setdefault(doctor_id, {})[day] = mask
+
+        entries = [RankedDoctor(doctor, by_doctor.get(str(doctor["_id"]), {})) for doctor in doctors]
+
+        self._score(entries)
+        self._entries = entries
+        self._by_id = {e.doctor_id: e for e in entries}
+        self._dirty = False
+        self.built_at = time.time()
+        return len(entries)
+
+    def _score(self, entries: List[RankedDoctor]):
+        if not entries:
+            return
+        today, horizon_end = self._window()
+        max_experience = max(e.experience for e in entries) or 1
+        max_load = max(e.booked_slots() for e in entries) or 1
+        today_date = datetime.strptime(today, "%Y-%m-%d").date()
+
+        for entry in entries:
+            next_slot = entry.next_free_slot(today, horizon_end)
+            if next_slot:
+                days_out = (datetime.strptime(next_slot["date"], "%Y-%m-%d").date() - today_date).days
+                availability = 1 - days_out / HORIZON_DAYS
+            else:
+                availability = 0.0
+            entry.score = round(
+                RANKING_WEIGHTS["rating"] * min(entry.rating / 5, 1)
+                + RANKING_WEIGHTS["experience"] * entry.experience / max_experience
+                + RANKING_WEIGHTS["availability"] * availability
+                + RANKING_WEIGHTS["load"] * (1 - entry.booked_slots() / max_load),
+                4
+            )
+        entries.sort(key=lambda e: (-e.score, e.doctor.get("name", "")))
+
+    def record_booking(self, doctor_id, day: str, time_str: str):
+        """Apply a booking to the in-memory masks so the next search reflects it."""
+        entry = self._by_id.get(str(doctor_id))
+        index = SLOT_INDEX.get(time_str)
+        if entry is None or index is None:
+            return
+        entry.masks[day] = entry.masks.get(day, 0) | (1 << index)
+        self._dirty = True
+
+    def record_release(self, doctor_id, day: str, time_str: str):
+        """Apply a cancellation to the in-memory masks."""
+        entry = self._by_id.get(str(doctor_id))
+        index = SLOT_INDEX.get(time_str)
+        if entry is None or index is None:
+            return
+        entry.masks[day] = entry.masks.get(day, 0) & ~(1 << index)
+        self._dirty = True
+
+    def search(
+        self,
+        specialty: Optional[str] = None,
+        date: Optional[str] = None,
+        min_rating: Optional[float] = None,
+        page: int = 1,
+        page_size: int = 10
+    ) -> Dict[str, Any]:
+        """Filter and page the ranked list."""
+        if self._dirty:
+            self._score(self._entries)
+            self._dirty = False
+
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        page = max(1, page)
+        key = specialty_key(normalize_specialty(specialty)) if specialty else None
+        today, horizon_end = self._window()
+
+        matches = [
+            e for e in self._entries
+            if (key is None or e.specialty_key == key)
+            and (min_rating is None or e.rating >= min_rating)
+            and (date is None or e.has_free_slot_on(date, today, horizon_end))
+        ]
+
+        start = (page - 1) * page_size
+        items = []
+        for entry in matches[start:start + page_size]:
+            item = dict(entry.doctor)
+            item["score"] = entry.score
+            item["next_free_slot"] = entry.next_free_slot(today, horizon_end)
+            item["upcoming_booked_slots"] = entry.booked_slots()
+            if date:
+                item["free_times"] = free_times(entry.masks.get(date, 0))
+            items.append(item)
+
+        return {
+            "items": items,
+            "page": page,
+            "page_size": page_size,
+            "total": len(matches)
+        }
+
+    async def _rebuild_loop(self):
+        while True:
+            await asyncio.sleep(self.rebuild_interval)
+            try:
+                await asyncio.to_thread(self.rebuild)
+            except Exception as e:
+                logger.error(f"Doctor search index rebuild failed: {e}")
+
+    def start(self):
+        if self._rebuild_task is None:
+            self._rebuild_task = asyncio.create_task(self._rebuild_loop())
+
+    def stop(self):
+        if self._rebuild_task is not None:
+            self._rebuild_task.cancel()
+            self._rebuild_task = None
@@ -0,0 +1,188 @@
+"""
+PDF text extraction off the event loop.
+
+PDFs are parsed in a process pool: pages are split into one batch per
+worker and extracted in parallel, up to a page cap. Pages that yield almost
+no text but carry an embedded image are treated as scanned, and only those
+pages are sent to OCR. Results are structured per page and cached by the
+SHA-256 of the file, so re-uploading the same report costs one cache read.
+A document can be given as bytes or as a file path; with a path, workers
+open the file themselves instead of each receiving a copy of its bytes.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger("hospital_ai")
+
+# Pages extracted per document; the rest are reported as truncated
+MAX_PDF_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Seconds allowed for one batch of pages
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "60"))
+
+# Pages with less text than this and an embedded image are treated as scanned
+MIN_TEXT_CHARS = 20
+
+CACHE_TTL = 7 * 24 * 3600
+
+# PDF bytes, or the path of a PDF file
+PdfSource = Union[bytes, str]
+
+
+def _reader(source: PdfSource):
+    import PyPDF2
+
+    return PyPDF2.PdfReader(source if isinstance(source, str) else BytesIO(source))
+
+
+def _count_pages(source: PdfSource) -> int:
+    return len(_reader(source).pages)
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _largest_image(page) -> Optional[bytes]:
+    """Bytes of the biggest embedded image on a page, which for a scan is the page itself."""
+    try:
+        images = list(page.images)
+    except Exception:
+        return None
+    if not images:
+        return None
+    return max(images, key=lambda image: len(image.data)).data
+
+
+def _extract_page_batch(source: PdfSource, page_numbers: List[int]) -> List[Dict[str, Any]]:
+    """Extract text from some pages of a PDF; runs in a worker process."""
+    reader = _reader(source)
+    pages = []
+    for number in page_numbers:
+        page = reader.pages[number]
+        try:
+            text = (page.extract_text() or "").strip()
+        except Exception:
+            text = ""
+        entry = {"page": number + 1, "text": text, "method": "text"}
+        if len(text) < MIN_TEXT_CHARS:
+            image = _largest_image(page)
+            if image is not None:
+                entry["method"] = "ocr"
+                entry["image"] = image
+            elif not text:
+                entry["method"] = "empty"
+        pages.append(entry)
+    return pages
+
+
+def _ocr_image(image: bytes) -> str:
+    import pytesseract
+    from PIL import Image
+
+    return pytesseract.image_to_string(Image.open(BytesIO(image)))
+
+
+class DocumentExtractor:
+    """Parallel, cached PDF text extraction in a process pool."""
+
+    def __init__(
+        self,
+        cache=None,
+        max_workers: int = EXTRACTION_WORKERS,
+        max_pages: int = MAX_PDF_PAGES,
+        ocr: Optional[Callable[[bytes], Awaitable[str]]] = None
+    ):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_pages = max_pages
+        self.ocr = ocr
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned workers do not inherit the API process's loaded models
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(self._pool(), fn, *args), EXTRACTION_TIMEOUT)
+
+    async def _ocr_page(self, image: bytes) -> str:
+        if self.ocr is not None:
+            return await self.ocr(image)
+        return await self._run(_ocr_image, image)
+
+    async def _extract(self, source: PdfSource, digest: str) -> Dict[str, Any]:
+        total = await self._run(_count_pages, source)
+        numbers = list(range(min(total, self.max_pages)))
+
+        # One batch per worker, so the file is opened or copied once per worker
+        batch_size = max(1, math.ceil(len(numbers) / self.max_workers))
+        batches = [numbers[i:i + batch_size] for i in range(0, len(numbers), batch_size)]
+        results = await asyncio.gather(*(self._run(_extract_page_batch, source, b) for b in batches))
+        pages = [page for batch in results for page in batch]
+
+        scanned = [page for page in pages if "image" in page]
+        if scanned:
+            texts = await asyncio.gather(
+                *(self._ocr_page(page.pop("image")) for page in scanned),
+                return_exceptions=True
+            )
+            for page, text in zip(scanned, texts):
+                if isinstance(text, Exception):
+                    logger.warning(f"OCR failed for page {page['page']}: {text}")
+                    page["method"] = "ocr_failed"
+                else:
+                    page["text"] = text.strip()
+
+        return {
+            "sha256": digest,
+            "page_count": total,
+            "pages_extracted": len(pages),
+            "truncated": total > len(pages),
+            "pages": pages,
+            "text": "\n".join(page["text"] for page in pages if page["text"])
+        }
+
+    async def extract_pdf(self, source: PdfSource, digest: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Per-page text of a PDF given as bytes or a file path, plus the joined text.
+
+        Pass ``digest`` if the SHA-256 is already known.
+        """
+        if digest is None:
+            if isinstance(source, str):
+                digest = await asyncio.to_thread(_file_sha256, source)
+            else:
+                digest = hashlib.sha256(source).hexdigest()
+        if self.cache is None:
+            return await self._extract(source, digest)
+        return await self.cache.get_or_load(
+            "pdf_text",
+            (digest, self.max_pages),
+            lambda: self._extract(source, digest),
+            ttl=CACHE_TTL
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
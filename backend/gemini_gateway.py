@@ -0,0 +1,294 @@
+"""
+Gateway for all Gemini calls.
+
+Calls go through the SDK's async API, so handlers never block the event
+loop. A per-process semaphore bounds concurrent requests, each attempt has a
+timeout, and rate-limit or server errors are retried with jittered
+exponential backoff. After repeated failures a circuit breaker opens and
+calls fail fast with ``GeminiUnavailableError``, so callers drop straight
+into their fallback responses instead of queueing behind a dead upstream.
+
+Set ``GEMINI_BACKEND=fake`` to use a local fake with canned replies and
+configurable latency and error rate, for offline load testing.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger("hospital_ai")
+
+MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+REQUEST_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+
+# Backoff before retry n is uniform in [0, min(BACKOFF_CAP, BACKOFF_BASE * 2**n)]
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+# Consecutive failures that open the breaker, and how long it stays open
+BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+    ConnectionError
+)
+
+Contents = Union[str, List[Dict[str, Any]]]
+
+
+class GeminiUnavailableError(Exception):
+    """Raised when Gemini cannot be reached or the circuit breaker is open."""
+
+    def __init__(self, message: str, retry_after: float = BREAKER_COOLDOWN):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed, open or half-open breaker over consecutive failures."""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open":
+            remaining = self.cooldown - (time.monotonic() - self.opened_at)
+            raise GeminiUnavailableError("Gemini circuit breaker is open", retry_after=remaining)
+        if state == "half_open":
+            # Let a single trial call through to probe recovery
+            if self._trial_running:
+                raise GeminiUnavailableError("Gemini circuit breaker is half-open", retry_after=1)
+            self._trial_running = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"Gemini circuit breaker opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """End a half-open trial that finished without a verdict."""
+        self._trial_running = False
+
+
+class GoogleGeminiBackend:
+    """Gemini via the google-generativeai async API."""
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        self.model_name = model_name
+        self._models: Dict[Optional[str], Any] = {}
+
+    def _model(self, system_instruction: Optional[str]):
+        # One model object per distinct system instruction
+        if system_instruction not in self._models:
+            self._models[system_instruction] = genai.GenerativeModel(
+                self.model_name, system_instruction=system_instruction
+            )
+        return self._models[system_instruction]
+
+    async def generate(self, contents: Contents, system_instruction: Optional[str] = None) -> str:
+        response = await self._model(system_instruction).generate_content_async(contents)
+        return response.text
+
+    async def stream(self, contents: Contents, system_instruction: Optional[str] = None) -> AsyncIterator[str]:
+        response = await self._model(system_instruction).generate_content_async(contents, stream=True)
+        async for chunk in response:
+            yield chunk.text or ""
+
+
+class FakeGeminiBackend:
+    """
+    Offline stand-in with canned replies.
+
+    Chat asks a few questions and then returns a ``FINAL DIAGNOSIS:`` block;
+    blood report prompts get a JSON analysis. Latency and error rate can be
+    set through ``GEMINI_FAKE_LATENCY`` and ``GEMINI_FAKE_ERROR_RATE``.
+    """
+
+    QUESTIONS = [
+        "How long have you had these symptoms?",
+        "Do you have a fever, and if so how high has it been?",
+        "Are you taking any medications or do you have any allergies?"
+    ]
+
+    def __init__(self, latency: Optional[float] = None, error_rate: Optional[float] = None):
+        self.latency = latency if latency is not None else float(os.getenv("GEMINI_FAKE_LATENCY", "0.3"))
+        self.error_rate = error_rate if error_rate is not None else float(os.getenv("GEMINI_FAKE_ERROR_RATE", "0"))
+
+    def _reply(self, contents: Contents) -> str:
+        if isinstance(contents, str):
+            if "Blood Report" in contents:
+                return json.dumps({
+                    "abnormalValues": [],
+                    "severityScore": 1,
+                    "recommendations": ["Values are within normal limits. Continue routine check-ups."]
+                })
+            return "Patient reported symptoms and answered follow-up questions."
+
+        user_turns = sum(1 for c in contents if c.get("role") == "user")
+        if user_turns <= len(self.QUESTIONS):
+            return self.QUESTIONS[user_turns - 1]
+        return (
+            "FINAL DIAGNOSIS:\n```json\n"
+            + json.dumps({
+                "diagnosis": "Common cold",
+                "recommendations": ["Rest and hydrate", "See a doctor if symptoms worsen"],
+                "doctor_specialty": "General Practitioner"
+            })
+            + "\n```"
+        )
+
+    async def _simulate(self):
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if random.random() < self.error_rate:
+            raise google_exceptions.ServiceUnavailable("Fake Gemini backend error")
+
+    async def generate(self, contents: Contents, system_instruction: Optional[str] = None) -> str:
+        await self._simulate()
+        return self._reply(contents)
+
+    async def stream(self, contents: Contents, system_instruction: Optional[str] = None) -> AsyncIterator[str]:
+        await self._simulate()
+        for piece in re.findall(r".{1,12}", self._reply(contents), re.DOTALL):
+            await asyncio.sleep(0.02)
+            yield piece
+
+
+def backend_from_env():
+    if os.getenv("GEMINI_BACKEND", "google").lower() == "fake":
+        logger.info("Using fake Gemini backend")
+        return FakeGeminiBackend()
+    return GoogleGeminiBackend()
+
+
+class GeminiGateway:
+    """Bounded, retrying and circuit-broken access to a Gemini backend."""
+
+    def __init__(
+        self,
+        backend,
+        max_concurrency: int = MAX_CONCURRENCY,
+        timeout: float = REQUEST_TIMEOUT,
+        max_retries: int = MAX_RETRIES
+    ):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    async def _backoff(self, attempt: int):
+        self.retries += 1
+        await asyncio.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+
+    def _give_up(self, error: Exception):
+        self.failures += 1
+        self.breaker.record_failure()
+        raise GeminiUnavailableError(f"Gemini request failed: {error}") from error
+
+    async def generate(self, contents: Contents, system_instruction: Optional[str] = None) -> str:
+        """Return the full reply text."""
+        self.calls += 1
+        for attempt in range(self.max_retries + 1):
+            self.breaker.before_call()
+            try:
+                async with self._semaphore:
+                    text = await asyncio.wait_for(
+                        self.backend.generate(contents, system_instruction), self.timeout
+                    )
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    self._give_up(e)
+                logger.warning(f"Gemini call failed ({type(e).__name__}), retrying")
+                self.breaker.release_trial()
+                await self._backoff(attempt)
+                continue
+            except BaseException:
+                # Bad requests, blocked content and cancellation are not upstream outages
+                self.breaker.release_trial()
+                raise
+            self.breaker.record_success()
+            return text
+
+    async def stream(self, contents: Contents, system_instruction: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Yield reply text as it arrives.
+
+        Retries only happen before the first chunk; once text has been
+        yielded a failure is raised to the caller.
+        """
+        self.calls += 1
+        for attempt in range(self.max_retries + 1):
+            self.breaker.before_call()
+            started = False
+            try:
+                async with self._semaphore:
+                    chunks = self.backend.stream(contents, system_instruction).__aiter__()
+                    while True:
+                        try:
+                            # The timeout applies to each wait for the next chunk
+                            chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            break
+                        started = True
+                        yield chunk
+            except RETRYABLE_ERRORS as e:
+                if started or attempt == self.max_retries:
+                    self._give_up(e)
+                logger.warning(f"Gemini stream failed ({type(e).__name__}), retrying")
+                self.breaker.release_trial()
+                await self._backoff(attempt)
+                continue
+            except BaseException:
+                self.breaker.release_trial()
+                raise
+            self.breaker.record_success()
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.backend).__name__,
+            "breaker": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures
+        }
@@ -0,0 +1,286 @@
+"""
+Materialized per-user health summary.
+
+Every write path (vitals, medical history, blood reports, X-rays and health
+assessments) folds its result into a single ``user_health_summary`` document,
+so readers get the latest state with one indexed lookup on ``user_email``
+instead of sorting several collections.
+"""
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger("hospital_ai")
+
+SUMMARY_COLLECTION = "user_health_summary"
+
+# Sources that contribute to the rolling risk factor list
+RISK_SOURCES = ["vitals", "medical_history", "bmi", "blood_report", "xray"]
+
+# Number of report summaries kept on the document
+RECENT_REPORTS_LIMIT = 5
+
+
+def calculate_bmi(height_cm, weight_kg) -> Optional[float]:
+    """Return BMI from height in cm and weight in kg, or None if not computable."""
+    if height_cm is None or weight_kg is None:
+        return None
+    try:
+        height_cm = float(height_cm)
+        weight_kg = float(weight_kg)
+        if height_cm <= 0:
+            return None
+        height_m = height_cm / 100
+        return weight_kg / (height_m * height_m)
+    except (ValueError, TypeError, ZeroDivisionError):
+        return None
+
+
+def vital_risk_factors(vital_signs: Dict[str, Any]) -> List[str]:
+    """Derive risk factors from a single set of vital signs."""
+    risk_factors = []
+    if not isinstance(vital_signs, dict):
+        return risk_factors
+
+    heart_rate = vital_signs.get("heartRate")
+    if heart_rate is not None and isinstance(heart_rate, (int, float)) and heart_rate > 100:
+        risk_factors.append("Elevated heart rate")
+    if heart_rate is not None and isinstance(heart_rate, (int, float)) and heart_rate < 60:
+        risk_factors.append("Low heart rate")
+
+    bp_str = vital_signs.get("bloodPressure", "")
+    if bp_str and isinstance(bp_str, str) and "/" in bp_str:
+        try:
+            systolic, diastolic = map(int, bp_str.split("/"))
+            if systolic > 140 or diastolic > 90:
+                risk_factors.append("Hypertension risk")
+            if systolic < 90 or diastolic < 60:
+                risk_factors.append("Hypotension risk")
+        except ValueError:
+            pass  # Skip if values can't be parsed
+
+    oxygen_level = vital_signs.get("oxygenLevel")
+    if oxygen_level is not None and isinstance(oxygen_level, (int, float)) and oxygen_level < 95:
+        risk_factors.append("Low blood oxygen")
+
+    temperature = vital_signs.get("temperature")
+    if temperature is not None and isinstance(temperature, (int, float)) and temperature > 37.5:
+        risk_factors.append("Elevated temperature")
+
+    return risk_factors
+
+
+def history_risk_factors(medical_history: Dict[str, Any]) -> List[str]:
+    """Derive risk factors from the conditions listed in a medical history."""
+    risk_factors = []
+    if not medical_history or not isinstance(medical_history, dict):
+        return risk_factors
+
+    conditions = medical_history.get("conditions", [])
+    if isinstance(conditions, list):
+        for condition in conditions:
+            if isinstance(condition, str):
+                condition_lower = condition.lower()
+                if "diabetes" in condition_lower:
+                    risk_factors.append("Diabetes")
+                if "hypertension" in condition_lower or "high blood pressure" in condition_lower:
+                    risk_factors.append("Hypertension")
+                if "heart" in condition_lower and "disease" in condition_lower:
+                    risk_factors.append("Heart disease")
+    return risk_factors
+
+
+def bmi_risk_factors(bmi: Optional[float]) -> List[str]:
+    """Derive weight-related risk factors from a BMI value."""
+    if bmi is None:
+        return []
+    if bmi < 18.5:
+        return ["Underweight"]
+    elif bmi >= 25:
+        return ["Overweight"]
+    elif bmi >= 30:
+        return ["Obesity"]
+    return []
+
+
+def report_risk_factors(report_type: str, severity: Optional[float]) -> List[str]:
+    """Flag a report source as a risk factor when its severity is high."""
+    if not isinstance(severity, (int, float)) or severity < 7:
+        return []
+    if report_type == "xray":
+        return ["Severe chest X-ray findings"]
+    return ["Abnormal blood test results"]
+
+
+def _literal(value):
+    # Pipeline updates interpret "$"-prefixed strings as expressions
+    return {"$literal": value}
+
+
+def _increment(field: str):
+    return {"$add": [{"$ifNull": [f"${field}", 0]}, 1]}
+
+
+class HealthSummaryStore:
+    """Incrementally maintained ``user_health_summary`` documents."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def _apply(
+        self,
+        user_email: str,
+        fields: Dict[str, Any],
+        counter: str,
+        risks: Optional[Dict[str, List[str]]] = None,
+        extra_stage: Optional[Dict[str, Any]] = None
+    ):
+        """Apply one write atomically as an upserting pipeline update."""
+        now = datetime.utcnow()
+        stage = {f: _literal(v) for f, v in fields.items()}
+        stage["user_email"] = _literal(user_email)
+        stage["updated_at"] = _literal(now)
+        stage[f"counts.{counter}"] = _increment(f"counts.{counter}")
+        for source, source_risks in (risks or {}).items():
+            stage[f"risk_factors_by_source.{source}"] = _literal(source_risks)
+
+        pipeline = [{"$set": stage}]
+        if extra_stage:
+            pipeline.append({"$set": extra_stage})
+
+        # Rebuild the flattened list from the per-source lists in the same write
+        pipeline.append({"$set": {
+            "risk_factors": {"$setUnion": [
+                {"$ifNull": [f"$risk_factors_by_source.{source}", []]}
+                for source in RISK_SOURCES
+            ]}
+        }})
+
+        try:
+            self.collection.update_one({"user_email": user_email}, pipeline, upsert=True)
+        except Exception as e:
+            logger.error(f"Error updating health summary for {user_email}: {e}")
+
+    def record_vitals(self, user_email: str, vitals: Dict[str, Any]):
+        """
+        Fold a vital signs reading into the summary.
+
+        The latest vitals and their risk factors are only replaced when the
+        reading is at least as recent as the stored one, so backdated
+        uploads still count but do not overwrite newer state.
+        """
+        latest = {
+            "heartRate": vitals.get("heartRate"),
+            "bloodPressure": vitals.get("bloodPressure"),
+            "oxygenLevel": vitals.get("oxygenLevel"),
+            "temperature": vitals.get("temperature"),
+            "respiratoryRate": vitals.get("respiratoryRate"),
+            "recorded_at": vitals.get("recorded_at")
+        }
+        if vitals.get("_id") is not None:
+            latest["_id"] = str(vitals["_id"])
+
+        recorded_at = vitals.get("recorded_at")
+        if recorded_at is None:
+            self._apply(
+                user_email,
+                {"latest_vitals": latest},
+                "vital_signs",
+                risks={"vitals": vital_risk_factors(vitals)}
+            )
+            return
+
+        # Evaluated against the stored document, before either field changes
+        newer = {"$gte": [_literal(recorded_at), {"$ifNull": ["$latest_vitals.recorded_at", datetime.min]}]}
+        self._apply(
+            user_email,
+            {},
+            "vital_signs",
+            extra_stage={
+                "latest_vitals": {"$cond": [newer, _literal(latest), "$latest_vitals"]},
+                "risk_factors_by_source.vitals": {"$cond": [
+                    newer,
+                    _literal(vital_risk_factors(vitals)),
+                    "$risk_factors_by_source.vitals"
+                ]}
+            }
+        )
+
+    def record_medical_history(self, user_email: str, history: Dict[str, Any]):
+        """Fold a saved medical history into the summary."""
+        latest = {k: v for k, v in history.items() if k not in ("_id", "user_id")}
+        if history.get("_id") is not None:
+            latest["_id"] = str(history["_id"])
+
+        fields = {"latest_medical_history": latest}
+        risks = {"medical_history": history_risk_factors(history)}
+        bmi = history.get("bmi")
+        if bmi is None:
+            bmi = calculate_bmi(history.get("height"), history.get("weight"))
+            bmi = round(bmi, 2) if bmi is not None else None
+        if bmi is not None:
+            fields["bmi"] = bmi
+            risks["bmi"] = bmi_risk_factors(bmi)
+
+        self._apply(user_email, fields, "medical_history", risks=risks)
+
+    def record_report(
+        self,
+        user_email: str,
+        report_type: str,
+        report_id: str,
+        severity: Optional[float],
+        created_at: Optional[datetime] = None
+    ):
+        """Fold a blood report or X-ray analysis into the summary."""
+        entry = {
+            "report_id": report_id,
+            "report_type": report_type,
+            "severity": severity,
+            "created_at": created_at or datetime.utcnow()
+        }
+        source = "xray" if report_type == "xray" else "blood_report"
+
+        # Keep a short, newest-first list of report summaries
+        recent = {
+            "recent_reports": {"$slice": [
+                {"$concatArrays": [[_literal(entry)], {"$ifNull": ["$recent_reports", []]}]},
+                RECENT_REPORTS_LIMIT
+            ]}
+        }
+
+        self._apply(
+            user_email,
+            {f"last_severity.{source}": severity, f"last_report.{source}": entry},
+            source,
+            risks={source: report_risk_factors(report_type, severity)},
+            extra_stage=recent
+        )
+
+    def record_assessment(self, user_email: str, assessment: Dict[str, Any]):
+        """Fold a completed health assessment into the summary."""
+        latest = {
+            "health_score": assessment.get("health_score"),
+            "risk_factors": assessment.get("risk_factors", []),
+            "bmi": assessment.get("bmi"),
+            "recommendations": assessment.get("recommendations", []),
+            "created_at": assessment.get("created_at")
+        }
+        if assessment.get("_id") is not None:
+            latest["_id"] = str(assessment["_id"])
+
+        fields = {
+            "latest_assessment": latest,
+            "last_severity.health_score": assessment.get("health_score")
+        }
+        if assessment.get("bmi") is not None:
+            fields["bmi"] = assessment["bmi"]
+        self._apply(user_email, fields, "health_assessments")
+
+    def get(self, user_email: str) -> Optional[Dict[str, Any]]:
+        """Return the summary document for a user, if one exists."""
+        try:
+            return self.collection.find_one({"user_email": user_email})
+        except Exception as e:
+            logger.error(f"Error reading health summary for {user_email}: {e}")
+            return None
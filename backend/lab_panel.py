@@ -0,0 +1,520 @@
+"""
+Rule-based parsing and interpretation of blood test reports.
+
+Lines like ``Hemoglobin: 14.2 g/dL`` are matched against a lexicon of
+common analytes, values are converted to one canonical unit per analyte and
+compared with a reference-range table keyed by sex and age. A value
+printed without a unit is read in whichever of the analyte's units gives a
+physiologically plausible result; values that are implausible, or that fit
+several units, make the report uncertain. Well-formed reports are analyzed
+locally and deterministically; a report is only sent to the language model
+when too few of its result lines could be parsed with confidence.
+"""
+import logging
+import re
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger("hospital_ai")
+
+# A report is analyzed locally only with at least this many analytes...
+MIN_ANALYTES = 2
+
+# ...and this share of its result-like lines parsed
+MIN_COVERAGE = 0.6
+
+Conversion = Union[float, Callable[[float], float]]
+
+# Values outside these bounds (canonical units) are misreads or wrong units, not results
+PLAUSIBLE_RANGES = {
+    "hemoglobin": (3.0, 25.0),
+    "wbc": (0.1, 500.0),
+    "rbc": (1.0, 10.0),
+    "platelets": (5.0, 2000.0),
+    "neutrophils": (0.0, 100.0),
+    "lymphocytes": (0.0, 100.0),
+    "monocytes": (0.0, 100.0),
+    "eosinophils": (0.0, 100.0),
+    "basophils": (0.0, 100.0),
+    "hematocrit": (10.0, 75.0),
+    "mchc": (20.0, 45.0),
+    "mch": (10.0, 50.0),
+    "mcv": (50.0, 150.0),
+    "hba1c": (3.0, 20.0),
+    "glucose": (20.0, 1000.0),
+    "hdl": (5.0, 150.0),
+    "ldl": (10.0, 500.0),
+    "cholesterol": (50.0, 700.0),
+    "triglycerides": (20.0, 5000.0),
+    "creatinine": (0.1, 20.0),
+    "urea": (2.0, 400.0),
+    "bun": (1.0, 200.0),
+    "sodium": (100.0, 180.0),
+    "potassium": (1.5, 10.0),
+    "calcium": (4.0, 18.0),
+    "alt": (1.0, 5000.0),
+    "ast": (1.0, 5000.0),
+    "bilirubin": (0.05, 40.0),
+    "tsh": (0.005, 150.0),
+    "vitamin_d": (2.0, 200.0),
+    "vitamin_b12": (50.0, 3000.0),
+    "ferritin": (1.0, 10000.0)
+}
+
+
+def _apply(factor: Conversion, value: float) -> float:
+    return factor(value) if callable(factor) else value * factor
+
+
+class Analyte:
+    """One lab parameter: its names, canonical unit and unit conversions."""
+
+    def __init__(
+        self,
+        key: str,
+        label: str,
+        aliases: List[str],
+        unit: str,
+        conversions: Optional[Dict[str, Conversion]] = None,
+        critical: Tuple[Optional[float], Optional[float]] = (None, None),
+        advice: Tuple[str, str] = ("", "")
+    ):
+        self.key = key
+        self.label = label
+        self.aliases = aliases
+        self.unit = unit
+        # Multipliers (or functions) from other units to the canonical one
+        self.conversions = {normalize_unit(unit): 1.0}
+        for other, factor in (conversions or {}).items():
+            self.conversions[normalize_unit(other)] = factor
+        self.critical_low, self.critical_high = critical
+        self.advice_low, self.advice_high = advice
+        self.plausible = PLAUSIBLE_RANGES.get(key)
+
+    def is_plausible(self, value: float) -> bool:
+        return self.plausible is None or self.plausible[0] <= value <= self.plausible[1]
+
+    def to_canonical(self, value: float, unit: Optional[str]) -> Optional[float]:
+        """
+        Convert ``value`` to the canonical unit.
+
+        Returns None for an unknown unit or an implausible result. Without a
+        unit, the value is read in every known unit and accepted only if the
+        plausible readings agree, e.g. glucose 5.4 can only be mmol/L.
+        """
+        if unit:
+            factor = self.conversions.get(unit)
+            if factor is None:
+                return None
+            converted = _apply(factor, value)
+            return converted if self.is_plausible(converted) else None
+
+        readings = [r for r in (_apply(f, value) for f in self.conversions.values()) if self.is_plausible(r)]
+        if not readings or max(readings) > min(readings) * 1.01:
+            return None
+        return readings[0]
+
+
+def normalize_unit(unit: str) -> str:
+    unit = unit.strip().lower()
+    for old, new in (("µ", "u"), ("μ", "u"), ("×", "x"), ("⁹", "^9"), ("³", "^3"), ("¹²", "^12"), ("⁶", "^6")):
+        unit = unit.replace(old, new)
+    unit = re.sub(r"\s+", "", unit)
+    unit = re.sub(r"\*10\^?|x10e|x10\^?|10e|10\*", "10^", unit)
+    unit = unit.replace("cumm", "ul").replace("mm^3", "ul").replace("mm3", "ul").replace("/cmm", "/ul")
+    return UNIT_ALIASES.get(unit, unit)
+
+
+UNIT_ALIASES = {
+    "10^3/ul": "10^9/l",
+    "k/ul": "10^9/l",
+    "thou/ul": "10^9/l",
+    "10^9/l": "10^9/l",
+    "10^6/ul": "10^12/l",
+    "m/ul": "10^12/l",
+    "mill/ul": "10^12/l",
+    "million/ul": "10^12/l",
+    "cells/ul": "/ul",
+    "lakhs/ul": "lakh/ul",
+    "lacs/ul": "lakh/ul",
+    "lakh/ul": "lakh/ul",
+    "miu/l": "uiu/ml",
+    "mu/l": "uiu/ml",
+    "iu/l": "u/l",
+    "mgs/dl": "mg/dl",
+    "gm/dl": "g/dl",
+    "gms/dl": "g/dl",
+    "gm%": "g/dl",
+    "g%": "g/dl",
+    "pg/ml": "pg/ml",
+    "fl": "fl",
+    "cu.microns": "fl",
+    "%": "%"
+}
+
+ANALYTES = [
+    Analyte("hemoglobin", "Hemoglobin", ["haemoglobin", "hemoglobin", "hgb", "hb"], "g/dL",
+            {"g/L": 0.1, "mmol/L": 1.611}, (7.0, 20.0),
+            ("Low hemoglobin can indicate anemia; an iron, B12 and folate work-up is advised.",
+             "High hemoglobin can reflect dehydration or polycythemia; recheck and discuss with a doctor.")),
+    Analyte("wbc", "White Blood Cells",
+            ["total leukocyte count", "total leucocyte count", "white blood cells", "white blood cell count",
+             "white cell count", "leukocytes", "tlc", "wbc count", "wbc"],
+            "10^9/L", {"/uL": 0.001}, (2.0, 30.0),
+            ("A low white cell count can weaken immunity; discuss with a doctor, especially if you have fevers.",
+             "A high white cell count often points to infection or inflammation; consult a doctor.")),
+    Analyte("rbc", "Red Blood Cells", ["red blood cells", "red blood cell count", "rbc count", "rbc"],
+            "10^12/L", {}, (None, None),
+            ("A low red cell count can indicate anemia.",
+             "A high red cell count can reflect dehydration or a marrow disorder.")),
+    Analyte("platelets", "Platelets", ["platelet count", "platelets", "plt"],
+            "10^9/L", {"/uL": 0.001, "lakh/uL": 100.0}, (20.0, 1000.0),
+            ("Low platelets raise bleeding risk; avoid NSAIDs and consult a doctor.",
+             "High platelets can follow infection or iron deficiency; a follow-up count is advised.")),
+    Analyte("neutrophils", "Neutrophils", ["neutrophils", "polymorphs", "neutrophil"], "%"),
+    Analyte("lymphocytes", "Lymphocytes", ["lymphocytes", "lymphocyte"], "%"),
+    Analyte("monocytes", "Monocytes", ["monocytes", "monocyte"], "%"),
+    Analyte("eosinophils", "Eosinophils", ["eosinophils", "eosinophil"], "%"),
+    Analyte("basophils", "Basophils", ["basophils", "basophil"], "%"),
+    Analyte("hematocrit", "Hematocrit", ["haematocrit", "hematocrit", "packed cell volume", "pcv", "hct"],
+            "%", {}, (20.0, 60.0),
+            ("Low hematocrit is consistent with anemia.", "High hematocrit can reflect dehydration.")),
+    Analyte("mchc", "MCHC", ["mean corpuscular hemoglobin concentration", "mchc"], "g/dL", {"g/L": 0.1}),
+    Analyte("mch", "MCH", ["mean corpuscular hemoglobin", "mch"], "pg"),
+    Analyte("mcv", "MCV", ["mean corpuscular volume", "mcv"], "fL", {},
+            (None, None),
+            ("Small red cells often indicate iron deficiency.", "Large red cells can indicate B12 or folate deficiency.")),
+    Analyte("hba1c", "HbA1c", ["glycated hemoglobin", "glycosylated hemoglobin", "hba1c", "a1c"],
+            "%", {"mmol/mol": lambda v: v / 10.929 + 2.15}, (None, 14.0),
+            ("", "Raised HbA1c indicates poor long-term glucose control; consult a doctor about diabetes management.")),
+    Analyte("glucose", "Glucose",
+            ["fasting blood glucose", "fasting blood sugar", "fasting glucose", "fbs", "blood glucose",
+             "blood sugar", "glucose"],
+            "mg/dL", {"mmol/L": 18.016}, (50.0, 400.0),
+            ("Low blood sugar needs prompt attention; eat regularly and consult a doctor.",
+             "High blood sugar can indicate diabetes; a fasting glucose or HbA1c test is advised.")),
+    Analyte("hdl", "HDL Cholesterol", ["hdl cholesterol", "hdl-c", "hdl"], "mg/dL", {"mmol/L": 38.67},
+            (None, None), ("Low HDL raises cardiovascular risk; regular exercise can help.", "")),
+    Analyte("ldl", "LDL Cholesterol", ["ldl cholesterol", "ldl-c", "ldl"], "mg/dL", {"mmol/L": 38.67},
+            (None, None), ("", "High LDL raises cardiovascular risk; review diet and discuss lipid-lowering options.")),
+    Analyte("cholesterol", "Total Cholesterol",
+            ["total cholesterol", "cholesterol, total", "serum cholesterol", "cholesterol"],
+            "mg/dL", {"mmol/L": 38.67}, (None, None),
+            ("", "High cholesterol raises cardiovascular risk; review diet and exercise with a doctor.")),
+    Analyte("triglycerides", "Triglycerides", ["triglycerides", "triglyceride", "tg"], "mg/dL",
+            {"mmol/L": 88.57}, (None, 1000.0),
+            ("", "High triglycerides respond to less sugar and alcohol; discuss with a doctor.")),
+    Analyte("creatinine", "Creatinine", ["serum creatinine", "creatinine"], "mg/dL",
+            {"umol/L": 1 / 88.4}, (None, 4.0),
+            ("", "Raised creatinine can indicate reduced kidney function; consult a doctor.")),
+    Analyte("urea", "Urea", ["blood urea", "serum urea", "urea"], "mg/dL", {"mmol/L": 6.006}, (None, 200.0),
+            ("", "Raised urea can indicate dehydration or reduced kidney function.")),
+    Analyte("bun", "Blood Urea Nitrogen", ["blood urea nitrogen", "bun"], "mg/dL", {"mmol/L": 2.801}, (None, 100.0),
+            ("", "Raised BUN can indicate dehydration or reduced kidney function.")),
+    Analyte("sodium", "Sodium", ["sodium", "na+", "na"], "mmol/L", {"mEq/L": 1.0}, (120.0, 160.0),
+            ("Low sodium can cause confusion and weakness; consult a doctor.",
+             "High sodium usually reflects dehydration; consult a doctor.")),
+    Analyte("potassium", "Potassium", ["potassium", "k+"], "mmol/L", {"mEq/L": 1.0}, (2.5, 6.5),
+            ("Low potassium can affect heart rhythm; consult a doctor.",
+             "High potassium can affect heart rhythm; seek prompt medical advice.")),
+    Analyte("calcium", "Calcium", ["serum calcium", "total calcium", "calcium"], "mg/dL", {"mmol/L": 4.008},
+            (6.5, 13.0),
+            ("Low calcium should be reviewed together with vitamin D levels.",
+             "High calcium should be evaluated by a doctor.")),
+    Analyte("alt", "ALT", ["alanine aminotransferase", "sgpt", "alt"], "U/L", {}, (None, 1000.0),
+            ("", "Raised ALT suggests liver inflammation; limit alcohol and consult a doctor.")),
+    Analyte("ast", "AST", ["aspartate aminotransferase", "sgot", "ast"], "U/L", {}, (None, 1000.0),
+            ("", "Raised AST can indicate liver or muscle injury; consult a doctor.")),
+    Analyte("bilirubin", "Total Bilirubin", ["total bilirubin", "bilirubin, total", "bilirubin"], "mg/dL",
+            {"umol/L": 1 / 17.1}, (None, 15.0),
+            ("", "Raised bilirubin can indicate liver or bile duct problems; consult a doctor.")),
+    Analyte("tsh", "TSH", ["thyroid stimulating hormone", "tsh"], "uIU/mL", {}, (None, None),
+            ("Low TSH can indicate an overactive thyroid; consult a doctor.",
+             "High TSH can indicate an underactive thyroid; consult a doctor.")),
+    Analyte("vitamin_d", "Vitamin D",
+            ["25-hydroxy vitamin d", "25-oh vitamin d", "vitamin d (25-oh)", "vitamin d, 25-hydroxy",
+             "vitamin d 25-hydroxy", "vitamin d, 25-oh", "vitamin d 25-oh", "vitamin d3", "vitamin d"],
+            "ng/mL", {"nmol/L": 1 / 2.496}, (None, None),
+            ("Low vitamin D is common; sunlight exposure and supplementation can help.", "")),
+    Analyte("vitamin_b12", "Vitamin B12", ["vitamin b12", "vit b12", "cobalamin", "b12"], "pg/mL",
+            {"pmol/L": 1.355}, (None, None),
+            ("Low vitamin B12 can cause anemia and nerve symptoms; supplementation may be needed.", "")),
+    Analyte("ferritin", "Ferritin", ["serum ferritin", "ferritin"], "ng/mL", {"ug/L": 1.0}, (None, None),
+            ("Low ferritin indicates depleted iron stores.", "High ferritin can reflect inflammation or iron overload."))
+]
+
+ANALYTES_BY_KEY = {a.key: a for a in ANALYTES}
+
+# (analyte, sex or None for any, min age, max age, low, high) in canonical units.
+# The first matching row wins, so specific rows precede general ones.
+REFERENCE_RANGES = [
+    ("hemoglobin", None, 0, 12, 11.5, 15.5),
+    ("hemoglobin", "male", 12, 200, 13.5, 17.5),
+    ("hemoglobin", "female", 12, 200, 12.0, 15.5),
+    ("hemoglobin", None, 12, 200, 12.0, 17.5),
+    ("wbc", None, 0, 12, 5.0, 14.5),
+    ("wbc", None, 12, 200, 4.0, 11.0),
+    ("rbc", "male", 12, 200, 4.5, 5.9),
+    ("rbc", "female", 12, 200, 4.0, 5.2),
+    ("rbc", None, 0, 200, 4.0, 5.9),
+    ("platelets", None, 0, 200, 150.0, 450.0),
+    ("hematocrit", "male", 12, 200, 41.0, 53.0),
+    ("hematocrit", "female", 12, 200, 36.0, 46.0),
+    ("hematocrit", None, 0, 200, 35.0, 50.0),
+    ("mcv", None, 0, 200, 80.0, 100.0),
+    ("mch", None, 0, 200, 27.0, 33.0),
+    ("mchc", None, 0, 200, 32.0, 36.0),
+    ("neutrophils", None, 0, 200, 40.0, 75.0),
+    ("lymphocytes", None, 0, 200, 20.0, 45.0),
+    ("monocytes", None, 0, 200, 2.0, 10.0),
+    ("eosinophils", None, 0, 200, 1.0, 6.0),
+    ("basophils", None, 0, 200, 0.0, 2.0),
+    ("hba1c", None, 0, 200, 4.0, 5.6),
+    ("glucose", None, 0, 200, 70.0, 99.0),
+    ("hdl", "male", 0, 200, 40.0, 100.0),
+    ("hdl", "female", 0, 200, 50.0, 100.0),
+    ("hdl", None, 0, 200, 40.0, 100.0),
+    ("ldl", None, 0, 200, 0.0, 129.0),
+    ("cholesterol", None, 0, 200, 0.0, 199.0),
+    ("triglycerides", None, 0, 200, 0.0, 149.0),
+    ("creatinine", None, 0, 12, 0.3, 0.7),
+    ("creatinine", "male", 12, 200, 0.7, 1.3),
+    ("creatinine", "female", 12, 200, 0.6, 1.1),
+    ("creatinine", None, 12, 200, 0.6, 1.3),
+    ("urea", None, 0, 200, 15.0, 45.0),
+    ("bun", None, 0, 60, 7.0, 20.0),
+    ("bun", None, 60, 200, 8.0, 23.0),
+    ("sodium", None, 0, 200, 135.0, 145.0),
+    ("potassium", None, 0, 200, 3.5, 5.1),
+    ("calcium", None, 0, 200, 8.5, 10.5),
+    ("alt", "male", 12, 200, 7.0, 55.0),
+    ("alt", None, 0, 200, 7.0, 45.0),
+    ("ast", None, 0, 200, 8.0, 48.0),
+    ("bilirubin", None, 0, 200, 0.1, 1.2),
+    ("tsh", None, 0, 200, 0.4, 4.5),
+    ("vitamin_d", None, 0, 200, 30.0, 100.0),
+    ("vitamin_b12", None, 0, 200, 200.0, 900.0),
+    ("ferritin", "male", 12, 200, 24.0, 336.0),
+    ("ferritin", "female", 12, 200, 11.0, 307.0),
+    ("ferritin", None, 0, 200, 12.0, 300.0)
+]
+
+# Longest aliases first so "hdl cholesterol" wins over "hdl" and "mchc" over "mch"
+_ALIAS_TO_KEY = {alias: a.key for a in ANALYTES for alias in a.aliases}
+_ALIAS_PATTERN = "|".join(re.escape(alias) for alias in sorted(_ALIAS_TO_KEY, key=len, reverse=True))
+
+RESULT_LINE = re.compile(
+    r"^\W*(?P<name>" + _ALIAS_PATTERN + r")(?![\w])"
+    r"[^\d<>\n]{0,40}?"
+    r"(?P<qualifier>[<>]=?)?\s*"
+    r"(?P<value>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+    r"(?:\s*(?P<unit>(?:[x×*]\s*10\s*[\^e*]?\s*[\d⁹³⁶¹²]+\s*/\s*[a-zµμ]+\^?3?|[a-zµμ%/.^\d]+(?:/[a-zµμ\d.^]+)?)))?",
+    re.IGNORECASE
+)
+
+# Lines that look like results: a label followed somewhere by a number
+CANDIDATE_LINE = re.compile(r"^\W*[a-z][a-z .,()/+-]{1,40}[:\s]\s*[<>]?\d", re.IGNORECASE)
+
+# Report headers with numbers that are not lab results
+HEADER_LINE = re.compile(
+    r"^\W*(patient|name|age|sex|gender|date|dob|dr\b|doctor|ref|sample|specimen|report|id|uhid|mrn|lab|"
+    r"phone|mobile|tel|address|collected|received|reported|registered|page|barcode|accession)\b",
+    re.IGNORECASE
+)
+
+
+# High/low flags printed after a value are not units
+FLAG_WORDS = {"h", "l", "hi", "lo", "high", "low", "normal", "abnormal", "n", "a"}
+
+
+class Measurement:
+    """One parsed result, in its report unit and the analyte's canonical unit."""
+
+    def __init__(self, analyte: Analyte, raw_value: float, raw_unit: Optional[str], value: float, line: str):
+        self.analyte = analyte
+        self.raw_value = raw_value
+        self.raw_unit = raw_unit
+        self.value = value
+        self.line = line
+
+
+class ParsedReport:
+    """Measurements found in a report and how much of it they cover."""
+
+    def __init__(self, measurements: List[Measurement], candidate_lines: int, uncertain: List[str]):
+        self.measurements = measurements
+        self.candidate_lines = candidate_lines
+        # Values with an unknown unit, an implausible value or an ambiguous missing unit
+        self.uncertain = uncertain
+
+    @property
+    def coverage(self) -> float:
+        if not self.candidate_lines:
+            return 0.0
+        return min(1.0, len(self.measurements) / self.candidate_lines)
+
+    @property
+    def confident(self) -> bool:
+        """Whether the local parse is complete enough to skip the language model."""
+        return (
+            len(self.measurements) >= MIN_ANALYTES
+            and self.coverage >= MIN_COVERAGE
+            and not self.uncertain
+        )
+
+
+def _parse_number(text: str) -> float:
+    return float(text.replace(",", ""))
+
+
+def parse_report(text: str) -> ParsedReport:
+    """Extract analyte values from report text, one result per line."""
+    measurements: List[Measurement] = []
+    seen = set()
+    candidates = 0
+    uncertain = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or HEADER_LINE.match(line):
+            continue
+        match = RESULT_LINE.match(line)
+        if match is None:
+            if CANDIDATE_LINE.match(line):
+                candidates += 1
+            continue
+        candidates += 1
+
+        analyte = ANALYTES_BY_KEY[_ALIAS_TO_KEY[match.group("name").lower()]]
+        raw_value = _parse_number(match.group("value"))
+        raw_unit = match.group("unit")
+        if raw_unit and raw_unit.lower() in FLAG_WORDS:
+            raw_unit = None
+        unit = normalize_unit(raw_unit) if raw_unit else None
+        value = analyte.to_canonical(raw_value, unit)
+        if value is None:
+            uncertain.append(f"{analyte.label}: {match.group('value')} {raw_unit or '(no unit)'}")
+            continue
+        # Reports sometimes repeat a value in a summary section; keep the first
+        if analyte.key in seen:
+            candidates -= 1
+            continue
+        seen.add(analyte.key)
+        measurements.append(Measurement(analyte, raw_value, raw_unit, value, line))
+    return ParsedReport(measurements, candidates, uncertain)
+
+
+def patient_sex(gender: Optional[str]) -> Optional[str]:
+    gender = (gender or "").strip().lower()
+    if gender in ("male", "m", "man"):
+        return "male"
+    if gender in ("female", "f", "woman"):
+        return "female"
+    return None
+
+
+def patient_age(dob: Any, today: Optional[date] = None) -> Optional[int]:
+    """Age in whole years from a ``YYYY-MM-DD`` string or datetime."""
+    if isinstance(dob, datetime):
+        born = dob.date()
+    elif isinstance(dob, date):
+        born = dob
+    else:
+        try:
+            born = datetime.strptime(str(dob)[:10], "%Y-%m-%d").date()
+        except ValueError:
+            return None
+    today = today or date.today()
+    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+
+
+def reference_range(key: str, sex: Optional[str], age: Optional[int]) -> Optional[Tuple[float, float]]:
+    # Without a known age, assume an adult
+    age = 30 if age is None else age
+    for analyte, row_sex, min_age, max_age, low, high in REFERENCE_RANGES:
+        if analyte != key or not (min_age <= age < max_age):
+            continue
+        if row_sex is None or row_sex == sex:
+            return low, high
+    return None
+
+
+def _format_value(value: float) -> str:
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def grade(measurement: Measurement, low: float, high: float) -> Optional[Tuple[str, str, bool]]:
+    """Return (direction, severity, critical) for an out-of-range value, or None if normal."""
+    value = measurement.value
+    analyte = measurement.analyte
+    if low <= value <= high:
+        return None
+    direction = "low" if value < low else "high"
+    if (analyte.critical_low is not None and value <= analyte.critical_low) or \
+       (analyte.critical_high is not None and value >= analyte.critical_high):
+        return direction, "high", True
+    # Relative distance outside the range
+    bound = low if direction == "low" else high
+    deviation = abs(value - bound) / bound if bound else 1.0
+    if deviation < 0.1:
+        return direction, "low", False
+    if deviation < 0.3:
+        return direction, "moderate", False
+    return direction, "high", False
+
+
+SEVERITY_POINTS = {"low": 1, "moderate": 2, "high": 4}
+
+
+def analyze(parsed: ParsedReport, sex: Optional[str] = None, age: Optional[int] = None) -> Dict[str, Any]:
+    """Build the analysis (same shape as the model's) from parsed measurements."""
+    abnormal = []
+    recommendations = []
+    points = 0
+    critical = False
+    for m in parsed.measurements:
+        ref = reference_range(m.analyte.key, sex, age)
+        if ref is None:
+            continue
+        low, high = ref
+        graded = grade(m, low, high)
+        if graded is None:
+            continue
+        direction, severity, is_critical = graded
+        abnormal.append({
+            "parameter": m.analyte.label,
+            "value": f"{_format_value(m.value)} {m.analyte.unit}",
+            "normalRange": f"{_format_value(low)}-{_format_value(high)} {m.analyte.unit}",
+            "severity": severity,
+            "direction": direction
+        })
+        points += SEVERITY_POINTS[severity]
+        critical = critical or is_critical
+        advice = m.analyte.advice_low if direction == "low" else m.analyte.advice_high
+        if advice:
+            recommendations.append(advice)
+
+    score = min(10, points)
+    if critical:
+        score = max(score, 8)
+        recommendations.insert(0, "One or more values are in a critical range. Seek medical attention promptly.")
+    if not abnormal:
+        recommendations.append("All recognized values are within normal limits. Continue routine check-ups.")
+    elif not critical:
+        recommendations.append("Discuss these results with your doctor for a full evaluation.")
+
+    return {
+        "abnormalValues": abnormal,
+        "severityScore": score,
+        "recommendations": recommendations,
+        "measurements": [
+            {
+                "parameter": m.analyte.label,
+                "value": round(m.value, 3),
+                "unit": m.analyte.unit,
+                "reportedValue": m.raw_value,
+                "reportedUnit": m.raw_unit
+            }
+            for m in parsed.measurements
+        ],
+        "source": "rules"
+    }
@@ -0,0 +1,283 @@
+"""
+Versioned schema and index migrations.
+
+All collections, indexes (including TTL and partial indexes) are declared
+here and applied once per version. Applied versions are recorded in the
+``schema_migrations`` collection, so a worker starting against an
+up-to-date database does a single read and no index management.
+
+Run at deploy time with ``python migrations.py`` or at startup via
+``run_migrations(db)``.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient, ASCENDING, DESCENDING, errors
+
+from appointment_slots import SLOTS_COLLECTION, SLOT_INDEX, slot_key
+
+logger = logging.getLogger("hospital_ai")
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+LOCK_ID = "migration_lock"
+
+# A lock older than this is assumed to belong to a crashed process
+LOCK_TIMEOUT = timedelta(minutes=10)
+
+AUDIT_LOG_RETENTION_DAYS = int(os.getenv("AUDIT_LOG_RETENTION_DAYS", "365"))
+
+
+def _baseline_indexes(db):
+    """Indexes previously created at import time and during registration."""
+    db["users"].create_index([("email", ASCENDING)], unique=True)
+    db["users"].create_index([("created_at", DESCENDING)])
+    db["users"].create_index([("unique_id", ASCENDING)], name="unique_id_index", unique=True)
+    db["aadhaar_data"].create_index([("user_email", ASCENDING)])
+    db["medical_history"].create_index([("user_email", ASCENDING)])
+    db["vital_signs"].create_index([("user_email", ASCENDING), ("recorded_at", DESCENDING)])
+    db["medical_reports"].create_index([("user_email", ASCENDING), ("created_at", DESCENDING)])
+    db["consultations"].create_index([("user_email", ASCENDING), ("timestamp", DESCENDING)])
+    db["appointments"].create_index([("user_email", ASCENDING), ("appointment_date", ASCENDING)])
+    db["appointments"].create_index([("doctor_id", ASCENDING), ("appointment_date", ASCENDING)])
+
+
+def _health_summary(db):
+    db["user_health_summary"].create_index([("user_email", ASCENDING)], unique=True)
+
+
+def _vitals_timeseries(db):
+    name = "vital_signs_timeseries"
+    if name in db.list_collection_names(filter={"name": name}):
+        return
+    version = db.client.server_info().get("versionArray", [0])
+    if version >= [5, 0]:
+        db.create_collection(
+            name,
+            timeseries={
+                "timeField": "recorded_at",
+                "metaField": "user_email",
+                "granularity": "seconds"
+            }
+        )
+    else:
+        db[name].create_index([("user_email", ASCENDING), ("recorded_at", ASCENDING)])
+
+
+def _resolve_duplicate_scheduled_slots(db) -> int:
+    """
+    Keep the earliest booking of each doubly booked slot and mark the rest.
+
+    The later bookings get status ``conflict`` with a pointer to the kept
+    booking, so the unique index can be built and staff can find and
+    reschedule them. Returns how many were marked.
+    """
+    duplicates = db["appointments"].aggregate([
+        {"$match": {"status": "scheduled"}},
+        {"$sort": {"created_at": ASCENDING, "_id": ASCENDING}},
+        {"$group": {
+            "_id": {"doctor_id": "$doctor_id", "date": "$appointment_date", "time": "$appointment_time"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+
+    marked = 0
+    for group in duplicates:
+        kept, *extra = group["ids"]
+        db["appointments"].update_many(
+            {"_id": {"$in": extra}},
+            {"$set": {
+                "status": "conflict",
+                "conflicts_with": kept,
+                "conflict_detected_at": datetime.utcnow()
+            }}
+        )
+        marked += len(extra)
+        slot = group["_id"]
+        logger.warning(
+            f"Slot {slot['doctor_id']} {slot['date']} {slot['time']} was booked {group['count']} times; "
+            f"kept {kept}, marked {', '.join(str(i) for i in extra)} as conflict"
+        )
+    return marked
+
+
+def _appointment_slots(db):
+    db["doctor_slots"].create_index([("doctor_id", ASCENDING), ("date", ASCENDING)])
+    # Existing double bookings would make the unique index build fail
+    marked = _resolve_duplicate_scheduled_slots(db)
+    if marked:
+        logger.warning(f"Marked {marked} double-booked appointment(s) as conflict; they need rescheduling")
+    # A slot can hold at most one scheduled appointment
+    db["appointments"].create_index(
+        [("doctor_id", ASCENDING), ("appointment_date", ASCENDING), ("appointment_time", ASCENDING)],
+        name="unique_scheduled_slot",
+        unique=True,
+        partialFilterExpression={"status": "scheduled"}
+    )
+
+
+def _keyset_pagination(db):
+    for name in ["medical_reports", "health_assessments", "health_history", "appointments"]:
+        db[name].create_index([("user_email", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+
+
+def _unindexed_collections(db):
+    """Cover collections that were written and queried by user without indexes."""
+    db["profiles"].create_index([("user_email", ASCENDING)])
+    db["profiles"].create_index([("user_id", ASCENDING)])
+    db["audit_logs"].create_index([("user_email", ASCENDING), ("timestamp", DESCENDING)])
+    db["audit_logs"].create_index(
+        [("timestamp", ASCENDING)],
+        name="audit_logs_ttl",
+        expireAfterSeconds=AUDIT_LOG_RETENTION_DAYS * 86400
+    )
+    db["medical_history"].create_index([("user_email", ASCENDING), ("created_at", DESCENDING)])
+    # Upcoming appointments use the (user_email, appointment_date) index from migration 1;
+    # a partial index on the same keys conflicts with it before MongoDB 5.0
+    db["doctors"].create_index([("specialty", ASCENDING), ("rating", DESCENDING)])
+
+
+def _backfill_doctor_slots(db):
+    """Set slot bits for scheduled appointments booked before slot bitmaps existed."""
+    today = datetime.utcnow().date().isoformat()
+    days = db["appointments"].aggregate([
+        {"$match": {"status": "scheduled", "appointment_date": {"$gte": today}}},
+        {"$group": {
+            "_id": {"doctor_id": "$doctor_id", "date": "$appointment_date"},
+            "times": {"$addToSet": "$appointment_time"}
+        }}
+    ], allowDiskUse=True)
+
+    slots = db[SLOTS_COLLECTION]
+    backfilled = 0
+    for day in days:
+        doctor_id = str(day["_id"]["doctor_id"])
+        date = day["_id"]["date"]
+        mask = 0
+        for time_str in day["times"]:
+            if time_str in SLOT_INDEX:
+                mask |= 1 << SLOT_INDEX[time_str]
+        if not mask:
+            continue
+        key = slot_key(doctor_id, date)
+        # Compare-and-set, so bookings made while this runs are kept
+        while True:
+            current = slots.find_one({"_id": key}, projection={"booked_mask": 1})
+            old = current.get("booked_mask", 0) if current else 0
+            new = old | mask
+            if new == old:
+                break
+            try:
+                result = slots.update_one(
+                    {"_id": key, "booked_mask": old} if current else {"_id": key, "booked_mask": {"$exists": False}},
+                    {
+                        "$set": {
+                            "doctor_id": doctor_id,
+                            "date": date,
+                            "booked_mask": new,
+                            "booked_count": bin(new).count("1"),
+                            "updated_at": datetime.utcnow()
+                        }
+                    },
+                    upsert=current is None
+                )
+            except errors.DuplicateKeyError:
+                # Created concurrently by a booking; read it again
+                continue
+            if result.matched_count or result.upserted_id is not None:
+                backfilled += 1
+                break
+    logger.info(f"Backfilled slot bitmaps for {backfilled} doctor-day(s)")
+
+
+def _drop_duplicate_appointment_index(db):
+    """Drop the partial index an earlier migration 6 built over migration 1's keys."""
+    try:
+        db["appointments"].drop_index("upcoming_scheduled_appointments")
+    except errors.OperationFailure:
+        # Never created, e.g. on servers where migration 6 originally failed
+        pass
+
+
+# Ordered list of (version, description, function); append only
+MIGRATIONS = [
+    (1, "baseline indexes", _baseline_indexes),
+    (2, "user health summary", _health_summary),
+    (3, "vital signs time-series collection", _vitals_timeseries),
+    (4, "appointment slot bitmaps and unique scheduled slot", _appointment_slots),
+    (5, "keyset pagination indexes", _keyset_pagination),
+    (6, "profiles and audit log TTL indexes", _unindexed_collections),
+    (7, "backfill slot bitmaps from scheduled appointments", _backfill_doctor_slots),
+    (8, "drop redundant partial appointment index", _drop_duplicate_appointment_index),
+]
+
+
+def pending_migrations(db):
+    applied = {
+        doc["_id"] for doc in db[MIGRATIONS_COLLECTION].find(
+            {"_id": {"$type": "int"}}, projection={"_id": 1}
+        )
+    }
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def _acquire_lock(db) -> bool:
+    now = datetime.utcnow()
+    try:
+        db[MIGRATIONS_COLLECTION].insert_one({"_id": LOCK_ID, "locked_at": now, "pid": os.getpid()})
+        return True
+    except errors.DuplicateKeyError:
+        # Take over a lock left behind by a crashed process
+        stale = db[MIGRATIONS_COLLECTION].find_one_and_update(
+            {"_id": LOCK_ID, "locked_at": {"$lt": now - LOCK_TIMEOUT}},
+            {"$set": {"locked_at": now, "pid": os.getpid()}}
+        )
+        return stale is not None
+
+
+def _release_lock(db):
+    db[MIGRATIONS_COLLECTION].delete_one({"_id": LOCK_ID, "pid": os.getpid()})
+
+
+def run_migrations(db, wait_seconds: int = 60) -> int:
+    """Apply pending migrations in order and return how many were applied."""
+    pending = pending_migrations(db)
+    if not pending:
+        return 0
+
+    deadline = time.monotonic() + wait_seconds
+    while not _acquire_lock(db):
+        # Another worker is migrating; wait for it instead of racing
+        if time.monotonic() > deadline:
+            logger.warning("Timed out waiting for migration lock; continuing without migrating")
+            return 0
+        time.sleep(1)
+
+    applied = 0
+    try:
+        for version, description, migrate in pending_migrations(db):
+            logger.info(f"Applying migration {version}: {description}")
+            migrate(db)
+            db[MIGRATIONS_COLLECTION].insert_one({
+                "_id": version,
+                "description": description,
+                "applied_at": datetime.utcnow()
+            })
+            applied += 1
+    finally:
+        _release_lock(db)
+
+    logger.info(f"Applied {applied} migration(s)")
+    return applied
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    client = MongoClient(os.getenv("MONGO_URI"), serverSelectionTimeoutMS=5000)
+    run_migrations(client[os.getenv("DB_NAME", "hospital_ai")])
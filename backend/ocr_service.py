@@ -0,0 +1,289 @@
+"""
+OCR in a bounded pool of persistent worker processes.
+
+Each worker is started once and keeps its OCR engine loaded: a
+``tesserocr`` API object when that package is installed, otherwise
+``pytesseract``. Images are preprocessed in the worker before recognition:
+converted to grayscale, scaled to roughly 300 DPI (shrinking oversized phone
+photos, enlarging small scans) and deskewed. Results come back line by line
+with Tesseract's confidence.
+
+Submissions beyond the worker count wait in a bounded queue; when that is
+full the caller gets ``OcrBusyError`` at once instead of piling up work.
+The pool also runs other image jobs, such as Aadhaar extraction, via
+``run``.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("hospital_ai")
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+# Jobs allowed to wait for a worker before new ones are rejected
+OCR_MAX_QUEUE = int(os.getenv("OCR_MAX_QUEUE", "32"))
+
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "60"))
+
+TARGET_DPI = 300
+
+# Longest side after scaling; larger photos are shrunk
+MAX_IMAGE_SIDE = 3500
+
+# Skew angles (degrees) outside this band are left alone
+MIN_DESKEW_ANGLE = 0.3
+MAX_DESKEW_ANGLE = 15.0
+
+# Assumed page width in inches when the image carries no DPI
+ASSUMED_PAGE_WIDTH = 8.27
+
+# Per-process engine, created by the pool initializer
+_engine = None
+
+
+class OcrBusyError(Exception):
+    """Raised when the OCR queue is full."""
+
+
+def _init_worker():
+    """Load the OCR engine once per worker process."""
+    global _engine
+    # Tesseract's own threading fights with the pool for cores
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    try:
+        import tesserocr
+
+        _engine = tesserocr.PyTessBaseAPI()
+    except Exception:
+        _engine = None
+
+
+def _decode(image_bytes: bytes):
+    """Decode to grayscale and return it with the image's DPI, if recorded."""
+    from io import BytesIO
+
+    import cv2
+    import numpy as np
+    from PIL import Image
+
+    dpi = None
+    try:
+        info_dpi = Image.open(BytesIO(image_bytes)).info.get("dpi")
+        if info_dpi and info_dpi[0] > 1:
+            dpi = float(info_dpi[0])
+    except Exception:
+        pass
+    gray = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError("Unreadable image")
+    return gray, dpi
+
+
+def _normalize_scale(gray, dpi: Optional[float]):
+    import cv2
+
+    height, width = gray.shape[:2]
+    dpi = dpi or width / ASSUMED_PAGE_WIDTH
+    scale = TARGET_DPI / dpi
+    scale = min(scale, MAX_IMAGE_SIDE / max(height, width))
+    if abs(scale - 1.0) < 0.1:
+        return gray, 1.0
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+    return cv2.resize(gray, None, fx=scale, fy=scale, interpolation=interpolation), scale
+
+
+def _deskew(gray):
+    """Rotate text lines to horizontal using the minimum-area rectangle of the ink."""
+    import cv2
+    import numpy as np
+
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    coords = np.column_stack(np.where(binary > 0))
+    if coords.shape[0] < 100:
+        return gray, 0.0
+    angle = cv2.minAreaRect(coords[:, ::-1].astype(np.float32))[-1]
+    # minAreaRect reports angles in [0, 90) or [-90, 0) depending on the OpenCV version
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    if not MIN_DESKEW_ANGLE <= abs(angle) <= MAX_DESKEW_ANGLE:
+        return gray, 0.0
+    height, width = gray.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    rotated = cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    return rotated, float(angle)
+
+
+def preprocess(image_bytes: bytes):
+    """Grayscale, DPI-normalized and deskewed image, with what was done to it."""
+    gray, dpi = _decode(image_bytes)
+    gray, scale = _normalize_scale(gray, dpi)
+    gray, angle = _deskew(gray)
+    return gray, {"scale": round(scale, 3), "deskew_angle": round(angle, 2)}
+
+
+def _tesserocr_lines(gray, psm: Optional[int], variables: Dict[str, str]) -> List[Dict[str, Any]]:
+    from PIL import Image
+    from tesserocr import PSM, RIL, iterate_level
+
+    # Settings apply to the persistent engine, so they are restored for the next job
+    previous_psm = _engine.GetPageSegMode()
+    previous_variables = {name: _engine.GetVariableAsString(name) or "" for name in variables}
+    try:
+        if psm is not None:
+            _engine.SetPageSegMode(PSM(psm))
+        for name, value in variables.items():
+            _engine.SetVariable(name, value)
+        _engine.SetImage(Image.fromarray(gray))
+        _engine.Recognize()
+        lines = []
+        for line in iterate_level(_engine.GetIterator(), RIL.TEXTLINE):
+            text = (line.GetUTF8Text(RIL.TEXTLINE) or "").strip()
+            if text:
+                lines.append({"text": text, "confidence": round(line.Confidence(RIL.TEXTLINE), 1)})
+        return lines
+    finally:
+        _engine.SetPageSegMode(previous_psm)
+        for name, value in previous_variables.items():
+            _engine.SetVariable(name, value)
+
+
+def recognize_lines(
+    gray,
+    psm: Optional[int] = None,
+    variables: Optional[Dict[str, str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    OCR a preprocessed image into text lines, each with a 0-100 confidence.
+
+    ``psm`` is a Tesseract page segmentation mode and ``variables`` are
+    Tesseract parameters such as ``tessedit_char_whitelist``; both apply to
+    this call only.
+    """
+    variables = variables or {}
+    if _engine is not None:
+        return _tesserocr_lines(gray, psm, variables)
+
+    import pytesseract
+
+    options = [f"--psm {psm}"] if psm is not None else []
+    options.extend(f"-c {name}={value}" for name, value in variables.items())
+    data = pytesseract.image_to_data(gray, config=" ".join(options), output_type=pytesseract.Output.DICT)
+    grouped: Dict[Any, Dict[str, list]] = {}
+    for i, text in enumerate(data["text"]):
+        conf = float(data["conf"][i])
+        if not text.strip() or conf < 0:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        line = grouped.setdefault(key, {"words": [], "confs": []})
+        line["words"].append(text.strip())
+        line["confs"].append(conf)
+    return [
+        {"text": " ".join(line["words"]), "confidence": round(sum(line["confs"]) / len(line["confs"]), 1)}
+        for line in grouped.values()
+    ]
+
+
+def _ocr_job(image_bytes: bytes) -> Dict[str, Any]:
+    """Preprocess and OCR one image; runs in a worker process."""
+    started = time.perf_counter()
+    gray, steps = preprocess(image_bytes)
+    lines = recognize_lines(gray)
+    confidences = [line["confidence"] for line in lines]
+    return {
+        "text": "\n".join(line["text"] for line in lines),
+        "lines": lines,
+        "mean_confidence": round(sum(confidences) / len(confidences), 1) if confidences else 0.0,
+        "width": int(gray.shape[1]),
+        "height": int(gray.shape[0]),
+        "preprocessing": steps,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+
+
+class OcrService:
+    """Async front end to the OCR worker pool with queue metrics."""
+
+    def __init__(self, workers: int = OCR_WORKERS, max_queue: int = OCR_MAX_QUEUE, timeout: float = OCR_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_service = 0.0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Run a picklable function in the pool, waiting in the bounded queue for a worker."""
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise OcrBusyError("OCR queue is full")
+
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        started = time.perf_counter()
+        self.total_wait += started - queued_at
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await asyncio.wait_for(loop.run_in_executor(self._pool(), fn, *args), self.timeout)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            self.total_service += time.perf_counter() - started
+            self._slots.release()
+
+    async def recognize(self, image_bytes: bytes) -> Dict[str, Any]:
+        """Full OCR result: text, per-line confidence and preprocessing details."""
+        return await self.run(_ocr_job, image_bytes)
+
+    async def recognize_text(self, image_bytes: bytes) -> str:
+        return (await self.recognize(image_bytes))["text"]
+
+    def stats(self) -> Dict[str, Any]:
+        finished = self.completed + self.failed
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / finished * 1000, 1) if finished else None,
+            "avg_service_ms": round(self.total_service / finished * 1000, 1) if finished else None
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,72 @@
+"""
+Keyset (cursor) pagination over ``(user_email, created_at, _id)``.
+
+Pages are fetched with a range condition on the last seen sort key instead
+of skip/limit, so page N costs the same index seek as page 1. Cursors are
+opaque URL-safe tokens encoding the last ``created_at`` and ``_id``.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(doc: Dict[str, Any], sort_field: str = "created_at") -> str:
+    payload = {"t": doc[sort_field].isoformat(), "id": str(doc["_id"])}
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), ObjectId(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidId, json.JSONDecodeError):
+        raise InvalidCursorError("Invalid pagination cursor")
+
+
+def keyset_page(
+    collection,
+    query: Dict[str, Any],
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    projection: Optional[Dict[str, Any]] = None,
+    sort_field: str = "created_at"
+) -> Dict[str, Any]:
+    """Return one newest-first page and the cursor for the next one."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = dict(query)
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        query["$or"] = [
+            {sort_field: {"$lt": last_value}},
+            {sort_field: last_value, "_id": {"$lt": last_id}}
+        ]
+
+    # Fetch one extra document to learn whether another page exists
+    docs: List[Dict[str, Any]] = list(collection.find(
+        query,
+        projection=projection,
+        sort=[(sort_field, DESCENDING), ("_id", DESCENDING)],
+        limit=limit + 1
+    ))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    return {
+        "items": docs,
+        "next_cursor": encode_cursor(docs[-1], sort_field) if has_more and docs else None,
+        "has_more": has_more
+    }
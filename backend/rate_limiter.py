@@ -0,0 +1,239 @@
+"""
+Token-bucket rate limiting shared across workers.
+
+Buckets live in Redis and are checked and charged by one Lua script, so all
+workers share the same budget and concurrent requests cannot overdraw it.
+When Redis is unreachable the limiter falls back to an in-process bucket
+table bounded by LRU eviction. Routes carry a cost weight, so one X-ray
+inference consumes far more of a caller's budget than a profile read.
+"""
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import AbstractSet, Optional, Dict, List, Tuple
+
+logger = logging.getLogger("hospital_ai")
+
+# Budget units charged per request; unlisted routes cost DEFAULT_COST
+ROUTE_COSTS = {
+    "/api/analyze-xray": 20,
+    "/api/analyze-blood-report": 15,
+    "/api/verify-face": 10,
+    "/api/register-face": 10,
+    "/api/upload-aadhaar": 10,
+    "/api/analyze-intent": 5,
+    "/api/analyze-intent/stream": 5,
+    "/api/health-assessment": 3,
+    "/api/vital-signs/batch": 3
+}
+DEFAULT_COST = 1
+
+# Routes never rate limited
+EXEMPT_PATHS = {"/api/health", "/api/docs", "/api/redoc", "/openapi.json"}
+EXEMPT_PREFIXES = ("/static/",)
+
+# Addresses of reverse proxies in front of the app, e.g. "127.0.0.1,10.0.0.5".
+# X-Forwarded-For is only read when the peer is one of them; by default the
+# header is ignored, since a directly connecting client can set it freely.
+TRUSTED_PROXIES = frozenset(
+    address.strip() for address in os.getenv("TRUSTED_PROXIES", "").split(",") if address.strip()
+)
+
+# Seconds to skip Redis after it fails, instead of timing out on every request
+REDIS_RETRY_INTERVAL = 30
+
+# Checks every bucket first and charges all of them only if all allow it.
+# KEYS: bucket keys. ARGV: now, then capacity, refill rate and cost per key.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local allowed = 1
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 1])
+    local rate = tonumber(ARGV[i * 3])
+    local cost = tonumber(ARGV[i * 3 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local current = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    current = math.min(capacity, current + math.max(0, now - ts) * rate)
+    tokens[i] = current
+    if current < cost then
+        allowed = 0
+    end
+end
+local result = {allowed}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 1])
+    local rate = tonumber(ARGV[i * 3])
+    local cost = tonumber(ARGV[i * 3 + 1])
+    if allowed == 1 then
+        tokens[i] = tokens[i] - cost
+    end
+    redis.call('HSET', key, 'tokens', tokens[i], 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+    result[i + 1] = tostring(tokens[i])
+end
+return result
+"""
+
+
+class RateLimitRule:
+    """A bucket of ``limit`` units refilled evenly over ``window`` seconds."""
+
+    def __init__(self, name: str, limit: int, window: int):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    @property
+    def rate(self) -> float:
+        return self.limit / self.window
+
+
+class RateLimitResult:
+    def __init__(self, allowed: bool, rule: RateLimitRule, remaining: float, cost: int):
+        self.allowed = allowed
+        self.rule = rule
+        self.remaining = remaining
+        self.cost = cost
+
+    @property
+    def reset(self) -> int:
+        """Seconds until the bucket is full again."""
+        return math.ceil(max(0.0, self.rule.limit - self.remaining) / self.rule.rate)
+
+    @property
+    def retry_after(self) -> int:
+        """Seconds until the bucket holds enough for this request."""
+        return max(1, math.ceil(max(0.0, self.cost - self.remaining) / self.rule.rate))
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "RateLimit-Limit": str(self.rule.limit),
+            "RateLimit-Remaining": str(max(0, math.floor(self.remaining))),
+            "RateLimit-Reset": str(self.reset),
+            "RateLimit-Policy": f"{self.rule.limit};w={self.rule.window}"
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+class LocalBuckets:
+    """In-process token buckets with LRU eviction, used when Redis is down."""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, checks: List[Tuple[str, RateLimitRule, int]], now: float) -> Tuple[bool, List[float]]:
+        tokens = []
+        for key, rule, cost in checks:
+            current, ts = self._buckets.get(key, (rule.limit, now))
+            tokens.append(min(rule.limit, current + max(0.0, now - ts) * rule.rate))
+        allowed = all(t >= cost for t, (_, _, cost) in zip(tokens, checks))
+
+        for i, (key, rule, cost) in enumerate(checks):
+            if allowed:
+                tokens[i] -= cost
+            self._buckets[key] = (tokens[i], now)
+            self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+class RateLimiter:
+    """Checks and charges one or more buckets per request."""
+
+    def __init__(self, redis_client=None, prefix: str = "ratelimit", max_local_keys: int = 10000):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.local = LocalBuckets(max_local_keys)
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT) if redis_client is not None else None
+        self._redis_down_until = 0.0
+
+    async def _take_redis(self, checks, now: float) -> Tuple[bool, List[float]]:
+        keys = [f"{self.prefix}:{key}" for key, _, _ in checks]
+        args = [now]
+        for _, rule, cost in checks:
+            args.extend([rule.limit, rule.rate, cost])
+        result = await self._script(keys=keys, args=args)
+        return bool(int(result[0])), [float(v) for v in result[1:]]
+
+    async def hit(self, checks: List[Tuple[str, RateLimitRule, int]]) -> RateLimitResult:
+        """
+        Charge ``cost`` to every ``(key, rule, cost)`` bucket if all can afford it.
+
+        Returns the result for the most constrained bucket, which is what the
+        response headers describe.
+        """
+        now = time.time()
+        if self._script is not None and now >= self._redis_down_until:
+            try:
+                allowed, tokens = await self._take_redis(checks, now)
+            except Exception as e:
+                logger.warning(f"Redis rate limiter unavailable, using local buckets: {e}")
+                self._redis_down_until = now + REDIS_RETRY_INTERVAL
+                allowed, tokens = self.local.take(checks, now)
+        else:
+            allowed, tokens = self.local.take(checks, now)
+
+        # Report the bucket with the fewest requests' worth of budget left
+        index = min(range(len(checks)), key=lambda i: tokens[i] / max(checks[i][2], 1))
+        _, rule, cost = checks[index]
+        return RateLimitResult(allowed, rule, tokens[index], cost)
+
+
+# Extra per-client buckets for routes that need a tighter limit of their own
+ROUTE_LIMITS = {
+    "/api/login": RateLimitRule("login", 10, 60),
+    "/api/register": RateLimitRule("register", 5, 300)
+}
+
+
+def route_cost(path: str) -> int:
+    return ROUTE_COSTS.get(path, DEFAULT_COST)
+
+
+def build_checks(identity: str, path: str, default_rule: RateLimitRule) -> List[Tuple[str, RateLimitRule, int]]:
+    """Buckets charged for one request: the caller's budget plus any route limit."""
+    checks = [(f"{default_rule.name}:{identity}", default_rule, route_cost(path))]
+    route_rule = ROUTE_LIMITS.get(path)
+    if route_rule is not None:
+        checks.append((f"{route_rule.name}:{identity}", route_rule, 1))
+    return checks
+
+
+def is_exempt(path: str, method: str) -> bool:
+    return method == "OPTIONS" or path in EXEMPT_PATHS or path.startswith(EXEMPT_PREFIXES)
+
+
+def client_ip(
+    forwarded_for: Optional[str],
+    client_host: Optional[str],
+    trusted_proxies: AbstractSet[str] = TRUSTED_PROXIES
+) -> Optional[str]:
+    """The caller's address, read from X-Forwarded-For only when the peer is a trusted proxy."""
+    if client_host not in trusted_proxies or not forwarded_for:
+        return client_host
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    # Walk back from the right past our own proxies; entries further left are client-supplied
+    for hop in reversed(hops):
+        if hop not in trusted_proxies:
+            return hop
+    return hops[0] if hops else client_host
+
+
+def client_identity(
+    forwarded_for: Optional[str],
+    client_host: Optional[str],
+    user_email: Optional[str],
+    trusted_proxies: AbstractSet[str] = TRUSTED_PROXIES
+) -> str:
+    """Limit authenticated callers per user and anonymous callers per IP."""
+    if user_email:
+        return f"user:{user_email}"
+    return f"ip:{client_ip(forwarded_for, client_host, trusted_proxies) or 'unknown'}"
@@ -0,0 +1,178 @@
+"""
+Request models for JSON endpoints.
+
+Bodies are size-checked, then parsed and validated in one pass by
+pydantic-core straight from the raw bytes. Unknown fields are dropped and
+every stored string and list is bounded, so oversized or malformed payloads
+are rejected before any database work.
+"""
+import os
+import re
+from typing import Annotated, Optional, Dict, Any, List, Literal, Union, Type, TypeVar
+
+from fastapi import HTTPException, Request
+from pydantic import (
+    AfterValidator, BaseModel, BeforeValidator, ConfigDict, Field, ValidationError, field_validator
+)
+
+from vitals_ingest import VITAL_RANGES
+
+# Largest JSON body accepted by default, in bytes
+MAX_JSON_BODY = int(os.getenv("MAX_JSON_BODY", "65536"))
+
+# Assessments embed document analysis and consultation results
+MAX_ASSESSMENT_BODY = int(os.getenv("MAX_ASSESSMENT_BODY", "262144"))
+
+PASSWORD_MIN_LENGTH = int(os.getenv("PASSWORD_MIN_LENGTH", "8"))
+
+EMAIL_PATTERN = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+
+MAX_LIST_ITEMS = 50
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def _normalize_email(value: str) -> str:
+    if not EMAIL_PATTERN.match(value):
+        raise ValueError("Invalid email format")
+    return value.lower()
+
+
+def _text_list(value):
+    """Accept a comma-separated string as well as a list of strings."""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(",") if item.strip()]
+    return value
+
+
+Email = Annotated[str, Field(max_length=254), AfterValidator(_normalize_email)]
+
+TextList = Annotated[
+    List[Annotated[str, Field(max_length=500)]],
+    BeforeValidator(_text_list),
+    Field(max_length=MAX_LIST_ITEMS)
+]
+
+
+class RequestModel(BaseModel):
+    """Base model: unknown fields are ignored and strings are stripped."""
+
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True)
+
+
+class LoginRequest(RequestModel):
+    email: Email
+    password: str = Field(min_length=1, max_length=128)
+
+
+class RegisterRequest(RequestModel):
+    email: Email
+    password: str = Field(max_length=128)
+    name: str = Field(min_length=1, max_length=100)
+    gender: str = Field(default="other", max_length=20)
+    dob: Optional[str] = Field(default=None, max_length=20)
+    role: Literal["patient", "doctor", "admin"] = "patient"
+    id: Optional[str] = Field(default=None, max_length=64)
+
+    @field_validator("password")
+    @classmethod
+    def check_password_strength(cls, value: str) -> str:
+        if len(value) < PASSWORD_MIN_LENGTH:
+            raise ValueError(f"Password must be at least {PASSWORD_MIN_LENGTH} characters")
+        if not any(c.isdigit() for c in value):
+            raise ValueError("Password must contain at least one number")
+        if not any(c.isupper() for c in value):
+            raise ValueError("Password must contain at least one uppercase letter")
+        if not any(c.islower() for c in value):
+            raise ValueError("Password must contain at least one lowercase letter")
+        return value
+
+
+class MedicalHistoryRequest(RequestModel):
+    conditions: TextList = Field(default_factory=list)
+    surgeries: TextList = Field(default_factory=list)
+    medications: TextList = Field(default_factory=list)
+    allergies: TextList = Field(default_factory=list)
+    familyHistory: TextList = Field(default_factory=list)
+    currentSymptoms: str = Field(default="", max_length=2000)
+    height: Optional[float] = Field(default=None, gt=0, le=300)
+    weight: Optional[float] = Field(default=None, gt=0, le=500)
+
+
+class VitalSignsRequest(RequestModel):
+    heartRate: Optional[Union[int, float]] = None
+    oxygenLevel: Optional[Union[int, float]] = None
+    temperature: Optional[Union[int, float]] = None
+    respiratoryRate: Optional[Union[int, float]] = None
+    bloodPressure: Optional[str] = Field(default=None, pattern=r"^\d{2,3}/\d{2,3}$")
+    timestamp: Optional[str] = Field(default=None, max_length=40)
+    # Raw device report; bounded by the request body limit
+    details: Optional[Dict[str, Any]] = None
+
+    @field_validator("heartRate", "oxygenLevel", "temperature", "respiratoryRate")
+    @classmethod
+    def check_range(cls, value, info):
+        low, high, message = VITAL_RANGES[info.field_name]
+        if value is not None and (value < low or value > high):
+            raise ValueError(message)
+        return value
+
+
+class BookAppointmentRequest(RequestModel):
+    doctor_id: str = Field(min_length=1, max_length=64)
+    date: str = Field(pattern=r"^\d{4}-\d{2}-\d{2}$")
+    time: str = Field(pattern=r"^\d{2}:\d{2}$")
+    reason: str = Field(min_length=1, max_length=1000)
+
+
+class HealthAssessmentRequest(RequestModel):
+    medicalHistory: Optional[MedicalHistoryRequest] = None
+    vitalSigns: Optional[VitalSignsRequest] = None
+    documentAnalysis: Optional[Dict[str, Any]] = None
+    aiConsultation: Optional[Dict[str, Any]] = None
+
+
+def validation_detail(exc: ValidationError) -> str:
+    """Flatten validation errors into the single-string ``detail`` clients expect."""
+    messages = []
+    for error in exc.errors(include_url=False):
+        message = error["msg"].removeprefix("Value error, ")
+        field = ".".join(str(part) for part in error["loc"])
+        messages.append(f"{field}: {message}" if field else message)
+    return "; ".join(messages)
+
+
+def parse_model(model: Type[ModelT], raw: Union[str, bytes], max_bytes: int = MAX_JSON_BODY) -> ModelT:
+    """Validate a raw JSON document against ``model``, raising HTTP errors."""
+    if len(raw) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Request body larger than {max_bytes} bytes")
+    try:
+        return model.model_validate_json(raw)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=validation_detail(e))
+
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    """Read a request body, failing with 413 as soon as it exceeds ``max_bytes``."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Request body larger than {max_bytes} bytes")
+
+    # Stop reading as soon as an undeclared body goes over the limit
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Request body larger than {max_bytes} bytes")
+    return bytes(body)
+
+
+def json_body(model: Type[ModelT], max_bytes: int = MAX_JSON_BODY):
+    """Dependency that reads, size-checks and validates a JSON request body."""
+
+    async def dependency(request: Request) -> ModelT:
+        return parse_model(model, await read_body(request, max_bytes), max_bytes)
+
+    return dependency
@@ -0,0 +1,58 @@
+"""
+JSON serialization for API responses.
+
+MongoDB documents, NumPy arrays and datetimes are encoded by orjson in a
+single pass, without copying or mutating the source documents first.
+Returning a ``MongoJSONResponse`` from a handler also skips FastAPI's own
+``jsonable_encoder`` walk over the payload.
+"""
+from decimal import Decimal
+from typing import Any
+
+import numpy as np
+import orjson
+from bson import ObjectId, Decimal128
+from fastapi.responses import JSONResponse
+
+# Naive datetimes are written as-is, matching datetime.isoformat()
+OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj: Any):
+    """Encode the types orjson does not handle natively."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_default, option=OPTIONS)
+
+
+def to_jsonable(obj: Any) -> Any:
+    """
+    Return a plain JSON-compatible copy of ``obj``.
+
+    For values that must stay Python objects (e.g. the current user passed
+    to handlers); responses should use ``MongoJSONResponse`` directly.
+    """
+    if obj is None:
+        return None
+    return orjson.loads(dumps(obj))
+
+
+class MongoJSONResponse(JSONResponse):
+    """JSON response that serializes Mongo documents with orjson."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
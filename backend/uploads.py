@@ -0,0 +1,175 @@
+"""
+Bounded-memory upload ingestion.
+
+Two layers keep oversized uploads cheap to refuse. ``UploadSizeLimitMiddleware``
+sits in front of the upload routes: a declared Content-Length over the limit
+is refused before any of the body is read, and a chunked body is cut off with
+413 as soon as it crosses the limit, rather than after the multipart parser
+has buffered all of it. ``ingest_upload`` then reads the parsed file in fixed
+chunks, enforcing the limit and computing SHA-256 on the way, into a temporary
+file that stays in memory while small and spills to disk above a threshold.
+Handlers must close the ``IngestedUpload`` when done, with ``with`` or
+``finally``.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Iterable, Iterator, Optional
+
+from fastapi import HTTPException, UploadFile
+
+logger = logging.getLogger("hospital_ai")
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Ingested uploads larger than this are kept on disk instead of in memory
+SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
+
+# Multipart framing and form fields allowed on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+UPLOAD_PATHS = {
+    "/api/register",
+    "/api/verify-face",
+    "/api/register-face",
+    "/api/upload-aadhaar",
+    "/api/analyze-blood-report",
+    "/api/analyze-xray"
+}
+
+
+class IngestedUpload:
+    """A fully received upload: metadata, SHA-256 and a spooled copy of the bytes."""
+
+    def __init__(self, filename: str, content_type: str, size: int, sha256: str, file):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+        self.sha256 = sha256
+        self.file = file
+
+    def read(self) -> bytes:
+        """The whole upload in memory; prefer ``open`` or ``iter_chunks`` for large files."""
+        self.file.seek(0)
+        return self.file.read()
+
+    def open(self):
+        """The spooled file rewound to the start, for readers that accept file objects."""
+        self.file.seek(0)
+        return self.file
+
+    def iter_chunks(self, chunk_size: int = UPLOAD_CHUNK_SIZE) -> Iterator[bytes]:
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def ingest_upload(
+    upload: UploadFile,
+    max_size: int,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+    spool_threshold: int = SPOOL_THRESHOLD
+) -> IngestedUpload:
+    """Stream an upload into a spooled file, hashing it and failing fast with 413 when too large."""
+    if upload.size is not None and upload.size > max_size:
+        raise HTTPException(status_code=413, detail="File size too large")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise HTTPException(status_code=413, detail="File size too large")
+            digest.update(chunk)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    finally:
+        # The parser's own copy is no longer needed
+        await upload.close()
+
+    if size == 0:
+        spool.close()
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    return IngestedUpload(upload.filename or "", upload.content_type or "", size, digest.hexdigest(), spool)
+
+
+class UploadSizeLimitMiddleware:
+    """ASGI middleware refusing upload bodies over ``max_body`` bytes as early as possible."""
+
+    def __init__(self, app, max_body: int, paths: Iterable[str] = UPLOAD_PATHS):
+        self.app = app
+        self.max_body = max_body
+        self.paths = set(paths)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "File size too large"}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode("ascii"))]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        declared: Optional[bytes] = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_body:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    exceeded = True
+                    logger.warning(f"Upload to {scope['path']} exceeded {self.max_body} bytes; aborting")
+                    # Ends the parser's read loop; the app's error response is replaced below
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal rejected
+            if exceeded:
+                if not rejected and message["type"] == "http.response.start":
+                    rejected = True
+                    await self._reject(send)
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not rejected:
+            await self._reject(send)
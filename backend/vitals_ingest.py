@@ -0,0 +1,191 @@
+"""
+Batch validation for continuous vital sign streams.
+
+Monitors send many timestamped readings per request. Range checks are done
+column-wise with NumPy so validating a batch costs a handful of vector
+operations instead of a Python branch per field per reading.
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("hospital_ai")
+
+# Accepted physiological ranges, shared with the single-reading endpoint
+VITAL_RANGES = {
+    "heartRate": (30, 220, "Heart rate must be between 30 and 220 bpm"),
+    "oxygenLevel": (70, 100, "Oxygen level must be between 70 and 100%"),
+    "temperature": (35, 42, "Temperature must be between 35 and 42°C"),
+    "respiratoryRate": (8, 40, "Respiratory rate must be between 8 and 40 breaths per minute")
+}
+
+MAX_BATCH_SIZE = 5000
+
+# Bytes read from a batch request before it is refused with 413
+MAX_BATCH_BODY = int(os.getenv("MAX_VITALS_BATCH_BODY", str(2 * 1024 * 1024)))
+
+# Same format the single-reading endpoint accepts, e.g. "120/80"
+BLOOD_PRESSURE_PATTERN = re.compile(r"^\d{2,3}/\d{2,3}$")
+
+# Readings stamped further than this into the future are rejected
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+# Maximum number of rejection details echoed back to the client
+MAX_REJECTION_DETAILS = 50
+
+
+class BatchFormatError(ValueError):
+    """Raised when a batch body cannot be parsed into readings."""
+
+
+def parse_batch_body(body: bytes, content_type: Optional[str]) -> List[Dict[str, Any]]:
+    """Parse a JSON array, ``{"readings": [...]}`` object or NDJSON body."""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise BatchFormatError("Body must be UTF-8 encoded")
+
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        readings = []
+        for line_no, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                readings.append(json.loads(line))
+            except json.JSONDecodeError:
+                raise BatchFormatError(f"Invalid JSON on line {line_no}")
+    else:
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            raise BatchFormatError("Invalid JSON body")
+        readings = data.get("readings") if isinstance(data, dict) else data
+
+    if not isinstance(readings, list):
+        raise BatchFormatError("Expected a list of readings")
+    if len(readings) > MAX_BATCH_SIZE:
+        raise BatchFormatError(f"Batch cannot contain more than {MAX_BATCH_SIZE} readings")
+    return readings
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Parse an ISO 8601 string or epoch seconds/milliseconds into naive UTC."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        # Treat large values as milliseconds
+        seconds = value / 1000 if value > 1e11 else value
+        try:
+            return datetime.utcfromtimestamp(seconds)
+        except (OverflowError, OSError, ValueError):
+            # Out of datetime's range, or NaN
+            return None
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    return None
+
+
+def _column(readings: List[Dict[str, Any]], field: str) -> np.ndarray:
+    """Extract a numeric column, using NaN for missing and inf for non-numeric."""
+    column = np.full(len(readings), np.nan, dtype=np.float64)
+    for i, reading in enumerate(readings):
+        value = reading.get(field)
+        if value is None:
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            column[i] = value
+        else:
+            column[i] = np.inf
+    return column
+
+
+def validate_batch(
+    readings: List[Dict[str, Any]],
+    now: Optional[datetime] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Split a batch into accepted documents and rejections.
+
+    Accepted readings are returned as clean dicts with ``recorded_at`` set;
+    each rejection carries the reading index and reason.
+    """
+    now = now or datetime.utcnow()
+    readings = [r if isinstance(r, dict) else None for r in readings]
+    count = len(readings)
+    valid = np.ones(count, dtype=bool)
+    reasons: Dict[int, str] = {}
+
+    # Shape and timestamp checks are per-row by nature
+    timestamps: List[Optional[datetime]] = []
+    for i, reading in enumerate(readings):
+        if reading is None:
+            valid[i] = False
+            reasons[i] = "Reading must be an object"
+            timestamps.append(None)
+            readings[i] = {}
+            continue
+        raw_ts = reading.get("recorded_at", reading.get("timestamp"))
+        ts = parse_timestamp(raw_ts) if raw_ts is not None else now
+        if ts is None:
+            valid[i] = False
+            reasons.setdefault(i, "Invalid timestamp")
+        elif ts > now + MAX_CLOCK_SKEW:
+            valid[i] = False
+            reasons.setdefault(i, "Timestamp is in the future")
+        timestamps.append(ts)
+
+    # Vectorized range checks, one pass per metric
+    present = np.zeros(count, dtype=bool)
+    columns = {}
+    for field, (low, high, message) in VITAL_RANGES.items():
+        column = _column(readings, field)
+        columns[field] = column
+        has_value = ~np.isnan(column)
+        present |= has_value
+        out_of_range = has_value & ((column < low) | (column > high))
+        for i in np.flatnonzero(out_of_range & valid):
+            reasons[int(i)] = message
+        valid &= ~out_of_range
+
+    has_bp = np.array([r.get("bloodPressure") is not None for r in readings], dtype=bool)
+    for i in np.flatnonzero(has_bp):
+        value = readings[i]["bloodPressure"]
+        if not isinstance(value, str) or not BLOOD_PRESSURE_PATTERN.match(value):
+            if valid[i]:
+                reasons[int(i)] = "Blood pressure must be in systolic/diastolic format, e.g. 120/80"
+            valid[i] = False
+    empty = ~(present | has_bp)
+    for i in np.flatnonzero(empty & valid):
+        reasons[int(i)] = "Reading contains no vital signs"
+    valid &= ~empty
+
+    accepted = []
+    for i in np.flatnonzero(valid):
+        i = int(i)
+        doc = {field: readings[i][field] for field in VITAL_RANGES if not np.isnan(columns[field][i])}
+        if has_bp[i]:
+            doc["bloodPressure"] = readings[i]["bloodPressure"]
+        if readings[i].get("device_id") is not None:
+            doc["device_id"] = str(readings[i]["device_id"])[:64]
+        doc["recorded_at"] = timestamps[i]
+        accepted.append(doc)
+
+    rejected = [
+        {"index": i, "reason": reasons[i]}
+        for i in sorted(reasons)
+    ]
+    return accepted, rejected
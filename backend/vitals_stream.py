@@ -0,0 +1,175 @@
+"""
+Live vital sign streaming over WebSockets.
+
+Monitors publish readings for a patient and care team dashboards subscribe
+to receive fan-out updates. Each patient keeps a bounded ring buffer used
+for rolling-window aggregates, and accepted readings are persisted in
+periodic batches instead of one write per reading.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, Any, List, Optional, Set
+
+from vitals_ingest import validate_batch
+
+logger = logging.getLogger("hospital_ai")
+
+# Rolling aggregate window in seconds
+WINDOW_SECONDS = 10
+
+# Readings retained per patient (ring buffer size)
+BUFFER_SIZE = 600
+
+# Upper bound on readings waiting to be persisted per patient
+MAX_PENDING = 5000
+
+# Seconds between persistence flushes
+FLUSH_INTERVAL = 5
+
+# Streams with no subscribers or pending data are dropped after this long
+IDLE_TIMEOUT = 300
+
+
+class PatientStream:
+    """Per-patient buffers and subscriber set."""
+
+    def __init__(self, user_id, buffer_size: int = BUFFER_SIZE):
+        self.user_id = user_id
+        self.readings = deque(maxlen=buffer_size)
+        self.pending = deque(maxlen=MAX_PENDING)
+        self.subscribers: Set[Any] = set()
+        self.last_activity = time.monotonic()
+
+
+def window_aggregates(readings, now: float, window_seconds: int = WINDOW_SECONDS) -> Dict[str, Any]:
+    """Compute rolling aggregates over readings newer than the window."""
+    heart_rates, oxygen, temperatures, respiratory = [], [], [], []
+    # The buffer is time-ordered, so walk backwards until the window ends
+    for ts, reading in reversed(readings):
+        if now - ts > window_seconds:
+            break
+        if "heartRate" in reading:
+            heart_rates.append(reading["heartRate"])
+        if "oxygenLevel" in reading:
+            oxygen.append(reading["oxygenLevel"])
+        if "temperature" in reading:
+            temperatures.append(reading["temperature"])
+        if "respiratoryRate" in reading:
+            respiratory.append(reading["respiratoryRate"])
+
+    return {
+        "window_seconds": window_seconds,
+        "heartRateMean": round(sum(heart_rates) / len(heart_rates), 1) if heart_rates else None,
+        "heartRateMax": max(heart_rates) if heart_rates else None,
+        "oxygenLevelMin": min(oxygen) if oxygen else None,
+        "temperatureMax": max(temperatures) if temperatures else None,
+        "respiratoryRateMean": round(sum(respiratory) / len(respiratory), 1) if respiratory else None,
+        "samples": max(len(heart_rates), len(oxygen), len(temperatures), len(respiratory))
+    }
+
+
+class VitalsStreamHub:
+    """Routes published readings to subscribers and batches persistence."""
+
+    def __init__(
+        self,
+        persist: Callable[[Any, str, List[Dict[str, Any]]], None],
+        window_seconds: int = WINDOW_SECONDS,
+        buffer_size: int = BUFFER_SIZE,
+        flush_interval: float = FLUSH_INTERVAL
+    ):
+        self.persist = persist
+        self.window_seconds = window_seconds
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.streams: Dict[str, PatientStream] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _stream(self, user_email: str, user_id=None) -> PatientStream:
+        stream = self.streams.get(user_email)
+        if stream is None:
+            stream = PatientStream(user_id, self.buffer_size)
+            self.streams[user_email] = stream
+        elif user_id is not None and stream.user_id is None:
+            stream.user_id = user_id
+        stream.last_activity = time.monotonic()
+        return stream
+
+    async def publish(self, user_email: str, user_id, reading: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate a reading, update aggregates and fan out to subscribers."""
+        accepted, rejected = validate_batch([reading])
+        if not accepted:
+            return {"type": "rejected", "reason": rejected[0]["reason"] if rejected else "Invalid reading"}
+
+        doc = accepted[0]
+        stream = self._stream(user_email, user_id)
+        now = time.monotonic()
+        stream.readings.append((now, doc))
+        stream.pending.append(doc)
+
+        message = {
+            "type": "reading",
+            "user_email": user_email,
+            "reading": {**doc, "recorded_at": doc["recorded_at"].isoformat()},
+            "aggregates": window_aggregates(stream.readings, now, self.window_seconds)
+        }
+        await self._broadcast(stream, message)
+        return {"type": "ack", "aggregates": message["aggregates"]}
+
+    async def _broadcast(self, stream: PatientStream, message: Dict[str, Any]):
+        if not stream.subscribers:
+            return
+        subscribers = list(stream.subscribers)
+        results = await asyncio.gather(
+            *(ws.send_json(message) for ws in subscribers),
+            return_exceptions=True
+        )
+        # Drop subscribers whose sockets have gone away
+        for ws, result in zip(subscribers, results):
+            if isinstance(result, Exception):
+                stream.subscribers.discard(ws)
+
+    def subscribe(self, user_email: str, websocket) -> Dict[str, Any]:
+        """Register a subscriber and return the current aggregate snapshot."""
+        stream = self._stream(user_email)
+        stream.subscribers.add(websocket)
+        return {
+            "type": "snapshot",
+            "user_email": user_email,
+            "aggregates": window_aggregates(stream.readings, time.monotonic(), self.window_seconds)
+        }
+
+    def unsubscribe(self, user_email: str, websocket):
+        stream = self.streams.get(user_email)
+        if stream is not None:
+            stream.subscribers.discard(websocket)
+
+    async def flush(self):
+        """Persist pending readings for every patient in one batch each."""
+        for user_email, stream in list(self.streams.items()):
+            if stream.pending:
+                batch = list(stream.pending)
+                stream.pending.clear()
+                try:
+                    await asyncio.to_thread(self.persist, stream.user_id, user_email, batch)
+                except Exception as e:
+                    logger.error(f"Error persisting streamed vitals for {user_email}: {e}")
+            elif not stream.subscribers and time.monotonic() - stream.last_activity > IDLE_TIMEOUT:
+                del self.streams[user_email]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
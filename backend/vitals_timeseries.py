@@ -0,0 +1,287 @@
+"""
+Time-series storage and downsampled queries for vital signs.
+
+Readings are stored in a MongoDB time-series collection keyed by
+``user_email`` (metaField) and ``recorded_at`` (timeField). When the server
+does not support time-series collections a plain collection with a compound
+index is used instead. Chart queries are downsampled server-side so payloads
+stay bounded regardless of the requested time range.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+from pymongo import ASCENDING, errors
+
+logger = logging.getLogger("hospital_ai")
+
+TIMESERIES_COLLECTION = "vital_signs_timeseries"
+
+# Numeric series stored per reading
+METRICS = ["heartRate", "oxygenLevel", "temperature", "respiratoryRate", "systolic", "diastolic"]
+
+# Downsampling windows in seconds, finest first. All are aligned to the Unix
+# epoch in UTC so NumPy buckets match Mongo's $dateTrunc buckets.
+WINDOWS = {
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+# Upper bound on points returned by a single series query
+MAX_POINTS = 500
+
+# Longest range a query may span: MAX_POINTS of the coarsest window
+MAX_RANGE = timedelta(seconds=MAX_POINTS * max(WINDOWS.values()))
+
+# Returned when percentiles are not requested, on servers that compute them
+# in the aggregation; elsewhere they would need the raw series
+DEFAULT_PERCENTILES = [50, 95]
+
+
+def parse_blood_pressure(value) -> Tuple[Optional[int], Optional[int]]:
+    """Split a "120/80" string into systolic and diastolic integers."""
+    if not value or not isinstance(value, str) or "/" not in value:
+        return None, None
+    try:
+        systolic, diastolic = map(int, value.split("/"))
+        return systolic, diastolic
+    except ValueError:
+        return None, None
+
+
+def to_point(user_email: str, vitals: Dict[str, Any], recorded_at: Optional[datetime] = None) -> Dict[str, Any]:
+    """Build a compact time-series document from a vital signs payload."""
+    point = {
+        "user_email": user_email,
+        "recorded_at": recorded_at or vitals.get("recorded_at") or datetime.utcnow()
+    }
+    for metric in ["heartRate", "oxygenLevel", "temperature", "respiratoryRate"]:
+        value = vitals.get(metric)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            point[metric] = float(value)
+
+    systolic, diastolic = parse_blood_pressure(vitals.get("bloodPressure"))
+    if systolic is not None:
+        point["systolic"] = float(systolic)
+        point["diastolic"] = float(diastolic)
+    return point
+
+
+def window_ceiling(moment: datetime, window: str) -> datetime:
+    """The first window boundary at or after ``moment``."""
+    seconds = WINDOWS[window]
+    elapsed = (moment - EPOCH).total_seconds()
+    return EPOCH + timedelta(seconds=-(-elapsed // seconds) * seconds)
+
+
+def choose_window(start: datetime, end: datetime, requested: str) -> str:
+    """Return the requested window, coarsened until the range fits MAX_POINTS."""
+    if end - start > MAX_RANGE:
+        raise ValueError(f"Range cannot exceed {MAX_RANGE.days} days")
+    span = max((end - start).total_seconds(), 1)
+    names = list(WINDOWS.keys())
+    index = names.index(requested)
+    while index < len(names) - 1 and span / WINDOWS[names[index]] > MAX_POINTS:
+        index += 1
+    return names[index]
+
+
+def downsample_arrays(
+    times: np.ndarray,
+    values: np.ndarray,
+    window_seconds: int,
+    percentiles: List[float]
+) -> List[Dict[str, Any]]:
+    """Aggregate raw (time, value) arrays into fixed windows with NumPy."""
+    if len(values) == 0:
+        return []
+
+    buckets = times.astype("datetime64[s]").astype(np.int64) // window_seconds
+
+    # Sort once by bucket, then split into contiguous groups
+    order = np.argsort(buckets, kind="stable")
+    buckets = buckets[order]
+    values = values[order]
+    unique_buckets, starts = np.unique(buckets, return_index=True)
+    groups = np.split(values, starts[1:])
+
+    points = []
+    for bucket, group in zip(unique_buckets, groups):
+        point = {
+            "window_start": EPOCH + timedelta(seconds=int(bucket) * window_seconds),
+            "min": float(group.min()),
+            "max": float(group.max()),
+            "mean": round(float(group.mean()), 2),
+            "count": int(group.size)
+        }
+        if percentiles:
+            for p, v in zip(percentiles, np.percentile(group, percentiles)):
+                point[f"p{int(p)}"] = round(float(v), 2)
+        points.append(point)
+    return points
+
+
+class VitalSignsTimeSeries:
+    """Vital sign readings stored for range queries and chart downsampling."""
+
+    def __init__(self, db, name: str = TIMESERIES_COLLECTION):
+        self.db = db
+        self.name = name
+        self.is_timeseries = False
+        self.supports_percentile = False
+        self.supports_date_trunc = False
+        self.collection = self._detect_collection()
+
+    def _detect_collection(self):
+        try:
+            version = self.db.client.server_info().get("versionArray", [0])
+        except Exception:
+            version = [0]
+        self.supports_date_trunc = version >= [5, 0]
+        self.supports_percentile = version >= [7, 0]
+
+        # Collection creation lives in migrations.py; only detect its type here
+        try:
+            options = self.db[self.name].options()
+            self.is_timeseries = "timeseries" in options
+        except errors.PyMongoError as e:
+            logger.warning(f"Could not inspect {self.name}, assuming plain collection: {e}")
+        return self.db[self.name]
+
+    def insert(self, user_email: str, vitals: Dict[str, Any], recorded_at: Optional[datetime] = None):
+        """Store one reading."""
+        try:
+            self.collection.insert_one(to_point(user_email, vitals, recorded_at))
+        except Exception as e:
+            logger.error(f"Error writing vital signs time-series point: {e}")
+
+    def insert_many(self, user_email: str, readings: List[Dict[str, Any]]):
+        """Store a batch of readings that already carry ``recorded_at``."""
+        if not readings:
+            return
+        try:
+            self.collection.insert_many(
+                [to_point(user_email, r) for r in readings],
+                ordered=False
+            )
+        except Exception as e:
+            logger.error(f"Error writing vital signs time-series batch: {e}")
+
+    def raw_series(
+        self,
+        user_email: str,
+        metric: str,
+        start: datetime,
+        end: datetime
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Load one metric for a user as (times, values) arrays."""
+        cursor = self.collection.find(
+            {
+                "user_email": user_email,
+                "recorded_at": {"$gte": start, "$lt": end},
+                metric: {"$exists": True}
+            },
+            projection={"_id": 0, "recorded_at": 1, metric: 1},
+            sort=[("recorded_at", ASCENDING)]
+        )
+        times, values = [], []
+        for doc in cursor:
+            times.append(doc["recorded_at"])
+            values.append(doc[metric])
+        return np.array(times, dtype="datetime64[ms]"), np.array(values, dtype=np.float64)
+
+    def downsample(
+        self,
+        user_email: str,
+        metric: str,
+        start: datetime,
+        end: datetime,
+        window: str = "hour",
+        percentiles: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
+        """Return min/max/mean/percentiles of a metric per time window."""
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        if window not in WINDOWS:
+            raise ValueError(f"Unknown window: {window}")
+        if percentiles is None:
+            needs_raw = self.supports_date_trunc and not self.supports_percentile
+            percentiles = [] if needs_raw else DEFAULT_PERCENTILES
+
+        window = choose_window(start, end, window)
+        window_seconds = WINDOWS[window]
+
+        if self.supports_date_trunc:
+            points = self._downsample_aggregate(user_email, metric, start, end, window, percentiles)
+        else:
+            times, values = self.raw_series(user_email, metric, start, end)
+            points = downsample_arrays(times, values, window_seconds, percentiles)
+
+        return {
+            "metric": metric,
+            "window": window,
+            "start": start,
+            "end": end,
+            "points": points
+        }
+
+    def _downsample_aggregate(
+        self,
+        user_email: str,
+        metric: str,
+        start: datetime,
+        end: datetime,
+        window: str,
+        percentiles: List[float]
+    ) -> List[Dict[str, Any]]:
+        group = {
+            "_id": {"$dateTrunc": {"date": "$recorded_at", "unit": window}},
+            "min": {"$min": f"${metric}"},
+            "max": {"$max": f"${metric}"},
+            "mean": {"$avg": f"${metric}"},
+            "count": {"$sum": 1}
+        }
+        if percentiles and self.supports_percentile:
+            group["percentiles"] = {"$percentile": {
+                "input": f"${metric}",
+                "p": [p / 100 for p in percentiles],
+                "method": "approximate"
+            }}
+
+        pipeline = [
+            {"$match": {
+                "user_email": user_email,
+                "recorded_at": {"$gte": start, "$lt": end},
+                metric: {"$exists": True}
+            }},
+            {"$group": group},
+            {"$sort": {"_id": 1}}
+        ]
+
+        points = []
+        for row in self.collection.aggregate(pipeline):
+            point = {
+                "window_start": row["_id"],
+                "min": row["min"],
+                "max": row["max"],
+                "mean": round(row["mean"], 2) if row["mean"] is not None else None,
+                "count": row["count"]
+            }
+            for p, v in zip(percentiles, row.get("percentiles") or []):
+                point[f"p{int(p)}"] = round(v, 2)
+            points.append(point)
+
+        # Servers without $percentile get exact percentiles from NumPy
+        if percentiles and not self.supports_percentile and points:
+            times, values = self.raw_series(user_email, metric, start, end)
+            exact = downsample_arrays(times, values, WINDOWS[window], percentiles)
+            by_window = {p["window_start"]: p for p in exact}
+            for point in points:
+                match = by_window.get(point["window_start"])
+                for p in percentiles:
+                    point[f"p{int(p)}"] = match.get(f"p{int(p)}") if match else None
+        return points
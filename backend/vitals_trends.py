@@ -0,0 +1,230 @@
+"""
+Trend and anomaly analysis over a user's vital sign history.
+
+Each user's series are held as NumPy arrays in a bounded in-process cache.
+A request only fetches readings newer than the cached ones, appends them and
+advances the EWMA state over the new points, so repeat analyses of a long
+history cost one small query plus a few vector operations. Writers report
+each stored batch through ``record_write``; a reading older than what is
+cached (a backdated or late-arriving one) drops the user's cached state so
+the next analysis reloads it.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Dict, Any, List
+
+import numpy as np
+from pymongo import ASCENDING, DESCENDING
+
+from vitals_timeseries import METRICS, EPOCH
+
+logger = logging.getLogger("hospital_ai")
+
+# EWMA smoothing factor and the deviation (in EW standard deviations) flagged
+EWMA_ALPHA = 0.1
+EWMA_THRESHOLD = 3.0
+
+# Points needed before EWMA deviations are trusted
+EWMA_WARMUP = 10
+
+ZSCORE_THRESHOLD = 3.0
+ROLLING_WINDOW = 20
+
+# Points used for the recent slope estimate
+SLOPE_POINTS = 200
+
+# Per-user history and cache bounds
+MAX_HISTORY = 20000
+MAX_CACHED_USERS = 256
+
+# Anomalies returned per metric
+MAX_ANOMALIES = 50
+
+
+class MetricSeries:
+    """Arrays and running EWMA state for one metric of one user."""
+
+    def __init__(self):
+        self.times = np.empty(0, dtype=np.float64)
+        self.values = np.empty(0, dtype=np.float64)
+        self.ewma = np.empty(0, dtype=np.float64)
+        self.ewma_flags = np.empty(0, dtype=bool)
+        self.mean = None
+        self.var = 0.0
+
+    def extend(self, times: np.ndarray, values: np.ndarray):
+        """Append new points and advance EWMA state over them only."""
+        if values.size == 0:
+            return
+        ewma = np.empty(values.size, dtype=np.float64)
+        flags = np.zeros(values.size, dtype=bool)
+        seen = self.values.size
+        mean, var = self.mean, self.var
+        for i, x in enumerate(values):
+            if mean is None:
+                mean = x
+            else:
+                diff = x - mean
+                if seen + i >= EWMA_WARMUP and var > 0:
+                    flags[i] = abs(diff) > EWMA_THRESHOLD * np.sqrt(var)
+                mean = mean + EWMA_ALPHA * diff
+                var = (1 - EWMA_ALPHA) * (var + EWMA_ALPHA * diff * diff)
+            ewma[i] = mean
+        self.mean, self.var = mean, var
+
+        self.times = np.concatenate([self.times, times])[-MAX_HISTORY:]
+        self.values = np.concatenate([self.values, values])[-MAX_HISTORY:]
+        self.ewma = np.concatenate([self.ewma, ewma])[-MAX_HISTORY:]
+        self.ewma_flags = np.concatenate([self.ewma_flags, flags])[-MAX_HISTORY:]
+
+    def analyze(self) -> Dict[str, Any]:
+        """Summarize the series: rolling mean, slope, z-scores and anomalies."""
+        n = self.values.size
+        if n == 0:
+            return {"count": 0}
+
+        values = self.values
+        mean = float(values.mean())
+        std = float(values.std())
+        zscores = (values - mean) / std if std > 0 else np.zeros(n)
+
+        # Rolling mean over the trailing window via cumulative sums
+        window = min(ROLLING_WINDOW, n)
+        cumsum = np.cumsum(np.insert(values, 0, 0.0))
+        rolling = (cumsum[window:] - cumsum[:-window]) / window
+
+        # Least-squares slope over recent points, in units per day
+        slope_per_day = None
+        recent_t = self.times[-SLOPE_POINTS:]
+        recent_v = values[-SLOPE_POINTS:]
+        if recent_t.size >= 2 and np.ptp(recent_t) > 0:
+            t = recent_t - recent_t.mean()
+            slope = float(np.dot(t, recent_v - recent_v.mean()) / np.dot(t, t))
+            slope_per_day = round(slope * 86400, 4)
+
+        anomalies = np.flatnonzero((np.abs(zscores) > ZSCORE_THRESHOLD) | self.ewma_flags)
+        recent_anomalies = [
+            {
+                "recorded_at": datetime.utcfromtimestamp(float(self.times[i])).isoformat(),
+                "value": float(values[i]),
+                "zscore": round(float(zscores[i]), 2),
+                "ewma": round(float(self.ewma[i]), 2),
+                "ewma_flag": bool(self.ewma_flags[i])
+            }
+            for i in anomalies[-MAX_ANOMALIES:]
+        ]
+
+        return {
+            "count": int(n),
+            "latest": float(values[-1]),
+            "latest_at": datetime.utcfromtimestamp(float(self.times[-1])).isoformat(),
+            "mean": round(mean, 2),
+            "std": round(std, 2),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "rolling_mean": round(float(rolling[-1]), 2),
+            "rolling_window": int(window),
+            "slope_per_day": slope_per_day,
+            "latest_zscore": round(float(zscores[-1]), 2),
+            "ewma": round(float(self.ewma[-1]), 2),
+            "anomaly_count": int(anomalies.size),
+            "anomalies": recent_anomalies
+        }
+
+
+class UserTrendState:
+    def __init__(self):
+        self.last_recorded_at: Optional[datetime] = None
+        self.metrics: Dict[str, MetricSeries] = {metric: MetricSeries() for metric in METRICS}
+        self.result: Optional[Dict[str, Any]] = None
+        self.lock = threading.Lock()
+
+
+class VitalTrendAnalyzer:
+    """Per-user cached trend analysis, refreshed incrementally from storage."""
+
+    def __init__(self, collection, max_users: int = MAX_CACHED_USERS):
+        self.collection = collection
+        self.max_users = max_users
+        self._states: "OrderedDict[str, UserTrendState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _state(self, user_email: str) -> UserTrendState:
+        with self._lock:
+            state = self._states.get(user_email)
+            if state is None:
+                state = UserTrendState()
+                self._states[user_email] = state
+                while len(self._states) > self.max_users:
+                    self._states.popitem(last=False)
+            else:
+                self._states.move_to_end(user_email)
+            return state
+
+    def invalidate(self, user_email: str):
+        with self._lock:
+            self._states.pop(user_email, None)
+
+    def record_write(self, user_email: str, recorded_at: List[datetime]):
+        """Note stored readings; invalidates the cache if any would not be fetched incrementally."""
+        if not recorded_at:
+            return
+        with self._lock:
+            state = self._states.get(user_email)
+            if state is None:
+                return
+            # Incremental fetches only see readings after the last one cached
+            if state.last_recorded_at is not None and min(recorded_at) <= state.last_recorded_at:
+                self._states.pop(user_email, None)
+
+    def _fetch_new(self, user_email: str, since: Optional[datetime]) -> List[Dict[str, Any]]:
+        query = {"user_email": user_email}
+        projection = {"_id": 0, "recorded_at": 1}
+        projection.update({metric: 1 for metric in METRICS})
+        if since is None:
+            # Cold start: load the most recent MAX_HISTORY readings
+            docs = list(self.collection.find(
+                query,
+                projection=projection,
+                sort=[("recorded_at", DESCENDING)],
+                limit=MAX_HISTORY
+            ))
+            docs.reverse()
+            return docs
+        query["recorded_at"] = {"$gt": since}
+        return list(self.collection.find(
+            query,
+            projection=projection,
+            sort=[("recorded_at", ASCENDING)],
+            limit=MAX_HISTORY
+        ))
+
+    def analyze(self, user_email: str) -> Dict[str, Any]:
+        """Return trend analysis for all metrics, fetching only new readings."""
+        state = self._state(user_email)
+        with state.lock:
+            docs = self._fetch_new(user_email, state.last_recorded_at)
+            if docs or state.result is None:
+                if docs:
+                    times = np.array(
+                        [(doc["recorded_at"] - EPOCH).total_seconds() for doc in docs],
+                        dtype=np.float64
+                    )
+                    for metric, series in state.metrics.items():
+                        mask = np.array([metric in doc for doc in docs], dtype=bool)
+                        if mask.any():
+                            values = np.array(
+                                [doc[metric] for doc in docs if metric in doc],
+                                dtype=np.float64
+                            )
+                            series.extend(times[mask], values)
+                    state.last_recorded_at = docs[-1]["recorded_at"]
+
+                state.result = {
+                    "metrics": {metric: series.analyze() for metric, series in state.metrics.items()},
+                    "new_readings": len(docs),
+                    "analyzed_at": datetime.utcnow().isoformat()
+                }
+            return state.result
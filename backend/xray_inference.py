@@ -0,0 +1,226 @@
+"""
+Chest X-ray decoding, classification, heatmaps and report text.
+
+Models are loaded once per process, on first use, and reused by later
+requests instead of being loaded from disk on every call. Everything here
+is synchronous and CPU or GPU bound; the API runs it on a bounded thread
+pool so the event loop keeps serving other requests meanwhile (torch and
+OpenCV release the GIL while they compute).
+
+Grad-CAM attaches hooks to the model, so one request at a time uses the
+classifier; torch still parallelises each forward pass across cores.
+"""
+import logging
+import os
+import threading
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, List, Optional, Union
+
+logger = logging.getLogger("hospital_ai")
+
+REPORT_MODEL_NAME = "microsoft/BiomedVLP-CXR-BERT-general"
+
+CHEST_CLASSES = [
+    "Atelectasis", "Cardiomegaly", "Consolidation", "Edema",
+    "Effusion", "Emphysema", "Fibrosis", "Hernia", "Infiltration",
+    "Mass", "Nodule", "Pleural_Thickening", "Pneumonia", "Pneumothorax"
+]
+
+DENSENET_CLASSES = [
+    "Atelectasis", "Consolidation", "Infiltration", "Pneumothorax",
+    "Edema", "Emphysema", "Fibrosis", "Effusion", "Pneumonia",
+    "Pleural_Thickening", "Cardiomegaly", "Nodule", "Mass", "Hernia"
+]
+
+PROMPT = "tThis is a chest X-ray image for analysis"
+
+_load_lock = threading.Lock()
+_inference_lock = threading.Lock()
+
+# Loaded on first use: (model, processor, config, device)
+_classifier = None
+
+# (processor, model), or False once loading has failed
+_report_generator = None
+
+
+class ModelUnavailableError(Exception):
+    """Raised when no classifier could be loaded."""
+
+
+class InferenceError(Exception):
+    """Raised when the classifier fails on an image."""
+
+
+def _device():
+    import torch
+
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def _model_configs() -> List[Dict[str, Any]]:
+    import torchvision
+
+    return [
+        {
+            "type": "huggingface",
+            "name": "microsoft/BiomedVLP-CXR-BERT-general",
+            "fine_tuned": True,
+            "classes": CHEST_CLASSES,
+            "weights": None
+        },
+        {
+            "type": "torchvision",
+            "name": "densenet121",
+            "weights": torchvision.models.DenseNet121_Weights.DEFAULT,
+            "classes": DENSENET_CLASSES
+        }
+    ]
+
+
+def load_classifier():
+    """The first classifier that loads, cached for the life of the process."""
+    global _classifier
+    if _classifier is not None:
+        return _classifier
+    with _load_lock:
+        if _classifier is not None:
+            return _classifier
+
+        import torchvision
+        from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+        device = _device()
+        logger.info(f"Loading X-ray classifier on {device}")
+        for cfg in _model_configs():
+            try:
+                if cfg["type"] == "huggingface":
+                    processor = AutoImageProcessor.from_pretrained(cfg["name"])
+                    model = AutoModelForImageClassification.from_pretrained(cfg["name"]).to(device)
+                else:
+                    processor = cfg["weights"].transforms()
+                    model = getattr(torchvision.models, cfg["name"])(weights=cfg["weights"]).to(device)
+                model.eval()
+                _classifier = (model, processor, cfg, device)
+                return _classifier
+            except Exception as e:
+                logger.warning(f"Model {cfg['name']} failed: {str(e)}")
+        raise ModelUnavailableError("All models failed to load")
+
+
+def load_report_generator():
+    """The report text model, or None; a failed load is not retried."""
+    global _report_generator
+    if _report_generator is None:
+        with _load_lock:
+            if _report_generator is None:
+                try:
+                    from transformers import AutoProcessor, BlipForConditionalGeneration
+
+                    processor = AutoProcessor.from_pretrained(REPORT_MODEL_NAME)
+                    model = BlipForConditionalGeneration.from_pretrained(REPORT_MODEL_NAME).to(_device())
+                    _report_generator = (processor, model)
+                except Exception as e:
+                    logger.warning(f"Report model failed to load: {str(e)}")
+                    _report_generator = False
+    return _report_generator or None
+
+
+def decode_xray(source: Union[bytes, BinaryIO], is_dicom: bool, processed_path: str):
+    """Decode a DICOM or JPEG/PNG upload, as bytes or a file object, to RGB and save the processed copy."""
+    import numpy as np
+    from PIL import Image
+
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+
+    if is_dicom:
+        import pydicom
+        from skimage import exposure
+
+        ds = pydicom.dcmread(source)
+        img_array = ds.pixel_array
+        if getattr(ds, "PhotometricInterpretation", "") == "MONOCHROME1":
+            img_array = np.amax(img_array) - img_array
+        img_array = exposure.rescale_intensity(img_array, out_range=(0, 255))
+        pil_image = Image.fromarray(img_array.astype(np.uint8)).convert("RGB")
+    else:
+        pil_image = Image.open(source).convert("RGB")
+
+    pil_image.save(processed_path)
+    return pil_image
+
+
+def _heatmap(model, img_tensor, pil_image, processed_path: str, analysis_dir: str) -> Optional[str]:
+    import cv2
+    import numpy as np
+    import torch
+    from pytorch_grad_cam import GradCAM
+
+    target_layer = next((module for module in model.modules() if isinstance(module, torch.nn.Conv2d)), None)
+    if not target_layer:
+        return None
+
+    cam = GradCAM(model=model, target_layers=[target_layer])
+    grayscale_cam = cam(input_tensor=img_tensor, targets=None)[0]
+
+    # Resize to original image dimensions
+    img_width, img_height = pil_image.size
+    heatmap = cv2.resize(grayscale_cam, (img_width, img_height))
+    heatmap = cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
+
+    img = cv2.imread(processed_path)
+    if img is None:
+        return None
+    superimposed_img = cv2.addWeighted(img, 0.6, heatmap, 0.4, 0)
+    heatmap_path = os.path.join(analysis_dir, "heatmap.jpg")
+    cv2.imwrite(heatmap_path, superimposed_img)
+    return heatmap_path
+
+
+def _report_text(pil_image, device) -> str:
+    generator = load_report_generator()
+    if generator is None:
+        return "Normal chest X-ray findings."
+    processor, model = generator
+    try:
+        inputs = processor(pil_image, return_tensors="pt").to(device)
+        report_ids = model.generate(**inputs, max_length=150)
+        return processor.decode(report_ids[0], skip_special_tokens=True)
+    except Exception as e:
+        logger.warning(f"Report generation failed: {str(e)}")
+        return "Normal chest X-ray findings."
+
+
+def analyze_xray_image(pil_image, processed_path: str, analysis_dir: str) -> Dict[str, Any]:
+    """Class probabilities, an optional Grad-CAM overlay and report text for one image."""
+    import torch
+
+    model, processor, cfg, device = load_classifier()
+    with _inference_lock:
+        try:
+            if cfg["type"] == "huggingface":
+                inputs = processor(pil_image, text=PROMPT, return_tensors="pt").to(device)
+                img_tensor = inputs.pixel_values
+            else:
+                img_tensor = processor(pil_image).unsqueeze(0).to(device)
+
+            with torch.no_grad():
+                outputs = model(img_tensor)
+                logits = outputs.logits if hasattr(outputs, "logits") else outputs
+                preds = torch.sigmoid(logits).cpu().numpy()[0]
+        except Exception as e:
+            raise InferenceError(str(e)) from e
+
+        heatmap_path = None
+        try:
+            heatmap_path = _heatmap(model, img_tensor, pil_image, processed_path, analysis_dir)
+        except Exception as e:
+            logger.error(f"Heatmap generation failed: {str(e)}")
+
+    return {
+        "preds": preds,
+        "model_metadata": cfg,
+        "heatmap_path": heatmap_path,
+        "report_text": _report_text(pil_image, device)
+    }